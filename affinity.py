@@ -0,0 +1,93 @@
+import glob
+import os
+from dataclasses import dataclass
+from typing import Dict, List
+
+SYS_CPU = '/sys/devices/system/cpu'
+
+def parse_cpulist(text: str) -> List[int]:
+    ret = []
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            lo, hi = part.split('-')
+            ret += range(int(lo), int(hi) + 1)
+        else:
+            ret.append(int(part))
+    return ret
+
+def format_cpulist(cpus: List[int]) -> str:
+    return ','.join(str(i) for i in sorted(cpus))
+
+def _read(path: str, default: str) -> str:
+    try:
+        with open(path) as file:
+            return file.read().strip()
+    except OSError:
+        return default
+
+@dataclass()
+class Cpu:
+    id: int
+    core: tuple
+    node: int
+    siblings: List[int]
+
+def topology() -> List[Cpu]:
+    ret = []
+    for cpu in sorted(os.sched_getaffinity(0)):
+        base = os.path.join(SYS_CPU, f'cpu{cpu}')
+        package = int(_read(os.path.join(base, 'topology/physical_package_id'), '0'))
+        core = int(_read(os.path.join(base, 'topology/core_id'), str(cpu)))
+        siblings = parse_cpulist(_read(os.path.join(base, 'topology/thread_siblings_list'), str(cpu)))
+        nodes = glob.glob(os.path.join(base, 'node[0-9]*'))
+        node = int(os.path.basename(nodes[0])[4:]) if nodes else 0
+        ret.append(Cpu(cpu, (package, core), node, siblings))
+    return ret
+
+class CpuAllocator():
+    def __init__(self, policy: str = 'core', cpus: List[Cpu] | None = None) -> None:
+        if policy not in ('core', 'pair'):
+            raise ValueError(f"Unknown pinning policy {policy}")
+
+        self.policy = policy
+        self.cpus = cpus if cpus is not None else topology()
+        self.free = self._order()
+
+    def _cores(self) -> Dict[tuple, List[Cpu]]:
+        cores: Dict[tuple, List[Cpu]] = {}
+        for cpu in self.cpus:
+            cores.setdefault((cpu.node,) + cpu.core, []).append(cpu)
+        return dict(sorted(cores.items()))
+
+    def _order(self) -> List[List[int]]:
+        cores = self._cores()
+
+        if self.policy == 'pair':
+            return [ [ cpu.id for cpu in threads ] for threads in cores.values() ]
+
+        # First thread of every physical core before any hyperthread sibling,
+        # filling one NUMA node at a time
+        depth = max(len(threads) for threads in cores.values())
+        ret = []
+        for node in sorted({ cpu.node for cpu in self.cpus }):
+            for level in range(depth):
+                ret += [
+                    [threads[level].id]
+                        for key, threads in cores.items() if key[0] == node and level < len(threads)
+                ]
+        return ret
+
+    def node(self, cpus: List[int]) -> int:
+        return next(cpu.node for cpu in self.cpus if cpu.id == cpus[0])
+
+    def allocate(self) -> List[int]:
+        if not self.free:
+            raise RuntimeError(f"No free cpus left for pinning with policy {self.policy}")
+        return self.free.pop(0)
+
+    def release(self, cpus: List[int]):
+        self.free.append(cpus)
+        order = self._order()
+        self.free.sort(key=order.index)
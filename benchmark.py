@@ -3,9 +3,15 @@
 from asyncio.taskgroups import TaskGroup
 from dataclasses import asdict, dataclass
 from copy import deepcopy
-import socket
+from functools import partial
+from typing import Callable, List
 import os
-import glob
+import json
+import shutil
+import signal
+import subprocess
+import tempfile
+import time
 import logging
 import aioshutil
 import asyncio
@@ -13,9 +19,18 @@ import aiofiles
 import aiofiles.os
 import argparse
 from tqdm import tqdm
-from run import run_fuzzer
-from multiprocessing import Process, Pipe
-import select
+from run import run_fuzzer, DrivePool
+from collector import Collector
+from livestats import LiveStats
+from corpus import CorpusStore
+from sampler import ResourceSampler, process_tree
+from affinity import CpuAllocator, format_cpulist, parse_cpulist
+from exporter import MetricsExporter
+from convergence import ConvergenceConfig, ConvergenceMonitor
+from supervisor import Supervisor, SupervisorConfig
+from epochs import CONSOLE_MARKER, METRIC_MARKER, begin_epoch, elapsed, end_epoch, load_epochs
+
+CONSOLE_SEGMENT_SIZE = 64 << 20
 
 @dataclass()
 class FuzzerConfig:
@@ -24,11 +39,17 @@ class FuzzerConfig:
     qemu_log_file: str = 'qemu.log'
     afl_log_file: str = 'afl.log'
     execsrv_log_file: str = 'srv.log'
+    execsrv_trace_file: str | None = 'srv.trace'
+    execsrv_trace_size: int | None = None
+    execsrv_verbose: bool = False
     enable_statsd: bool = True
-    statsd_host: str = "127.0.0.1:8125"
+    statsd_host: str = "127.0.0.1:0"
     launch_terminals: bool = False
-    stdio_normal_port: int = 54320
-    stdio_secure_port: int = 54321
+    console_transport: str = 'unix'
+    stdio_normal_port: int = 0
+    stdio_secure_port: int = 0
+    stdio_normal_socket: str | None = None
+    stdio_secure_socket: str | None = None
     afl_dir: str = 'optee/AFLplusplus/'
     qemu_dir: str = 'optee/qemu/build/'
     execsrv_dir: str = './execsrv/build'
@@ -42,12 +63,21 @@ class FuzzerConfig:
     tznorevert: bool = False
     skip_cpu_check: bool = True
     tmpfs: str = './tmpfs'
+    drive: str | None = None
+    drive_pool: int = 1
+    cpus: str | None = None
+    sync_dir: str | None = None
+    afl_role: str = 'main'
+    afl_name: str = 'main'
+    sync_time: int | None = None
     timeout: float = 50000
     input: str = './in'
     output: str = './out'
     noout: bool = True
     testcase_decoding_mode: str = 'dsl'
+    afl_autoresume: bool = False
     no_affinity: bool = True # This is required to work, just says how shitty this setup is
+                             # pinning is done for the whole process tree with `cpus` instead
 
     def prepare(self, index: int, subdir: str):
         cfg = deepcopy(self)
@@ -60,117 +90,180 @@ class FuzzerConfig:
         cfg.optee_build_dir = os.path.join(DIR, self.optee_build_dir)
         cfg.tmpfs = os.path.join(DIR, self.tmpfs)
 
+        if cfg.sync_dir is not None:
+            cfg.sync_dir = os.path.join(DIR, cfg.sync_dir)
+
         cfg.input = os.path.join(DIR, subdir, cfg.input)
         cfg.output= os.path.join(DIR, subdir, cfg.output)
         cfg.qemu_log_file = os.path.join(DIR, subdir, cfg.qemu_log_file)
         cfg.afl_log_file = os.path.join(DIR, subdir, cfg.afl_log_file)
         cfg.execsrv_log_file = os.path.join(DIR, subdir, cfg.execsrv_log_file)
+        if cfg.execsrv_trace_file is not None:
+            cfg.execsrv_trace_file = os.path.join(DIR, subdir, cfg.execsrv_trace_file)
 
-        cfg.stdio_normal_port += index * 2
-        cfg.stdio_secure_port += index * 2
+        # Port 0 is resolved when the collector binds the endpoint
+        if cfg.stdio_normal_port:
+            cfg.stdio_normal_port += index * 2
+        if cfg.stdio_secure_port:
+            cfg.stdio_secure_port += index * 2
 
         host, port = cfg.statsd_host.split(":")
-        cfg.statsd_host = f"{host}:{int(port) + index}"
+        if int(port):
+            cfg.statsd_host = f"{host}:{int(port) + index}"
 
         return cfg
 
-class TCPDumper():
-    def __init__(self, port: int, filename: str) -> None:
-        self.port = port
-        self.filename = filename
-
-    def dump(self, shutdown_pipe):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        sock.bind(('127.0.0.1', self.port))
-        sock.listen()
-        client, _ = sock.accept()
-
-        with open(self.filename, 'wb') as file:
-            while True:
-                rlist, _, _ = select.select([client, shutdown_pipe], [], [])
-
-                for fd in rlist:
-                    if fd is client:
-                        file.write(client.recv(0x1000))
-                        file.flush()
-                    else:
-                        return
-
-class UDPDumper():
-    def __init__(self, port: int, filename: str) -> None:
-        self.port = port
-        self.filename = filename
-    def dump(self, shutdown_pipe):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        sock.bind(('127.0.0.1', self.port))
-
-        with open(self.filename, 'wb') as file:
-            while True:
-                rlist, _, _ = select.select([sock, shutdown_pipe], [], [])
-
-                for fd in rlist:
-                    if fd is sock:
-                        file.write(sock.recv(0x1000))
-                        file.flush()
-                    else:
-                        return
-
+async def bind_consoles(cfg: FuzzerConfig, collector: Collector, normal_log: str, secure_log: str, socket_prefix: str) -> List:
+    if cfg.console_transport == 'unix':
+        normal = await collector.add_unix_stream(f'{socket_prefix}.normal', normal_log)
+        secure = await collector.add_unix_stream(f'{socket_prefix}.secure', secure_log)
+        cfg.stdio_normal_socket, cfg.stdio_secure_socket = normal.address, secure.address
+    else:
+        normal = await collector.add_stream(cfg.stdio_normal_port, normal_log)
+        secure = await collector.add_stream(cfg.stdio_secure_port, secure_log)
+        cfg.stdio_normal_port, cfg.stdio_secure_port = normal.address[1], secure.address[1]
+    return [normal, secure]
 
 class FuzzerInstance():
     def __init__(self, cfg: FuzzerConfig) -> None:
         self.cfg = cfg
-
-    async def setup(self, index: int, subdir: str, corpusdir: str):
-        self.cfg = self.cfg.prepare(index, subdir)
+        self.process = None
+        self.lock = asyncio.Lock()
+        self.launches = 0
+
+    def pid(self) -> int | None:
+        if self.process is None or self.process.poll() is not None:
+            return None
+        return self.process.pid
+
+    async def setup(self, index: int, subdir: str, corpus: CorpusStore, slot: int | None = None, epoch: int = 0):
+        start = time.monotonic()
+        self.index = index
+        self.epoch = epoch
+        self.cfg = self.cfg.prepare(index if slot is None else slot, subdir)
+        resume = epoch > 0
 
         DIR = os.path.dirname(__file__)
-        os.mkdir(subdir)
-        await aiofiles.os.makedirs(self.cfg.input)
-        await aiofiles.os.makedirs(self.cfg.output)
+        os.makedirs(subdir, exist_ok=resume)
+        await aiofiles.os.makedirs(self.cfg.input, exist_ok=resume)
+
+        if self.cfg.sync_dir is not None:
+            # AFL writes to <sync>/<name>, keep <instance>/out pointing at it
+            self.cfg.afl_role = 'main' if index == 0 else 'secondary'
+            self.cfg.afl_name = f'i{index}'
+            if not os.path.islink(self.cfg.output):
+                os.symlink(os.path.join(self.cfg.sync_dir, self.cfg.afl_name), self.cfg.output)
+        else:
+            await aiofiles.os.makedirs(self.cfg.output, exist_ok=resume)
         self.normal_log = os.path.join(DIR, subdir, 'normal.log')
         self.secure_log = os.path.join(DIR, subdir, 'secure.log')
         self.metric_log = os.path.join(DIR, subdir, 'metric.log')
-        _, port = self.cfg.statsd_host.split(':')
-        self.metric_dumper = UDPDumper(int(port), self.metric_log)
-        self.normal_dumper = TCPDumper(self.cfg.stdio_normal_port, self.normal_log)
-        self.secure_dumper = TCPDumper(self.cfg.stdio_secure_port, self.secure_log)
-
-        for testcase in glob.glob(os.path.join(corpusdir, '*')):
-            await aioshutil.copy(testcase, self.cfg.input)
-
-    async def run(self, time: float):
-        metric_log_a, metric_log_b = Pipe()
-        metric_log = Process(target=self.metric_dumper.dump, args=(metric_log_b,))
-        normal_log_a, normal_log_b = Pipe()
-        normal_log = Process(target=self.normal_dumper.dump, args=(normal_log_b,))
-        secure_log_a, secure_log_b = Pipe()
-        secure_log = Process(target=self.secure_dumper.dump, args=(secure_log_b,))
-
-        metric_log.start()
-        normal_log.start()
-        secure_log.start()
-        process = run_fuzzer(argparse.Namespace(**asdict(self.cfg)))
-
-        await asyncio.sleep(time)
 
-        process.terminate()
-        process.communicate()
-
-        metric_log_a.send("DUPA")
-        normal_log_a.send("DUPA")
-        secure_log_a.send("DUPA")
-
-        metric_log.join()
-        normal_log.join()
-        secure_log.join()
+        if resume and self.cfg.execsrv_trace_file is not None:
+            root, ext = os.path.splitext(self.cfg.execsrv_trace_file)
+            self.cfg.execsrv_trace_file = f'{root}.e{epoch}{ext}'
+        self.trace_file = self.cfg.execsrv_trace_file
+
+        if resume and os.listdir(self.cfg.input):
+            # AFL continues from the queue in its output dir, the seeds are already in place
+            self.cfg.afl_autoresume = True
+            self.seeding = {}
+        else:
+            self.seeding = await asyncio.to_thread(corpus.seed, self.cfg.input)
+        self.setup_time = time.monotonic() - start
+
+    def _feed(self, stats: LiveStats, monitor: ConvergenceMonitor | None, data: bytes):
+        stats.feed(self.index, data)
+        if monitor is not None:
+            monitor.feed(self.index, data)
+
+    async def listen(self, collector: Collector, stats: LiveStats, monitor: ConvergenceMonitor | None = None, socket_dir: str | None = None):
+        stats.instance(self.index)
+
+        # AFL++ only sends statsd over UDP, the endpoint stays on loopback
+        host, port = self.cfg.statsd_host.split(':')
+        sink = await collector.add_datagram(int(port), self.metric_log, partial(self._feed, stats, monitor))
+        self.cfg.statsd_host = f'{host}:{sink.address[1]}'
+
+        # sun_path is limited to 108 bytes, benchmark dirs can be deeper than that
+        prefix = os.path.join(socket_dir or os.path.dirname(self.metric_log), str(self.index))
+        consoles = await bind_consoles(self.cfg, collector, self.normal_log, self.secure_log, prefix)
+
+        if self.epoch > 0:
+            now = time.time()
+            sink.write(METRIC_MARKER.format(epoch=self.epoch, time=now).encode(), now)
+            for console in consoles:
+                console.write(CONSOLE_MARKER.format(epoch=self.epoch, date=time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now))).encode())
+
+    def start(self):
+        # Every restart gets its own execsrv trace, the ring is truncated on open
+        if self.launches > 0 and self.trace_file is not None:
+            root, ext = os.path.splitext(self.trace_file)
+            self.cfg.execsrv_trace_file = f'{root}.{self.launches}{ext}'
+
+        self.process = run_fuzzer(argparse.Namespace(**asdict(self.cfg)))
+        self.launches += 1
+
+    def _kill(self, timeout: float):
+        tree = process_tree(self.process.pid)
+        self.process.terminate()
+        try:
+            self.process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.communicate()
+
+        # A hung QEMU or execsrv can outlive AFL
+        for pid in tree[1:]:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    async def kill(self, timeout: float = 10):
+        if self.process is not None:
+            await asyncio.to_thread(self._kill, timeout)
+
+    async def restart(self, stop: asyncio.Event, reset: Callable | None = None) -> bool:
+        async with self.lock:
+            if stop.is_set():
+                return False
+
+            await self.kill()
+            if reset is not None:
+                await asyncio.to_thread(reset)
+
+            # Continue from the existing AFL output dir
+            self.cfg.afl_autoresume = True
+            self.start()
+            return True
+
+    async def run(self, duration: float, stop: asyncio.Event):
+        self.start()
+
+        try:
+            await asyncio.wait_for(stop.wait(), duration)
+        except asyncio.TimeoutError:
+            pass
+
+        async with self.lock:
+            await self.kill()
 
 class Benchmark():
-    def __init__(self, mode: str, benchmark_dir: str, corpus: str, decoding_mode: str):
+    def __init__(self, mode: str, benchmark_dir: str, corpus: str, decoding_mode: str, stats_window: float = 300, first_slot: int = 0, label: str = '', allocator: CpuAllocator | None = None, cooperative: bool = False, sync_time: int | None = None, exporter: MetricsExporter | None = None, console_transport: str = 'unix', console_segment_size: int = CONSOLE_SEGMENT_SIZE, console_segment_time: float = 0, resume: bool = False):
         self.mode = mode
         self.benchmark_dir = benchmark_dir
         self.corpus = corpus
+        self.stats = LiveStats(stats_window)
+        self.first_slot = first_slot
+        self.name = label or os.path.basename(os.path.normpath(benchmark_dir))
+        self.label = f"[{label}] " if label else ''
+        self.allocator = allocator
+        self.exporter = exporter
+        self.instances: List[FuzzerInstance] = []
+        self.started = None
+        self.stop = asyncio.Event()
+        self.stop_reason = None
 
         self.cfg = FuzzerConfig()
 
@@ -184,38 +277,304 @@ class Benchmark():
             self.cfg.tznorevert = True
 
         self.cfg.testcase_decoding_mode = decoding_mode
+        self.cfg.console_transport = console_transport
+        self.console_segment_size = console_segment_size
+        self.console_segment_time = console_segment_time
+        self.resume = resume
+        self.epoch = 0
+
+        if cooperative:
+            self.cfg.sync_dir = os.path.join(benchmark_dir, 'sync')
+            self.cfg.sync_time = sync_time
+
+    async def setup(self, instances: List[FuzzerInstance]):
+        start = time.monotonic()
+        corpus = CorpusStore(os.path.join(self.benchmark_dir, '.corpus'))
+        ingest = await asyncio.to_thread(corpus.ingest, self.corpus)
+        ingest_time = time.monotonic() - start
+
+        await asyncio.gather(*(
+            inst.setup(index, os.path.join(self.benchmark_dir, str(index)), corpus, self.first_slot + index, self.epoch)
+                for index, inst in enumerate(instances)
+        ))
+
+        report = {
+            'epoch': self.epoch,
+            'mode': self.mode,
+            'decoding': self.cfg.testcase_decoding_mode,
+            'cooperative': self.cfg.sync_dir is not None,
+            'corpus': { 'files': len(corpus.entries), 'time': ingest_time, 'stored': ingest },
+            'instances': {
+                inst.index:{ 'time': inst.setup_time, 'seeded': inst.seeding } for inst in instances
+            },
+            'total': time.monotonic() - start,
+        }
+
+        # Every epoch keeps its own setup report, the first one stays setup.json
+        name = 'setup.json' if self.epoch == 0 else f'setup.{self.epoch}.json'
+        async with aiofiles.open(os.path.join(self.benchmark_dir, name), 'w') as file:
+            await file.write(json.dumps(report, indent=2))
+
+        if self.cfg.normal:
+            await asyncio.to_thread(self._acquire_drives, instances)
+
+        await self._pin(instances)
+
+        slowest = max(inst.setup_time for inst in instances)
+        print(f"{self.label}Set up {len(instances)} instances in {report['total']:.2f}s (corpus {ingest_time:.2f}s, slowest instance {slowest:.2f}s)", flush=True)
+
+    async def _pin(self, instances: List[FuzzerInstance]):
+        mapping = {}
+
+        for inst in instances:
+            if self.allocator is not None:
+                cpus = self.allocator.allocate()
+                inst.cfg.cpus = format_cpulist(cpus)
+                mapping[inst.index] = { 'cpus': cpus, 'node': self.allocator.node(cpus) }
+            else:
+                mapping[inst.index] = None
+
+        report = {
+            'policy': self.allocator.policy if self.allocator is not None else None,
+            'instances': mapping,
+        }
+
+        async with aiofiles.open(os.path.join(self.benchmark_dir, 'affinity.json'), 'w') as file:
+            await file.write(json.dumps(report, indent=2))
+
+    def _unpin(self, instances: List[FuzzerInstance]):
+        if self.allocator is None:
+            return
+
+        for inst in instances:
+            if inst.cfg.cpus is not None:
+                self.allocator.release(parse_cpulist(inst.cfg.cpus))
+                inst.cfg.cpus = None
+
+    def _acquire_drives(self, instances: List[FuzzerInstance]):
+        self.pool = DrivePool(self.cfg.tmpfs, count=len(instances))
+        self.pool.reclaim()
+        self.pool.warm()
+
+        for inst in instances:
+            inst.cfg.drive = self.pool.acquire()
+
+    def _release_drives(self, instances: List[FuzzerInstance]):
+        for inst in instances:
+            if inst.cfg.drive is not None:
+                self.pool.release(inst.cfg.drive)
+                inst.cfg.drive = None
+
+    async def report(self, duration: float, progress: bool, summary_interval: float):
+        every = max(1, int(summary_interval))
+
+        with tqdm(total=int(duration), disable=not progress) as bar:
+            for second in range(int(duration)):
+                try:
+                    await asyncio.wait_for(self.stop.wait(), 1)
+                    break
+                except asyncio.TimeoutError:
+                    pass
+                bar.update(1)
+
+                if summary_interval > 0 and (second + 1) % every == 0:
+                    line = self.label + self.stats.summary_line()
+                    bar.set_postfix_str(line, refresh=False)
+                    if not progress:
+                        print(line, flush=True)
+
+    async def watch(self, monitor: ConvergenceMonitor, duration: float):
+        indices = [ inst.index for inst in self.instances ]
+        deadline = time.monotonic() + duration
+
+        while not self.stop.is_set():
+            try:
+                await asyncio.wait_for(self.stop.wait(), min(monitor.cfg.check_interval, max(deadline - time.monotonic(), 0)))
+                return
+            except asyncio.TimeoutError:
+                pass
+
+            if monitor.check(indices):
+                self.stop_reason = 'converged'
+                elapsed = time.monotonic() - monitor.started
+                print(f"{self.label}{monitor.cfg.field} converged within {monitor.cfg.width:.1%} after {elapsed:.0f}s, stopping", flush=True)
+                self.stop.set()
+            elif time.monotonic() >= deadline:
+                return
+
+    async def _write_stop(self, duration: float, monitor: ConvergenceMonitor | None):
+        report = {
+            'reason': self.stop_reason,
+            'requested': duration,
+            'epoch': self.epoch,
+            'elapsed': time.time() - self.started,
+            'adaptive': asdict(monitor.cfg) if monitor is not None else None,
+        }
+        if monitor is not None:
+            report.update(monitor.report([ inst.index for inst in self.instances ]))
+
+        async with aiofiles.open(os.path.join(self.benchmark_dir, 'stop.json'), 'w') as file:
+            await file.write(json.dumps(report, indent=2))
+
+    def _reset_drive(self, inst: FuzzerInstance):
+        # The VM state drive of a dead instance cannot be trusted
+        self.pool.release(inst.cfg.drive)
+        inst.cfg.drive = self.pool.acquire()
+
+    async def _restart(self, inst: FuzzerInstance) -> bool:
+        reset = None
+        if self.cfg.normal and inst.cfg.drive is not None:
+            reset = partial(self._reset_drive, inst)
+        return await inst.restart(self.stop, reset)
+
+    async def run_for(self, threads: int, duration: float, progress: bool, summary_interval: float = 10, sample_interval: float = 5, adaptive: ConvergenceConfig | None = None, supervise: SupervisorConfig | None = None):
+        epochs = await asyncio.to_thread(load_epochs, self.benchmark_dir) if self.resume else []
+        if epochs:
+            done = elapsed(epochs)
+            duration -= done
+            if duration <= 0:
+                print(f"{self.label}Already ran {done:.0f}s in {len(epochs)} epochs, nothing to resume", flush=True)
+                return
+            print(f"{self.label}Resuming as epoch {len(epochs)} after {done:.0f}s, {duration:.0f}s left", flush=True)
+        self.epoch = len(epochs)
 
-    async def run_for(self, threads: int, time: float, progress: bool):
         instances = [ FuzzerInstance(self.cfg) for _ in range(threads) ]
-
-        for index, inst in enumerate(tqdm(instances)):
-            await inst.setup(index, os.path.join(self.benchmark_dir, str(index)), self.corpus)
-
-        async with TaskGroup() as tg:
-            futures = [ asyncio.create_task(inst.run(time)) for inst in instances ]
-
-            for _ in tqdm(range(int(time))):
-                await asyncio.sleep(1)
-
-            asyncio.gather(*futures)
+        self.instances = instances
+        monitor = ConvergenceMonitor(adaptive) if adaptive is not None else None
+
+        socket_dir = tempfile.mkdtemp(prefix='bench-')
+        collector = Collector(segment_size=self.console_segment_size, segment_time=self.console_segment_time, append=self.epoch > 0)
+
+        try:
+            await self.setup(instances)
+            for inst in instances:
+                await inst.listen(collector, self.stats, monitor, socket_dir)
+
+            self.sampler = ResourceSampler(self.benchmark_dir, sample_interval, instances[0].cfg.tmpfs, append=self.epoch > 0)
+            for inst in instances:
+                self.sampler.add(inst.index, inst.pid)
+
+            supervisor = None
+            if supervise is not None:
+                supervisor = Supervisor(supervise, self.stats, instances, self.stop, self._restart, self.label)
+
+            self.started = time.time()
+            await asyncio.to_thread(begin_epoch, self.benchmark_dir, epochs)
+            if monitor is not None:
+                monitor.started = time.monotonic()
+            if self.exporter is not None:
+                self.exporter.register(self.name, self)
+
+            async with TaskGroup() as tg:
+                tg.create_task(collector.run())
+                if sample_interval > 0:
+                    tg.create_task(self.sampler.run())
+                if monitor is not None:
+                    tg.create_task(self.watch(monitor, duration))
+                if supervisor is not None:
+                    tg.create_task(supervisor.run())
+                futures = [ tg.create_task(inst.run(duration, self.stop)) for inst in instances ]
+
+                await self.report(duration, progress, summary_interval)
+
+                if self.stop_reason is None:
+                    self.stop_reason = 'max_time' if monitor is not None else 'time'
+                self.stop.set()
+
+                await asyncio.gather(*futures)
+                collector.stop()
+                self.sampler.stop()
+        finally:
+            if self.exporter is not None:
+                self.exporter.unregister(self.name)
+            # Setup or listen can fail before the collector ran and closed its sockets
+            await collector.close()
+            shutil.rmtree(socket_dir, ignore_errors=True)
+
+        await self._write_stop(duration, monitor)
+        await asyncio.to_thread(end_epoch, self.benchmark_dir, epochs, self.stop_reason)
+        if supervisor is not None:
+            name = 'downtime.json' if self.epoch == 0 else f'downtime.{self.epoch}.json'
+            await asyncio.to_thread(supervisor.write, os.path.join(self.benchmark_dir, name), self.started, time.time())
+
+        self._unpin(instances)
+        if self.cfg.normal:
+            await asyncio.to_thread(self._release_drives, instances)
+
+async def prepare_dir(path: str):
+    if os.path.isdir(path):
+        await aioshutil.rmtree(path)
+    await aiofiles.os.makedirs(path)
 
 async def main():
     parser = argparse.ArgumentParser("benchmark")
     parser.add_argument('--mode', type=str, choices=['normal', 'fast', 'norevert', 'tznorevert'], help="Select fuzzing mode")
     parser.add_argument('--threads', type=int, default=1, help="Instances to run concurrently")
     parser.add_argument('--dir', type=str, default='benchmarks', help="Directory to store benchmark logs")
-    parser.add_argument('--time', type=float, default=3600 * 2, help="Run for n seconds")
+    parser.add_argument('--time', type=float, default=3600 * 2, help="Run for n seconds, the upper limit with --adaptive")
     parser.add_argument('--corpus', type=str, help="Coprus directory")
     parser.add_argument('--testcase-decoding-mode', type=str, choices=['dsl', 'direct'], default='dsl', help="Test case decoding mode")
     parser.add_argument('--progress', required=False, action='store_true', help="Show progress bar")
+    parser.add_argument('--summary-interval', type=float, default=10, help="Print live statistics every n seconds, 0 disables")
+    parser.add_argument('--sample-interval', type=float, default=5, help="Sample RAM and CPU usage every n seconds, 0 disables")
+    parser.add_argument('--stats-window', type=float, default=300, help="Window in seconds for live statistics")
+    parser.add_argument('--console-transport', choices=['unix', 'tcp'], default='unix', help="Connect QEMU consoles to the collector over Unix sockets or loopback TCP")
+    parser.add_argument('--console-segment-size', type=float, default=CONSOLE_SEGMENT_SIZE >> 20, help="MiB of console output per compressed segment, 0 writes plain logs")
+    parser.add_argument('--console-segment-time', type=float, default=0, help="Also start a new console segment after n seconds, 0 disables")
+    parser.add_argument('--pin', choices=['none', 'core', 'pair'], default='none', help="Pin every instance to its own core or hyperthread pair")
+    parser.add_argument('--cooperative', required=False, action='store_true', help="Run instances as one AFL main and secondaries sharing a sync directory")
+    parser.add_argument('--sync-time', type=int, required=False, help="Minutes between AFL corpus syncs in cooperative mode")
+    parser.add_argument('--sweep', required=False, type=str, help="Run a benchmark matrix described by a JSON spec")
+    parser.add_argument('--adaptive', required=False, action='store_true', help="Stop early once execs_per_sec of every instance has converged")
+    parser.add_argument('--min-time', type=float, default=600, help="Seconds an adaptive run lasts at least")
+    parser.add_argument('--warmup', type=float, default=120, help="Seconds of every instance ignored by the convergence check")
+    parser.add_argument('--ci-width', type=float, default=0.02, help="Relative half width of the confidence interval that counts as converged")
+    parser.add_argument('--confidence', type=float, default=0.95, help="Confidence level of the convergence interval")
+    parser.add_argument('--check-interval', type=float, default=30, help="Seconds between convergence checks")
+    parser.add_argument('--stable-checks', type=int, default=3, help="Consecutive converged checks needed to stop")
+    parser.add_argument('--supervise', required=False, action='store_true', help="Restart instances that die or stop making progress")
+    parser.add_argument('--stall-after', type=float, default=120, help="Seconds without statsd data or throughput before an instance is restarted")
+    parser.add_argument('--startup-grace', type=float, default=180, help="Seconds after a (re)start before stalls are detected")
+    parser.add_argument('--console-timeout', type=float, default=0, help="Restart instances without console output for n seconds, 0 disables")
+    parser.add_argument('--max-restarts', type=int, default=5, help="Restarts per instance before giving up on it")
+    parser.add_argument('--resume', required=False, action='store_true', help="Continue an interrupted benchmark in --dir for the rest of --time instead of starting over")
+    parser.add_argument('--metrics-port', type=int, required=False, help="Serve live metrics over HTTP on this port, 0 picks a free one")
+    parser.add_argument('--metrics-host', type=str, default='127.0.0.1', help="Address the metrics endpoint listens on")
 
     args = parser.parse_args()
 
-    if os.path.isdir(args.dir):
-        await aioshutil.rmtree(args.dir)
-    await aiofiles.os.makedirs(args.dir)
-    benchmark = Benchmark(args.mode, args.dir, args.corpus, args.testcase_decoding_mode)
-    await benchmark.run_for(args.threads, args.time, args.progress)
+    exporter = None
+    if args.metrics_port is not None:
+        exporter = MetricsExporter(args.metrics_host, args.metrics_port)
+        await exporter.start()
+
+    try:
+        if args.sweep is not None:
+            from sweep import Sweep
+            await Sweep.from_file(args.sweep, args.dir, exporter, args.resume).run()
+            return
+
+        if args.resume:
+            await aiofiles.os.makedirs(args.dir, exist_ok=True)
+        else:
+            await prepare_dir(args.dir)
+        allocator = CpuAllocator(args.pin) if args.pin != 'none' else None
+        benchmark = Benchmark(args.mode, args.dir, args.corpus, args.testcase_decoding_mode, args.stats_window, allocator=allocator,
+                              cooperative=args.cooperative, sync_time=args.sync_time, exporter=exporter,
+                              console_transport=args.console_transport, console_segment_size=int(args.console_segment_size * (1 << 20)),
+                              console_segment_time=args.console_segment_time, resume=args.resume)
+        adaptive = None
+        if args.adaptive:
+            adaptive = ConvergenceConfig(min_time=args.min_time, warmup=args.warmup, width=args.ci_width, confidence=args.confidence,
+                                         check_interval=args.check_interval, stable_checks=args.stable_checks)
+        supervise = None
+        if args.supervise:
+            supervise = SupervisorConfig(startup_grace=args.startup_grace, stall_after=args.stall_after,
+                                         console_timeout=args.console_timeout, max_restarts=args.max_restarts)
+        await benchmark.run_for(args.threads, args.time, args.progress, args.summary_interval, args.sample_interval, adaptive, supervise)
+    finally:
+        if exporter is not None:
+            await exporter.close()
 
 if __name__ == "__main__":
     logging.getLogger("asyncio")
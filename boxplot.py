@@ -1,64 +1,32 @@
 #!/usr/bin/env python3
 
 import argparse
-from functools import reduce
 from typing import Dict, List
-from urllib import request
 import matplotlib.pyplot as plt
-import os
-import datetime
 
-from metric import METRIC
+from metric import METRIC, sketches
+from metricstore import MetricStore
+from sketch import QuantileSketch, merge_all
 
 class BoxPlot():
     def __init__(self) -> None:
-        pass
+        self.store = MetricStore()
 
-    def _read_metrics(self, data_dir: str, subdir: str) -> Dict[str, List[float]]:
-        with open(os.path.join(data_dir, subdir, 'metric.log')) as file:
-            lines = file.readlines()
+    def _prepare_data(self, metric: str, data_dir: str, baseline: str | None = None) -> Dict[str, QuantileSketch]:
+        return sketches(metric, self.store, data_dir, baseline)
 
-        ret = {}
-        for line in lines:
-            name, value = line.split(':')
-            _, field = name.split('.', 1)
-            val, _ = value.split('|', 1)
+    def _join_data(self, data: Dict[str, QuantileSketch]) -> QuantileSketch:
+        return merge_all(data.values())
 
-            if field not in ret:
-                ret[field] = []
-
-            ret[field].append(float(val))
-
-        return ret
-
-    def _read_data(self, data_dir: str) -> Dict[str, Dict[str, str]]:
-        dirs = os.listdir(data_dir)
-        data = {
-            i:self._read_metrics(data_dir, i)
-                for i in dirs
-        }
-
-        return data
-
-    def _filter_metric(self, data, metric: str):
-        return {
-            index:instance[metric] for index, instance in data.items()
-        }
-
-    def _prepare_data(self, metric: str, data_dir: str):
-        return self._filter_metric(self._read_data(data_dir), metric)
-
-    def _join_data(self, data):
-        return reduce(lambda a, b: a + b, data.values())
-
-    def plot(self, metric: str, data_dirs: List[str]):
+    def plot(self, metric: str, data_dirs: List[str], baseline: str | None = None):
         cfg = METRIC[metric]
-        data = {
-            dirname:self._join_data(self._prepare_data(cfg.metric, dirname))
-                for dirname in data_dirs
-        }
+        prepared = { dirname:self._prepare_data(metric, dirname, baseline) for dirname in data_dirs }
+        # Experiments without a value, e.g. no crash to time, get no box
+        data = { dirname:self._join_data(sketches) for dirname, sketches in prepared.items() if sketches }
+        if not data:
+            raise ValueError(f"No {metric} samples in {', '.join(data_dirs)}")
 
-        plt.boxplot(data.values(), labels=data.keys())
+        plt.gca().bxp([ sketch.box_stats(name) for name, sketch in data.items() ], showfliers=False)
         plt.xticks(rotation=45)
         plt.title(cfg.title)
         plt.ylabel(cfg.ylabel)
@@ -67,13 +35,18 @@ class BoxPlot():
 def main():
     parser = argparse.ArgumentParser("Line plot")
     parser.add_argument('metric_dirs', type=str, help="Directories with metrics to read", nargs='+')
-    parser.add_argument('--metric', choices=METRIC.keys(), help="Metric to plot")
+    parser.add_argument('--metric', choices=METRIC.keys(), default='execs/s', help="Metric to plot")
+    parser.add_argument('--baseline', required=False, type=str, help="norevert benchmark directory for relative metrics")
     parser.add_argument('--save', required=False, type=str, help="Save figure to file")
     parser.add_argument('--show', required=False, action='store_true', help="Show the generated figure")
     args = parser.parse_args()
 
     plot = BoxPlot()
-    plot.plot(args.metric, data_dirs=args.metric_dirs)
+    try:
+        plot.plot(args.metric, data_dirs=args.metric_dirs, baseline=args.baseline)
+    except ValueError as e:
+        # No samples or no baseline for the metric, not a bug
+        parser.exit(1, f"{e}\n")
 
     if args.save is not None:
         plt.savefig(args.save)
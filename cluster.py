@@ -0,0 +1,557 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import shutil
+import socket
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Tuple
+
+from benchmark import Benchmark, prepare_dir
+from collector import BufferedSink
+from convergence import ConvergenceConfig
+from livestats import LiveStats
+from metricstore import RAM_LOG, RESOURCES_LOG
+from supervisor import SupervisorConfig
+
+DEFAULT_PORT = 7878
+CHUNK = 1 << 20
+RESULT_EXCLUDE = {'.corpus'}
+NODES_DIR = 'nodes'
+
+# Messages are JSON objects, one per line. A result header is followed by
+# `size` bytes of a gzipped tar of the agent's benchmark directory.
+
+async def send(writer: asyncio.StreamWriter, message: Dict):
+    writer.write(json.dumps(message).encode() + b'\n')
+    await writer.drain()
+
+async def recv(reader: asyncio.StreamReader) -> Dict | None:
+    line = await reader.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+def parse_address(address: str, port: int = DEFAULT_PORT) -> Tuple[str, int]:
+    host, _, value = address.rpartition(':')
+    if not host:
+        return value or '127.0.0.1', port
+    return host, int(value)
+
+@dataclass()
+class ClusterSpec:
+    mode: str = 'fast'
+    decoding: str = 'dsl'
+    threads: int = 1
+    time: float = 3600 * 2
+    corpus: str = './in'
+    stats_window: float = 300
+    summary_interval: float = 60
+    sample_interval: float = 5
+    adaptive: Dict | None = None
+    supervise: Dict | None = None
+    config: Dict = field(default_factory=dict)  # FuzzerConfig overrides for every agent
+
+@dataclass()
+class Assignment:
+    agent: str
+    first: int
+    count: int
+    status: str = 'pending'
+    reason: str | None = None
+    started: float | None = None
+    finished: float | None = None
+    error: str | None = None
+
+def pack_corpus(path: str) -> List[Dict[str, str]]:
+    ret = []
+    for name in sorted(os.listdir(path)):
+        full = os.path.join(path, name)
+        if os.path.isfile(full):
+            with open(full, 'rb') as file:
+                ret.append({ 'name': name, 'data': base64.b64encode(file.read()).decode() })
+    return ret
+
+def unpack_corpus(files: List[Dict[str, str]], path: str):
+    os.makedirs(path, exist_ok=True)
+    for entry in files:
+        with open(os.path.join(path, os.path.basename(entry['name'])), 'wb') as file:
+            file.write(base64.b64decode(entry['data']))
+
+def pack_result(benchmark_dir: str, path: str):
+    def skip(info: tarfile.TarInfo) -> tarfile.TarInfo | None:
+        parts = info.name.split('/')
+        if RESULT_EXCLUDE & set(parts) or info.name.endswith('.npz'):
+            return None
+        return info
+
+    with tarfile.open(path, 'w:gz') as tar:
+        tar.add(benchmark_dir, arcname='.', filter=skip)
+
+def assign(threads: int, agents: Dict[str, int]) -> List[Tuple[str, int, int]]:
+    """
+    Spreads `threads` instances round robin over agents with free capacity
+    and numbers them contiguously per agent
+    """
+    counts = { name:0 for name in agents }
+    remaining = threads
+    while remaining > 0:
+        free = [ name for name in agents if counts[name] < agents[name] ]
+        if not free:
+            break
+        for name in free[:remaining]:
+            counts[name] += 1
+            remaining -= 1
+
+    ret = []
+    first = 0
+    for name, count in counts.items():
+        if count > 0:
+            ret.append((name, first, count))
+            first += count
+    return ret
+
+class ForwardingStats(LiveStats):
+    """
+    LiveStats that also hands every statsd datagram to the agent's
+    connection, tagged with the instance and arrival time
+    """
+    def __init__(self, window: float, queue: asyncio.Queue) -> None:
+        super().__init__(window)
+        self.queue = queue
+
+    def feed(self, index: int, data: bytes):
+        super().feed(index, data)
+        self.queue.put_nowait({ 'type': 'metric', 'instance': index, 'time': time.time(), 'data': data.decode(errors='replace') })
+
+class Agent():
+    def __init__(self, coordinator: Tuple[str, int], name: str, capacity: int, work_dir: str, config: Dict | None = None) -> None:
+        self.coordinator = coordinator
+        self.name = name
+        self.capacity = capacity
+        # Instance paths are resolved against the repository, not the cwd
+        self.work_dir = os.path.abspath(work_dir)
+        self.config = config or {}
+        self.benchmark: Benchmark | None = None
+
+    async def connect(self, timeout: float = 60) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        deadline = time.monotonic() + timeout
+        delay = 0.1
+        while True:
+            try:
+                return await asyncio.open_connection(*self.coordinator)
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 5)
+
+    async def _forward(self, queue: asyncio.Queue, writer: asyncio.StreamWriter):
+        while True:
+            await send(writer, await queue.get())
+
+    async def run_job(self, job: Dict, writer: asyncio.StreamWriter):
+        spec = ClusterSpec(**job['spec'])
+        job_dir = os.path.join(self.work_dir, job['name'])
+        benchmark_dir = os.path.join(job_dir, 'benchmark')
+        corpus = os.path.join(job_dir, 'corpus')
+
+        await prepare_dir(job_dir)
+        unpack_corpus(job['corpus'], corpus)
+
+        queue = asyncio.Queue()
+        benchmark = Benchmark(spec.mode, benchmark_dir, corpus, spec.decoding, spec.stats_window, label=self.name)
+        benchmark.stats = ForwardingStats(spec.stats_window, queue)
+        for key, value in dict(spec.config, **self.config).items():
+            setattr(benchmark.cfg, key, value)
+        self.benchmark = benchmark
+
+        adaptive = ConvergenceConfig(**spec.adaptive) if spec.adaptive is not None else None
+        supervise = SupervisorConfig(**spec.supervise) if spec.supervise is not None else None
+
+        forward = asyncio.create_task(self._forward(queue, writer))
+        try:
+            await prepare_dir(benchmark_dir)
+            await benchmark.run_for(job['count'], spec.time, False, spec.summary_interval, spec.sample_interval, adaptive, supervise)
+        except Exception as e:
+            await send(writer, { 'type': 'failed', 'job': job['name'], 'error': repr(e) })
+            return
+        finally:
+            while not queue.empty():
+                await send(writer, queue.get_nowait())
+            forward.cancel()
+            self.benchmark = None
+
+        archive = os.path.join(job_dir, 'result.tar.gz')
+        await asyncio.to_thread(pack_result, benchmark_dir, archive)
+        await send(writer, { 'type': 'result', 'job': job['name'], 'reason': benchmark.stop_reason, 'size': os.path.getsize(archive) })
+        with open(archive, 'rb') as file:
+            while chunk := file.read(CHUNK):
+                writer.write(chunk)
+                await writer.drain()
+
+        if job.get('cleanup', True):
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+    async def run(self):
+        reader, writer = await self.connect()
+        await send(writer, { 'type': 'hello', 'name': self.name, 'capacity': self.capacity, 'host': socket.gethostname() })
+        job = None
+
+        try:
+            while (message := await recv(reader)) is not None:
+                if message['type'] == 'run':
+                    job = asyncio.create_task(self.run_job(message, writer))
+                elif message['type'] == 'stop':
+                    if self.benchmark is not None:
+                        self.benchmark.stop_reason = 'coordinator'
+                        self.benchmark.stop.set()
+                elif message['type'] == 'shutdown':
+                    break
+        finally:
+            if self.benchmark is not None:
+                self.benchmark.stop.set()
+            if job is not None:
+                await asyncio.gather(job, return_exceptions=True)
+            writer.close()
+
+class AgentConnection():
+    def __init__(self, name: str, capacity: int, host: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.name = name
+        self.capacity = capacity
+        self.host = host
+        self.reader = reader
+        self.writer = writer
+
+class Coordinator():
+    """
+    Hands out instance slots to agents, streams their statsd data into
+    <dir>/<instance>/metric.log while they run and merges their result
+    directories into the layout a single benchmark.py run produces
+    """
+    def __init__(self, spec: ClusterSpec, benchmark_dir: str, host: str = '127.0.0.1', port: int = DEFAULT_PORT) -> None:
+        self.spec = spec
+        self.benchmark_dir = benchmark_dir
+        self.name = os.path.basename(os.path.normpath(benchmark_dir))
+        self.host = host
+        self.port = port
+        self.agents: Dict[str, AgentConnection] = {}
+        self.assignments: Dict[str, Assignment] = {}
+        self.sinks: Dict[int, BufferedSink] = {}
+        self.stats = LiveStats(spec.stats_window)
+        self.joined = asyncio.Condition()
+        self.server: asyncio.AbstractServer | None = None
+        self.jobs: List[asyncio.Task] = []
+        # Agents finishing together merge into the same top-level logs
+        self.merging = threading.Lock()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._accept, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        print(f"Coordinator listening on {self.host}:{self.port}", flush=True)
+
+    async def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        hello = await recv(reader)
+        if hello is None or hello.get('type') != 'hello' or hello['name'] in self.agents:
+            writer.close()
+            return
+
+        agent = AgentConnection(hello['name'], int(hello['capacity']), hello.get('host', ''), reader, writer)
+        async with self.joined:
+            self.agents[agent.name] = agent
+            self.joined.notify_all()
+        print(f"Agent {agent.name} on {agent.host} joined with {agent.capacity} slots", flush=True)
+
+    async def wait_agents(self, count: int, timeout: float):
+        async with self.joined:
+            try:
+                await asyncio.wait_for(self.joined.wait_for(
+                    lambda: len(self.agents) >= count or sum(a.capacity for a in self.agents.values()) >= self.spec.threads), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _sink(self, index: int) -> BufferedSink:
+        if index not in self.sinks:
+            subdir = os.path.join(self.benchmark_dir, str(index))
+            os.makedirs(subdir, exist_ok=True)
+            self.sinks[index] = BufferedSink(os.path.join(subdir, 'metric.log'), 0x10000, timestamps=True)
+        return self.sinks[index]
+
+    def _close_sinks(self, assignment: Assignment):
+        for index in range(assignment.first, assignment.first + assignment.count):
+            sink = self.sinks.pop(index, None)
+            if sink is not None:
+                sink.close()
+
+    def _merge(self, assignment: Assignment, extracted: str):
+        node_dir = os.path.join(self.benchmark_dir, NODES_DIR, assignment.agent)
+        os.makedirs(node_dir, exist_ok=True)
+
+        for name in os.listdir(extracted):
+            source = os.path.join(extracted, name)
+            if name.isdigit() and int(name) < assignment.count:
+                target = os.path.join(self.benchmark_dir, str(assignment.first + int(name)))
+                shutil.rmtree(target, ignore_errors=True)
+                shutil.move(source, target)
+                continue
+
+            if name == RESOURCES_LOG:
+                self._merge_resources(source, assignment.first)
+            elif name == RAM_LOG:
+                self._merge_ram(source)
+            # The agent's own copy stays as it was written
+            shutil.move(source, os.path.join(node_dir, name))
+
+    def _merge_resources(self, source: str, first: int):
+        with open(source) as src:
+            header = src.readline()
+            rows = []
+            for line in src:
+                row = line.split(',')
+                # A line cut off by a killed run would run into the next agent's rows
+                if not line.endswith('\n') or len(row) < 2 or not row[1].isdigit():
+                    continue
+                row[1] = str(int(row[1]) + first)
+                rows.append(','.join(row))
+
+        with self.merging, open(os.path.join(self.benchmark_dir, RESOURCES_LOG), 'a') as dst:
+            if dst.tell() == 0:
+                dst.write(header)
+            dst.writelines(rows)
+
+    def _merge_ram(self, source: str):
+        """
+        Every agent samples the memory of its own host, the merged log holds
+        the samples of all hosts in time order
+        """
+        def load(path: str) -> List[Dict]:
+            samples = []
+            with open(path) as file:
+                for line in file:
+                    try:
+                        samples.append(json.loads(line))
+                    except ValueError:
+                        pass
+            return samples
+
+        target = os.path.join(self.benchmark_dir, RAM_LOG)
+        with self.merging:
+            samples = load(source) + (load(target) if os.path.isfile(target) else [])
+            samples.sort(key=lambda sample: sample.get('time', 0))
+            tmp = f"{target}.tmp"
+            with open(tmp, 'w') as file:
+                file.writelines(json.dumps(sample) + '\n' for sample in samples)
+            os.replace(tmp, target)
+
+    async def _receive_result(self, agent: AgentConnection, assignment: Assignment, size: int):
+        with tempfile.TemporaryDirectory(dir=self.benchmark_dir, prefix='.result-') as tmp:
+            archive = os.path.join(tmp, 'result.tar.gz')
+            with open(archive, 'wb') as file:
+                while size > 0:
+                    chunk = await agent.reader.readexactly(min(size, CHUNK))
+                    file.write(chunk)
+                    size -= len(chunk)
+
+            # The streamed metric logs are replaced by the agent's own copies
+            self._close_sinks(assignment)
+            extracted = os.path.join(tmp, 'result')
+
+            def unpack():
+                with tarfile.open(archive) as tar:
+                    tar.extractall(extracted, filter='data')
+                self._merge(assignment, extracted)
+
+            await asyncio.to_thread(unpack)
+
+    async def _run_agent(self, agent: AgentConnection, assignment: Assignment, corpus: List[Dict]):
+        assignment.status = 'running'
+        assignment.started = time.time()
+        await send(agent.writer, {
+            'type': 'run', 'name': self.name, 'first': assignment.first, 'count': assignment.count,
+            'spec': asdict(self.spec), 'corpus': corpus,
+        })
+
+        try:
+            while (message := await recv(agent.reader)) is not None:
+                if message['type'] == 'metric':
+                    index = assignment.first + int(message['instance'])
+                    data = message['data'].encode()
+                    self._sink(index).write(data, message['time'])
+                    self.stats.feed(index, data)
+                elif message['type'] == 'failed':
+                    assignment.status = 'failed'
+                    assignment.error = message['error']
+                    break
+                elif message['type'] == 'result':
+                    await self._receive_result(agent, assignment, int(message['size']))
+                    assignment.status = 'done'
+                    assignment.reason = message.get('reason')
+                    break
+            else:
+                assignment.status = 'failed'
+                assignment.error = 'agent disconnected'
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            assignment.status = 'failed'
+            assignment.error = repr(e)
+        finally:
+            # A lost agent keeps the metric logs streamed so far
+            self._close_sinks(assignment)
+            assignment.finished = time.time()
+            self.write_manifest()
+            print(f"Agent {agent.name}: instances {assignment.first}-{assignment.first + assignment.count - 1} {assignment.status}", flush=True)
+
+    def write_manifest(self):
+        manifest = {
+            'spec': { k:v for k, v in asdict(self.spec).items() if k != 'config' },
+            'agents': { name:{ 'host': agent.host, 'capacity': agent.capacity } for name, agent in self.agents.items() },
+            'assignments': [ asdict(a) for a in self.assignments.values() ],
+        }
+        tmp = os.path.join(self.benchmark_dir, 'cluster.json.tmp')
+        with open(tmp, 'w') as file:
+            json.dump(manifest, file, indent=2)
+        os.replace(tmp, os.path.join(self.benchmark_dir, 'cluster.json'))
+
+    async def _summary(self):
+        while True:
+            await asyncio.sleep(self.spec.summary_interval)
+            print(f"[{self.name}] {self.stats.summary_line()}", flush=True)
+
+    async def stop(self):
+        for agent in self.agents.values():
+            try:
+                await send(agent.writer, { 'type': 'stop' })
+            except ConnectionError:
+                pass
+
+    async def run(self):
+        slots = assign(self.spec.threads, { name:agent.capacity for name, agent in self.agents.items() })
+        placed = sum(count for _, _, count in slots)
+        if placed == 0:
+            raise RuntimeError("No agent capacity available")
+        if placed < self.spec.threads:
+            print(f"Only {placed} of {self.spec.threads} instances fit on the connected agents", flush=True)
+
+        corpus = await asyncio.to_thread(pack_corpus, self.spec.corpus)
+        for name, first, count in slots:
+            self.assignments[name] = Assignment(name, first, count)
+        self.write_manifest()
+
+        summary = asyncio.create_task(self._summary()) if self.spec.summary_interval > 0 else None
+        try:
+            await asyncio.gather(*(
+                self._run_agent(self.agents[name], self.assignments[name], corpus) for name, _, _ in slots
+            ))
+        finally:
+            if summary is not None:
+                summary.cancel()
+            for sink in self.sinks.values():
+                sink.close()
+            self.sinks.clear()
+
+    async def close(self):
+        for agent in self.agents.values():
+            try:
+                await send(agent.writer, { 'type': 'shutdown' })
+            except ConnectionError:
+                pass
+            agent.writer.close()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+def spec_from_args(args: argparse.Namespace) -> ClusterSpec:
+    config = {}
+    if args.config is not None:
+        with open(args.config) as file:
+            config = json.load(file)
+
+    return ClusterSpec(
+        mode=args.mode, decoding=args.testcase_decoding_mode, threads=args.threads, time=args.time,
+        corpus=args.corpus, stats_window=args.stats_window, summary_interval=args.summary_interval,
+        sample_interval=args.sample_interval, supervise=asdict(SupervisorConfig()) if args.supervise else None,
+        config=config)
+
+async def coordinate(args: argparse.Namespace, local: int = 0):
+    await prepare_dir(args.dir)
+    host, port = parse_address(args.listen)
+    coordinator = Coordinator(spec_from_args(args), args.dir, host, port)
+    await coordinator.start()
+
+    agents = []
+    if local > 0:
+        # Stand-in nodes, every agent gets its own work directory
+        for i in range(local):
+            cmd = [sys.executable, os.path.abspath(__file__), 'agent', f'{host}:{coordinator.port}',
+                   '--name', f'local{i}', '--capacity', str(args.capacity), '--work-dir', os.path.join(args.work_dir, f'local{i}')]
+            if args.config is not None:
+                cmd += ['--config', args.config]
+            agents.append(await asyncio.create_subprocess_exec(*cmd))
+
+    try:
+        await coordinator.wait_agents(local or args.agents, args.wait)
+        await coordinator.run()
+    except asyncio.CancelledError:
+        await coordinator.stop()
+        raise
+    finally:
+        await coordinator.close()
+        for agent in agents:
+            await agent.wait()
+
+def main():
+    parser = argparse.ArgumentParser("Multi-node benchmark")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    agent = subparsers.add_parser('agent', help="Run benchmark instances for a coordinator")
+    agent.add_argument('coordinator', type=str, help="Coordinator host:port")
+    agent.add_argument('--name', type=str, default=socket.gethostname(), help="Agent name, unique within the cluster")
+    agent.add_argument('--capacity', type=int, default=os.cpu_count(), help="Instances this node runs at most")
+    agent.add_argument('--work-dir', type=str, default='cluster-work', help="Directory for the node's benchmark runs")
+    agent.add_argument('--config', type=str, required=False, help="JSON with FuzzerConfig overrides for this node, e.g. tool paths")
+
+    for name, help in (('coordinator', "Distribute a benchmark over agents"), ('local', "Coordinator with agents on this host")):
+        sub = subparsers.add_parser(name, help=help)
+        sub.add_argument('--mode', type=str, choices=['normal', 'fast', 'norevert', 'tznorevert'], default='fast', help="Select fuzzing mode")
+        sub.add_argument('--threads', type=int, default=1, help="Instances to run across all agents")
+        sub.add_argument('--dir', type=str, default='benchmarks', help="Directory to merge the results into")
+        sub.add_argument('--time', type=float, default=3600 * 2, help="Run for n seconds")
+        sub.add_argument('--corpus', type=str, default='./in', help="Corpus directory, sent to every agent")
+        sub.add_argument('--testcase-decoding-mode', type=str, choices=['dsl', 'direct'], default='dsl', help="Test case decoding mode")
+        sub.add_argument('--summary-interval', type=float, default=60, help="Print live statistics every n seconds, 0 disables")
+        sub.add_argument('--sample-interval', type=float, default=5, help="Sample RAM and CPU usage every n seconds on the agents, 0 disables")
+        sub.add_argument('--stats-window', type=float, default=300, help="Window in seconds for live statistics")
+        sub.add_argument('--supervise', required=False, action='store_true', help="Restart instances that die or stop making progress")
+        sub.add_argument('--config', type=str, required=False, help="JSON with FuzzerConfig overrides sent to every agent")
+        sub.add_argument('--wait', type=float, default=60, help="Seconds to wait for agents to join")
+        if name == 'coordinator':
+            sub.add_argument('--listen', type=str, default=f'0.0.0.0:{DEFAULT_PORT}', help="Address agents connect to")
+            sub.add_argument('--agents', type=int, default=1, help="Agents to wait for before starting")
+        else:
+            sub.add_argument('--listen', type=str, default='127.0.0.1:0', help="Address agents connect to")
+            sub.add_argument('--local-agents', type=int, default=2, help="Agents to start on this host")
+            sub.add_argument('--capacity', type=int, default=1, help="Instances per local agent")
+            sub.add_argument('--work-dir', type=str, default='cluster-work', help="Parent of the local agents' work directories")
+
+    args = parser.parse_args()
+
+    if args.command == 'agent':
+        config = None
+        if args.config is not None:
+            with open(args.config) as file:
+                config = json.load(file)
+        asyncio.run(Agent(parse_address(args.coordinator), args.name, args.capacity, args.work_dir, config).run())
+    elif args.command == 'coordinator':
+        asyncio.run(coordinate(args))
+    else:
+        asyncio.run(coordinate(args, args.local_agents))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+import asyncio
+import os
+import struct
+import time
+import zlib
+from typing import Callable, List
+
+TIME_SUFFIX = '.time'
+# End offset of a datagram in the log and its arrival time
+TIME_RECORD = struct.Struct('<Qd')
+
+SEGMENT_SUFFIX = '.gz'
+INDEX_SUFFIX = '.idx'
+# Segment, end offset of a flush in the uncompressed log and its time
+INDEX_RECORD = struct.Struct('<IQd')
+
+def truncate_records(file, record_size: int) -> int:
+    # Drops a record that was cut off when the writer was killed
+    size = file.seek(0, os.SEEK_END)
+    size -= size % record_size
+    file.truncate(size)
+    return size
+
+def segment_path(filename: str, segment: int) -> str:
+    return f'{filename}.{segment:05d}{SEGMENT_SUFFIX}'
+
+class BufferedSink():
+    def __init__(self, filename: str, limit: int, timestamps: bool = False, append: bool = False) -> None:
+        self.filename = filename
+        self.limit = limit
+        mode = 'ab' if append else 'wb'
+        self.file = open(filename, mode)
+        self.index = open(filename + TIME_SUFFIX, mode) if timestamps else None
+        if append and self.index is not None:
+            truncate_records(self.index, TIME_RECORD.size)
+        self.chunks: List[bytes] = []
+        self.stamps: List[bytes] = []
+        self.size = 0
+        # Index offsets continue after what an earlier epoch wrote
+        self.offset = self.file.tell()
+        # Endpoint the collector bound for this sink, resolves port 0
+        self.address = None
+
+    def write(self, data: bytes, stamp: float | None = None):
+        self.chunks.append(data)
+        self.size += len(data)
+        self.offset += len(data)
+
+        if self.index is not None:
+            self.stamps.append(TIME_RECORD.pack(self.offset, time.time() if stamp is None else stamp))
+
+        if self.size >= self.limit:
+            self.flush()
+
+    def flush(self):
+        if not self.chunks:
+            return
+
+        self.file.write(b''.join(self.chunks))
+        self.file.flush()
+        self.chunks.clear()
+        self.size = 0
+
+        # The index never points past data that is on disk
+        if self.index is not None:
+            self.index.write(b''.join(self.stamps))
+            self.index.flush()
+            self.stamps.clear()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        if self.index is not None:
+            self.index.close()
+
+class SegmentedSink():
+    """
+    Console sink writing gzip segments that rotate by size or age. Every
+    flush ends with a sync point and an index record, so live segments can
+    be read and seeked by time while the benchmark runs.
+    """
+    def __init__(self, filename: str, limit: int, segment_size: int, segment_time: float = 0, level: int = 6, append: bool = False) -> None:
+        self.filename = filename
+        self.limit = limit
+        self.segment_size = segment_size
+        self.segment_time = segment_time
+        self.level = level
+        self.chunks: List[bytes] = []
+        self.size = 0
+        self.offset = 0
+        self.address = None
+
+        self.segment = -1
+        if append:
+            self._continue()
+        self.index = open(filename + INDEX_SUFFIX, 'ab' if append else 'wb')
+        self.file = None
+        self.compressor = None
+        self.segment_start = 0
+        self.segment_opened = 0.0
+
+    def _continue(self):
+        # Appending starts a new segment after the last indexed one, a
+        # segment cut off by a crash keeps everything up to its last sync
+        try:
+            with open(self.filename + INDEX_SUFFIX, 'r+b') as file:
+                size = truncate_records(file, INDEX_RECORD.size)
+                if size == 0:
+                    return
+                file.seek(size - INDEX_RECORD.size)
+                self.segment, self.offset, _ = INDEX_RECORD.unpack(file.read(INDEX_RECORD.size))
+        except FileNotFoundError:
+            pass
+
+    def write(self, data: bytes, stamp: float | None = None):
+        self.chunks.append(data)
+        self.size += len(data)
+        self.offset += len(data)
+
+        if self.size >= self.limit:
+            self.flush()
+
+    def _open(self):
+        self.segment += 1
+        self.file = open(segment_path(self.filename, self.segment), 'wb')
+        self.compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        self.segment_start = self.offset - self.size
+        self.segment_opened = time.monotonic()
+
+    def _finish(self):
+        if self.file is not None:
+            self.file.write(self.compressor.flush(zlib.Z_FINISH))
+            self.file.close()
+            self.file = None
+
+    def flush(self):
+        if not self.chunks:
+            return
+
+        if self.file is None:
+            self._open()
+
+        data = b''.join(self.chunks)
+        self.file.write(self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH))
+        self.file.flush()
+        self.chunks.clear()
+        self.size = 0
+
+        self.index.write(INDEX_RECORD.pack(self.segment, self.offset, time.time()))
+        self.index.flush()
+
+        aged = self.segment_time > 0 and time.monotonic() - self.segment_opened >= self.segment_time
+        if self.offset - self.segment_start >= self.segment_size or aged:
+            self._finish()
+
+    def close(self):
+        self.flush()
+        self._finish()
+        self.index.close()
+
+class DatagramSink(asyncio.DatagramProtocol):
+    def __init__(self, sink: BufferedSink, callback: Callable[[bytes], None] | None) -> None:
+        self.sink = sink
+        self.callback = callback
+
+    def datagram_received(self, data: bytes, addr):
+        self.sink.write(data)
+
+        if self.callback is not None:
+            self.callback(data)
+
+class StreamSink(asyncio.Protocol):
+    def __init__(self, sink: BufferedSink | SegmentedSink, connections: List[asyncio.BaseTransport]) -> None:
+        self.sink = sink
+        self.connections = connections
+
+    def connection_made(self, transport: asyncio.BaseTransport):
+        self.connections.append(transport)
+
+    def connection_lost(self, exc: Exception | None):
+        self.sink.flush()
+
+    def data_received(self, data: bytes):
+        self.sink.write(data)
+
+class Collector():
+    def __init__(self, flush_interval: float = 1.0, buffer_limit: int = 0x40000, segment_size: int = 0, segment_time: float = 0, append: bool = False) -> None:
+        self.flush_interval = flush_interval
+        self.buffer_limit = buffer_limit
+        # Resumed benchmarks append to the logs of the earlier epochs
+        self.append = append
+        # Consoles are written as compressed segments unless segment_size is 0
+        self.segment_size = segment_size
+        self.segment_time = segment_time
+        self.sinks: List[BufferedSink | SegmentedSink] = []
+        self.transports: List[asyncio.BaseTransport] = []
+        self.servers: List[asyncio.AbstractServer] = []
+        self.connections: List[asyncio.BaseTransport] = []
+        self.paths: List[str] = []
+        self.stopped = asyncio.Event()
+        self.closed = False
+
+    def _sink(self, filename: str, timestamps: bool = False) -> BufferedSink:
+        sink = BufferedSink(filename, self.buffer_limit, timestamps, self.append)
+        self.sinks.append(sink)
+        return sink
+
+    def _console_sink(self, filename: str) -> BufferedSink | SegmentedSink:
+        if self.segment_size <= 0:
+            return self._sink(filename)
+
+        sink = SegmentedSink(filename, self.buffer_limit, self.segment_size, self.segment_time, append=self.append)
+        self.sinks.append(sink)
+        return sink
+
+    async def add_datagram(self, port: int, filename: str, callback: Callable[[bytes], None] | None = None) -> BufferedSink:
+        sink = self._sink(filename, timestamps=True)
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: DatagramSink(sink, callback), local_addr=('127.0.0.1', port))
+        self.transports.append(transport)
+        sink.address = transport.get_extra_info('sockname')
+        return sink
+
+    async def add_stream(self, port: int, filename: str) -> BufferedSink | SegmentedSink:
+        """
+        TCP console on `port`, 0 lets the kernel pick a free one
+        """
+        sink = self._console_sink(filename)
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(
+            lambda: StreamSink(sink, self.connections), '127.0.0.1', port, reuse_address=True)
+        self.servers.append(server)
+        sink.address = server.sockets[0].getsockname()
+        return sink
+
+    async def add_unix_stream(self, path: str, filename: str) -> BufferedSink | SegmentedSink:
+        # A socket left behind by a killed run would fail the bind
+        if os.path.exists(path):
+            os.unlink(path)
+
+        sink = self._console_sink(filename)
+        loop = asyncio.get_running_loop()
+        server = await loop.create_unix_server(lambda: StreamSink(sink, self.connections), path)
+        self.servers.append(server)
+        self.paths.append(path)
+        sink.address = path
+        return sink
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+    def stop(self):
+        self.stopped.set()
+
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+
+        for server in self.servers:
+            server.close()
+        for transport in self.transports + self.connections:
+            transport.close()
+        for server in self.servers:
+            await server.wait_closed()
+        for sink in self.sinks:
+            sink.close()
+        for path in self.paths:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    async def run(self):
+        try:
+            while not self.stopped.is_set():
+                try:
+                    await asyncio.wait_for(self.stopped.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self.flush()
+        finally:
+            await self.close()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import math
+import os
+import sys
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+from metricstore import MetricStore, RAM_LOG
+
+EFFECT_SIZES = [(0.147, 'negligible'), (0.33, 'small'), (0.474, 'medium'), (math.inf, 'large')]
+
+@dataclass()
+class Comparison:
+    metric: str
+    baseline: str
+    candidate: str
+    n_baseline: int
+    n_candidate: int
+    mean_baseline: float
+    mean_candidate: float
+    median_baseline: float
+    median_candidate: float
+    change: float
+    ci_low: float
+    ci_high: float
+    median_ci_low: float
+    median_ci_high: float
+    u: float
+    p_value: float
+    cliffs_delta: float
+    cohens_d: float
+    magnitude: str
+    verdict: str
+
+def mann_whitney(a: np.ndarray, b: np.ndarray) -> Tuple[float, float]:
+    """
+    Two sided Mann-Whitney U test of `b` against `a` using the normal
+    approximation with tie and continuity correction
+    """
+    n1, n2 = len(a), len(b)
+    n = n1 + n2
+    _, inverse, counts = np.unique(np.concatenate([a, b]), return_inverse=True, return_counts=True)
+
+    # Ties share the average of the ranks they span
+    ranks = (np.cumsum(counts) - (counts - 1) / 2)[inverse]
+    u = ranks[n1:].sum() - n2 * (n2 + 1) / 2
+
+    ties = (counts ** 3 - counts).sum() / (n * (n - 1)) if n > 1 else 0
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - ties))
+    if sigma == 0:
+        return u, 1.0
+
+    z = (abs(u - n1 * n2 / 2) - 0.5) / sigma
+    return u, math.erfc(max(z, 0) / math.sqrt(2))
+
+def cliffs_delta(u: float, n1: int, n2: int) -> float:
+    return 2 * u / (n1 * n2) - 1
+
+def cohens_d(a: np.ndarray, b: np.ndarray) -> float:
+    n1, n2 = len(a), len(b)
+    if n1 + n2 <= 2:
+        return math.nan
+    pooled = math.sqrt(((n1 - 1) * a.var(ddof=1) + (n2 - 1) * b.var(ddof=1)) / (n1 + n2 - 2))
+    return (b.mean() - a.mean()) / pooled if pooled else 0.0
+
+def magnitude(delta: float) -> str:
+    return next(name for limit, name in EFFECT_SIZES if abs(delta) < limit)
+
+# Distinct values resampled as they are, larger samples are binned
+BINS = 16384
+
+def support(values: np.ndarray, limit: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Distinct values and their counts. Above `limit` distinct values the
+    sample is binned and each bin stands at the mean of its members. That
+    keeps the mean of the whole sample, but resampling bins instead of
+    values drops the spread inside each bin, so the bootstrap variance comes
+    out lower and the intervals narrower than with the raw values.
+    """
+    unique, counts = np.unique(values, return_counts=True)
+    if len(unique) <= limit:
+        return unique, counts
+
+    edges = np.linspace(values.min(), values.max(), limit + 1)
+    bins = np.clip(np.searchsorted(edges, values, side='right') - 1, 0, limit - 1)
+    counts = np.bincount(bins, minlength=limit)
+    sums = np.bincount(bins, weights=values, minlength=limit)
+    keep = counts > 0
+    return sums[keep] / counts[keep], counts[keep]
+
+def bootstrap(values: np.ndarray, resamples: int, rng: np.random.Generator, limit: int = BINS, chunk: int = 256) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Means and medians of `resamples` bootstrap resamples. Drawing counts per
+    distinct value from a multinomial costs O(resamples * support) instead of
+    O(resamples * len(values)).
+    """
+    points, counts = support(values, limit)
+    n = int(counts.sum())
+    weights = counts / n
+
+    means = np.empty(resamples)
+    medians = np.empty(resamples)
+    for start in range(0, resamples, chunk):
+        draws = rng.multinomial(n, weights, size=min(chunk, resamples - start))
+        means[start:start + len(draws)] = draws @ points / n
+        middle = (np.cumsum(draws, axis=1) < (n + 1) / 2).sum(axis=1)
+        medians[start:start + len(draws)] = points[np.minimum(middle, len(points) - 1)]
+    return means, medians
+
+def relative(candidate: np.ndarray | float, baseline: np.ndarray | float):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(baseline != 0, candidate / baseline - 1, np.nan)
+
+def all_samples(store: MetricStore, data_dir: str, field: str) -> np.ndarray:
+    data = store.prepare_data(field, data_dir)
+    return np.concatenate(list(data.values())) if data else np.zeros(0)
+
+def final_values(store: MetricStore, data_dir: str, field: str) -> np.ndarray:
+    data = store.prepare_data(field, data_dir)
+    return np.array([ val[-1] for val in data.values() if len(val) ], dtype=np.float64)
+
+def ram_samples(store: MetricStore, data_dir: str, field: str) -> np.ndarray:
+    if not os.path.isfile(os.path.join(data_dir, RAM_LOG)):
+        return np.zeros(0)
+    return store.read_ram(data_dir).get(field, np.zeros(0))
+
+@dataclass()
+class CompareMetric:
+    field: str
+    read: Callable[[MetricStore, str, str], np.ndarray]
+    higher_is_better: bool
+
+COMPARE_METRICS = {
+    'execs_per_sec': CompareMetric('execs_per_sec', all_samples, True),
+    # Cumulative counter, each instance contributes the value it ended with
+    'total_crashes': CompareMetric('total_crashes', final_values, True),
+    'ram': CompareMetric('used', ram_samples, False),
+}
+
+class Comparator():
+    def __init__(self, resamples: int = 2000, confidence: float = 0.95, alpha: float = 0.05, min_change: float = 0.0, seed: int | None = None,
+                 bins: int = BINS) -> None:
+        self.resamples = resamples
+        self.bins = bins
+        self.confidence = confidence
+        self.alpha = alpha
+        self.min_change = min_change
+        self.rng = np.random.default_rng(seed)
+        self.store = MetricStore()
+
+    def samples(self, metric: str, data_dir: str) -> np.ndarray:
+        cfg = COMPARE_METRICS[metric]
+        values = np.asarray(cfg.read(self.store, data_dir, cfg.field), dtype=np.float64)
+        return values[np.isfinite(values)]
+
+    def _verdict(self, metric: str, p_value: float, low: float, high: float) -> str:
+        if p_value >= self.alpha or (low <= 0 <= high) or np.isnan(low):
+            if -self.min_change <= low and high <= self.min_change:
+                return 'equivalent'
+            return 'inconclusive'
+
+        change = low if low > 0 else high
+        if abs(change) < self.min_change:
+            return 'equivalent'
+
+        better = (change > 0) == COMPARE_METRICS[metric].higher_is_better
+        return 'better' if better else 'worse'
+
+    def compare(self, metric: str, baseline: str, a: np.ndarray, candidate: str, b: np.ndarray) -> Comparison:
+        tail = (1 - self.confidence) / 2 * 100
+
+        means_a, medians_a = bootstrap(a, self.resamples, self.rng, self.bins)
+        means_b, medians_b = bootstrap(b, self.resamples, self.rng, self.bins)
+        low, high = np.nanpercentile(relative(means_b, means_a), [tail, 100 - tail])
+        median_low, median_high = np.nanpercentile(relative(medians_b, medians_a), [tail, 100 - tail])
+
+        u, p_value = mann_whitney(a, b)
+        delta = cliffs_delta(u, len(a), len(b))
+
+        return Comparison(
+            metric, baseline, candidate, len(a), len(b),
+            float(a.mean()), float(b.mean()), float(np.median(a)), float(np.median(b)),
+            float(relative(b.mean(), a.mean())), float(low), float(high), float(median_low), float(median_high),
+            float(u), p_value, delta, cohens_d(a, b), magnitude(delta),
+            self._verdict(metric, p_value, float(low), float(high)))
+
+    def run(self, dirs: Dict[str, str], metrics: List[str]) -> List[Comparison]:
+        labels = list(dirs.keys())
+        baseline = labels[0]
+        ret = []
+
+        for metric in metrics:
+            samples = { label:self.samples(metric, data_dir) for label, data_dir in dirs.items() }
+            if len(samples[baseline]) < 2:
+                print(f"{metric}: not enough samples in {baseline}, skipping", file=sys.stderr)
+                continue
+
+            for candidate in labels[1:]:
+                if len(samples[candidate]) < 2:
+                    print(f"{metric}: not enough samples in {candidate}, skipping", file=sys.stderr)
+                    continue
+                ret.append(self.compare(metric, baseline, samples[baseline], candidate, samples[candidate]))
+        return ret
+
+def summary_line(result: Comparison) -> str:
+    return (f"{result.metric:>14} {result.candidate} vs {result.baseline}: {result.change:+.1%} "
+            f"[{result.ci_low:+.1%}, {result.ci_high:+.1%}] p={result.p_value:.3g} "
+            f"delta={result.cliffs_delta:+.3f} ({result.magnitude}) -> {result.verdict}")
+
+def main():
+    parser = argparse.ArgumentParser("Compare benchmark runs")
+    parser.add_argument('benchmark_dirs', type=str, help="Benchmark directories, the first one is the baseline", nargs='+')
+    parser.add_argument('--labels', type=str, nargs='+', help="Names of the benchmark directories in the verdict")
+    parser.add_argument('--metric', choices=COMPARE_METRICS.keys(), nargs='+', default=list(COMPARE_METRICS.keys()), help="Metrics to compare")
+    parser.add_argument('--resamples', type=int, default=2000, help="Bootstrap resamples")
+    parser.add_argument('--bins', type=int, default=BINS, help="Distinct values bootstrapped as they are, larger samples are binned, which narrows the intervals somewhat")
+    parser.add_argument('--confidence', type=float, default=0.95, help="Confidence level of the bootstrap intervals")
+    parser.add_argument('--alpha', type=float, default=0.05, help="Significance level of the Mann-Whitney test")
+    parser.add_argument('--min-change', type=float, default=0.0, help="Relative change below which a difference counts as equivalent")
+    parser.add_argument('--seed', type=int, required=False, help="Seed of the bootstrap generator")
+    parser.add_argument('--out', type=str, default='verdict.json', help="Verdict file")
+    args = parser.parse_args()
+
+    if len(args.benchmark_dirs) < 2:
+        parser.error("need a baseline and at least one candidate")
+
+    labels = args.labels if args.labels is not None else args.benchmark_dirs
+    if len(labels) != len(args.benchmark_dirs):
+        parser.error("--labels needs one label per benchmark directory")
+
+    comparator = Comparator(args.resamples, args.confidence, args.alpha, args.min_change, args.seed, args.bins)
+    results = comparator.run(dict(zip(labels, args.benchmark_dirs)), args.metric)
+
+    for result in results:
+        print(summary_line(result))
+
+    regressions = [ result for result in results if result.verdict == 'worse' ]
+    verdict = {
+        'baseline': labels[0],
+        'dirs': dict(zip(labels, args.benchmark_dirs)),
+        'resamples': args.resamples,
+        'bins': args.bins,
+        'confidence': args.confidence,
+        'alpha': args.alpha,
+        'min_change': args.min_change,
+        'pass': not regressions,
+        'regressions': [ f"{result.candidate}:{result.metric}" for result in regressions ],
+        'comparisons': [ asdict(result) for result in results ],
+    }
+
+    with open(args.out, 'w') as file:
+        json.dump(verdict, file, indent=2)
+
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import re
+import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from collector import INDEX_SUFFIX, segment_path
+
+INDEX_DTYPE = np.dtype([('segment', '<u4'), ('end', '<u8'), ('time', '<f8')])
+CONSOLE_LOGS = ['normal.log', 'secure.log']
+READ_SIZE = 1 << 20
+
+@dataclass()
+class Segment:
+    path: str
+    start: int              # Offset of the first byte in the uncompressed log
+    ends: np.ndarray        # End offsets of the flushes in this segment
+    times: np.ndarray       # Time of every flush
+    after: float            # Time of the flush before the first one
+
+def read_index(path: str) -> np.ndarray | None:
+    try:
+        with open(path + INDEX_SUFFIX, 'rb') as file:
+            raw = file.read()
+    except OSError:
+        return None
+    return np.frombuffer(raw[:len(raw) - len(raw) % INDEX_DTYPE.itemsize], dtype=INDEX_DTYPE)
+
+def console_size(path: str) -> int:
+    """
+    Uncompressed size of a console log, reads only the last index record
+    """
+    try:
+        with open(path + INDEX_SUFFIX, 'rb') as file:
+            size = file.seek(0, os.SEEK_END)
+            if size < INDEX_DTYPE.itemsize:
+                return 0
+            file.seek(size - size % INDEX_DTYPE.itemsize - INDEX_DTYPE.itemsize)
+            return int(np.frombuffer(file.read(INDEX_DTYPE.itemsize), dtype=INDEX_DTYPE)['end'][0])
+    except FileNotFoundError:
+        pass
+
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def inflate(path: str, limit: int | None = None) -> bytes:
+    """
+    Decompresses a segment, stops once `limit` bytes are out. Segments that
+    are still written have no gzip trailer yet, everything up to the last
+    sync point is returned.
+    """
+    decompressor = zlib.decompressobj(31)
+    chunks = []
+    size = 0
+    with open(path, 'rb') as file:
+        while limit is None or size < limit:
+            data = file.read(READ_SIZE)
+            if not data:
+                break
+            chunk = decompressor.decompress(data)
+            chunks.append(chunk)
+            size += len(chunk)
+    return b''.join(chunks)[:limit]
+
+def _window(segment: Segment, start: float | None, end: float | None) -> Tuple[int, int] | None:
+    """
+    Byte range of a segment written between `start` and `end`. The bytes of
+    a flush arrived after the previous flush, times are exact to the
+    collector's flush interval.
+    """
+    begins = np.concatenate(([segment.start], segment.ends[:-1]))
+    previous = np.concatenate(([segment.after], segment.times[:-1]))
+
+    mask = np.ones(len(segment.ends), dtype=bool)
+    if start is not None:
+        mask &= segment.times >= start
+    if end is not None:
+        mask &= previous <= end
+
+    selected = np.flatnonzero(mask)
+    if selected.size == 0:
+        return None
+    return int(begins[selected[0]] - segment.start), int(segment.ends[selected[-1]] - segment.start)
+
+def _grep_segment(segment: Segment, pattern: bytes, start: float | None, end: float | None) -> List[Tuple[float, bytes]]:
+    window = _window(segment, start, end)
+    if window is None:
+        return []
+
+    lo, hi = window
+    data = inflate(segment.path, hi)[lo:hi]
+    regex = re.compile(pattern)
+    ret = []
+    for match in regex.finditer(data):
+        line_start = data.rfind(b'\n', 0, match.start()) + 1
+        line_end = data.find(b'\n', match.end())
+        offset = segment.start + lo + line_start
+        flush = min(np.searchsorted(segment.ends, offset, side='right'), len(segment.times) - 1)
+        ret.append((float(segment.times[flush]), data[line_start:line_end if line_end >= 0 else len(data)]))
+    return ret
+
+class ConsoleLog():
+    """
+    Reader for console logs, either the gzip segments and index the
+    collector writes or a plain log from before segments or from a replay
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.index = read_index(path)
+
+    @property
+    def segmented(self) -> bool:
+        return self.index is not None
+
+    def size(self) -> int:
+        if self.index is None:
+            return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return int(self.index['end'][-1]) if len(self.index) else 0
+
+    def span(self) -> Tuple[float, float] | None:
+        if self.index is None or len(self.index) == 0:
+            return None
+        return float(self.index['time'][0]), float(self.index['time'][-1])
+
+    def segments(self) -> List[Segment]:
+        if self.index is None:
+            return []
+
+        ret = []
+        start, after = 0, -np.inf
+        for number in np.unique(self.index['segment']):
+            records = self.index[self.index['segment'] == number]
+            ret.append(Segment(segment_path(self.path, int(number)), start, records['end'].copy(), records['time'].copy(), after))
+            start, after = int(records['end'][-1]), float(records['time'][-1])
+        return ret
+
+    def _check_window(self, start: float | None, end: float | None):
+        if self.index is None and (start is not None or end is not None):
+            raise ValueError(f"{self.path} has no time index")
+
+    def read(self, start: float | None = None, end: float | None = None) -> bytes:
+        """
+        Console output written between the `start` and `end` timestamps,
+        only the segments overlapping the window are decompressed
+        """
+        self._check_window(start, end)
+        if self.index is None:
+            try:
+                with open(self.path, 'rb') as file:
+                    return file.read()
+            except OSError:
+                return b''
+
+        chunks = []
+        for segment in self.segments():
+            window = _window(segment, start, end)
+            if window is not None:
+                lo, hi = window
+                chunks.append(inflate(segment.path, hi)[lo:hi])
+        return b''.join(chunks)
+
+    def lines(self, start: float | None = None, end: float | None = None) -> Iterator[bytes]:
+        yield from self.read(start, end).splitlines()
+
+    def grep(self, pattern: bytes, start: float | None = None, end: float | None = None, jobs: int | None = None) -> List[Tuple[float | None, bytes]]:
+        """
+        Lines matching `pattern` with the time they were flushed, segments
+        are searched in parallel
+        """
+        self._check_window(start, end)
+        if self.index is None:
+            regex = re.compile(pattern)
+            return [ (None, line) for line in self.lines() if regex.search(line) ]
+
+        segments = self.segments()
+        if len(segments) <= 1 or jobs == 1:
+            results = [ _grep_segment(segment, pattern, start, end) for segment in segments ]
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                results = list(pool.map(partial(_grep_segment, pattern=pattern, start=start, end=end), segments))
+        return [ match for result in results for match in result ]
+
+def find_logs(paths: List[str]) -> List[str]:
+    ret = []
+    for path in paths:
+        if os.path.isdir(path):
+            ret += [ os.path.join(path, name) for name in CONSOLE_LOGS
+                        if os.path.exists(os.path.join(path, name)) or os.path.exists(os.path.join(path, name) + INDEX_SUFFIX) ]
+        else:
+            ret.append(path)
+    return ret
+
+def describe(log: ConsoleLog) -> Dict:
+    segments = log.segments()
+    stored = sum(os.path.getsize(segment.path) for segment in segments if os.path.exists(segment.path))
+    span = log.span()
+    return {
+        'segments': len(segments),
+        'size': log.size(),
+        'stored': stored if log.segmented else log.size(),
+        'start': span[0] if span is not None else None,
+        'end': span[1] if span is not None else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser("Console log reader")
+    parser.add_argument('paths', type=str, help="Console logs or instance directories", nargs='+')
+    parser.add_argument('--start', type=float, required=False, help="Seconds since the log started")
+    parser.add_argument('--end', type=float, required=False, help="Seconds since the log started")
+    parser.add_argument('--at', type=float, required=False, help="Unix time to show the output around, e.g. a crash")
+    parser.add_argument('--window', type=float, default=30, help="Seconds before and after --at")
+    parser.add_argument('--grep', type=str, required=False, help="Print only lines matching this regular expression")
+    parser.add_argument('--jobs', type=int, required=False, help="Segments searched in parallel")
+    parser.add_argument('--stat', required=False, action='store_true', help="Print segments and compression of every log")
+    args = parser.parse_args()
+
+    for path in find_logs(args.paths):
+        log = ConsoleLog(path)
+        if args.stat:
+            info = describe(log)
+            ratio = info['size'] / info['stored'] if info['stored'] else 0
+            print(f"{path}: {info['size']} bytes in {info['segments']} segments, {info['stored']} stored ({ratio:.1f}x)")
+            continue
+
+        start, end = None, None
+        span = log.span()
+        if args.at is not None:
+            start, end = args.at - args.window, args.at + args.window
+        elif span is not None:
+            start = span[0] + args.start if args.start is not None else None
+            end = span[0] + args.end if args.end is not None else None
+
+        if args.grep is not None:
+            for stamp, line in log.grep(args.grep.encode(), start, end, args.jobs):
+                prefix = f"{stamp - span[0]:10.3f} " if stamp is not None else ''
+                print(f"{path}: {prefix}{line.decode(errors='replace')}")
+        else:
+            sys.stdout.buffer.write(log.read(start, end))
+
+if __name__ == "__main__":
+    main()
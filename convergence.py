@@ -0,0 +1,90 @@
+import math
+import time
+from dataclasses import dataclass
+from statistics import NormalDist
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from livestats import parse_statsd
+
+@dataclass()
+class ConvergenceConfig:
+    field: str = 'execs_per_sec'
+    min_time: float = 600         # Never stop before this many seconds
+    warmup: float = 120           # Samples of the first seconds of an instance are ignored
+    width: float = 0.02           # Relative half width of the interval that counts as converged
+    confidence: float = 0.95
+    batches: int = 20             # Batch means, the samples of one instance are autocorrelated
+    check_interval: float = 30
+    stable_checks: int = 3        # Consecutive converged checks needed to stop
+
+def batch_means(values: np.ndarray, batches: int, confidence: float) -> Tuple[float, float]:
+    """
+    Mean and confidence interval half width from the means of `batches`
+    consecutive blocks, which are close to independent even when the samples
+    are not
+    """
+    size = len(values) // batches
+    if size < 2:
+        return float(values.mean()) if len(values) else math.nan, math.inf
+
+    means = values[len(values) - size * batches:].reshape(batches, size).mean(axis=1)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    return float(means.mean()), float(z * means.std(ddof=1) / math.sqrt(batches))
+
+def finite(value: float) -> float | None:
+    return value if math.isfinite(value) else None
+
+class ConvergenceMonitor():
+    def __init__(self, cfg: ConvergenceConfig) -> None:
+        self.cfg = cfg
+        self.samples: Dict[int, List[Tuple[float, float]]] = {}
+        self.started = time.monotonic()
+        self.streak = 0
+        self.history: List[Dict] = []
+
+    def feed(self, index: int, data: bytes):
+        now = time.monotonic()
+        for field, value in parse_statsd(data):
+            if field == self.cfg.field:
+                self.samples.setdefault(index, []).append((now, value))
+
+    def interval(self, index: int) -> Dict[str, float]:
+        samples = self.samples.get(index, [])
+        if not samples:
+            return { 'samples': 0, 'mean': math.nan, 'half_width': math.inf, 'relative': math.inf }
+
+        start = samples[0][0] + self.cfg.warmup
+        values = np.array([ v for t, v in samples if t >= start ], dtype=np.float64)
+        mean, half_width = batch_means(values, self.cfg.batches, self.cfg.confidence)
+        relative = half_width / abs(mean) if mean and math.isfinite(half_width) else math.inf
+        return { 'samples': int(values.size), 'mean': mean, 'half_width': half_width, 'relative': relative }
+
+    def check(self, instances: List[int]) -> bool:
+        """
+        True once every instance has stayed within the configured width for
+        `stable_checks` consecutive checks after `min_time`
+        """
+        elapsed = time.monotonic() - self.started
+        intervals = { index:self.interval(index) for index in instances }
+        converged = bool(intervals) and all(i['relative'] <= self.cfg.width for i in intervals.values())
+
+        self.streak = self.streak + 1 if converged else 0
+        self.history.append({
+            'elapsed': elapsed,
+            'converged': converged,
+            'worst': max((i['relative'] for i in intervals.values()), default=math.inf),
+        })
+
+        return elapsed >= self.cfg.min_time and self.streak >= self.cfg.stable_checks
+
+    def report(self, instances: List[int]) -> Dict:
+        return {
+            'instances': {
+                index:{ k:finite(v) for k, v in self.interval(index).items() }
+                    for index in instances
+            },
+            'streak': self.streak,
+            'history': [ dict(entry, worst=finite(entry['worst'])) for entry in self.history ],
+        }
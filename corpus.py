@@ -0,0 +1,84 @@
+import errno
+import fcntl
+import glob
+import hashlib
+import os
+import shutil
+from typing import Dict, List, Tuple
+
+FICLONE = 0x40049409
+
+def reflink(src: str, dst: str):
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+
+def clone(src: str, dst: str) -> str:
+    try:
+        reflink(src, dst)
+        return 'reflink'
+    except OSError:
+        pass
+
+    shutil.copyfile(src, dst)
+    return 'copy'
+
+def place(src: str, dst: str) -> str:
+    try:
+        os.link(src, dst)
+        return 'link'
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+
+    return clone(src, dst)
+
+def digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(0x100000), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+class CorpusStore():
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.entries: List[Tuple[str, str]] = []
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest)
+
+    def ingest(self, corpusdir: str) -> Dict[str, int]:
+        os.makedirs(self.root, exist_ok=True)
+        counts: Dict[str, int] = {}
+
+        for testcase in sorted(glob.glob(os.path.join(corpusdir, '*'))):
+            if not os.path.isfile(testcase):
+                continue
+
+            key = digest(testcase)
+            stored = self.path(key)
+            if not os.path.exists(stored):
+                how = clone(testcase, stored)
+                counts[how] = counts.get(how, 0) + 1
+            self.entries.append((os.path.basename(testcase), key))
+
+        return counts
+
+    def seed(self, dest: str) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        seen = set()
+
+        for name, key in self.entries:
+            if key in seen:
+                continue
+            seen.add(key)
+
+            how = place(self.path(key), os.path.join(dest, name))
+            counts[how] = counts.get(how, 0) + 1
+
+        return counts
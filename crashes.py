@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+from dataclasses import asdict
+from typing import Dict, List
+
+from benchmark import FuzzerConfig
+from consolelog import CONSOLE_LOGS, ConsoleLog
+from corpus import digest
+from replay import CONSUMED_PATTERN, CRASH_PATTERNS, ReplayEngine, ReplayResult
+
+CRASH_GLOBS = [
+    os.path.join('*', 'out', 'crashes', 'id:*'),
+    os.path.join('*', 'out', '*', 'crashes', 'id:*'),
+]
+
+FRAME = re.compile(rb'^\s*(?:pc|lr)\s*:|^\s+\S+\+0x[0-9a-f]+/0x[0-9a-f]+')
+NORMALIZE = [
+    (re.compile(rb'^\[\s*\d+\.\d+\]\s*'), b''),
+    (re.compile(rb'\+0x[0-9a-f]+/0x[0-9a-f]+'), b''),
+    (re.compile(rb'0x[0-9a-f]+|\b[0-9a-f]{8,16}\b'), b'<addr>'),
+    (re.compile(rb'\b\d+\b'), b'<n>'),
+]
+FRAMES = 5
+
+def normalize(line: bytes) -> bytes:
+    for pattern, repl in NORMALIZE:
+        line = pattern.sub(repl, line)
+    return line.strip()
+
+def crash_lines(*logs: str) -> List[bytes]:
+    ret = []
+    for log in logs:
+        frames = 0
+        for line in ConsoleLog(log).lines():
+            if any(pattern.search(line) for pattern in CRASH_PATTERNS):
+                ret.append(normalize(line))
+            elif ret and frames < FRAMES and FRAME.search(line):
+                ret.append(normalize(line))
+                frames += 1
+    return ret
+
+def signature(result: ReplayResult) -> Dict[str, str] | None:
+    if result.status == 'timeout':
+        return { 'id': 'timeout', 'title': 'timeout' }
+
+    lines = crash_lines(result.secure_log, result.normal_log)
+    if not lines:
+        if result.status == 'crashed':
+            return { 'id': f'exit-{result.returncode}', 'title': f'QEMU exited with {result.returncode}' }
+        return None
+
+    return {
+        'id': hashlib.sha1(b'\n'.join(lines)).hexdigest()[:16],
+        'title': lines[0].decode(errors='replace'),
+    }
+
+def benchmark_info(benchmark_dir: str) -> Dict[str, str]:
+    try:
+        with open(os.path.join(benchmark_dir, 'setup.json')) as file:
+            setup = json.load(file)
+        return { 'mode': setup.get('mode'), 'decoding': setup.get('decoding') }
+    except (OSError, ValueError):
+        return {}
+
+class CrashDatabase():
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.inputs = os.path.join(path, 'inputs')
+        self.crashes: Dict[str, Dict] = {}
+        self.signatures: Dict[str, Dict] = {}
+
+        os.makedirs(self.inputs, exist_ok=True)
+        try:
+            with open(os.path.join(path, 'crashes.json')) as file:
+                db = json.load(file)
+            self.crashes = db['crashes']
+            self.signatures = db['signatures']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def save(self):
+        tmp = os.path.join(self.path, 'crashes.json.tmp')
+        with open(tmp, 'w') as file:
+            json.dump({ 'crashes': self.crashes, 'signatures': self.signatures }, file, indent=2)
+        os.replace(tmp, os.path.join(self.path, 'crashes.json'))
+
+    def index(self, benchmark_dir: str) -> int:
+        info = benchmark_info(benchmark_dir)
+        added = 0
+
+        for pattern in CRASH_GLOBS:
+            for path in glob.glob(os.path.join(benchmark_dir, pattern)):
+                key = digest(path)
+                instance = os.path.relpath(path, benchmark_dir).split(os.sep)[0]
+                source = { 'benchmark': benchmark_dir, 'instance': instance, 'path': path, 'found': os.path.getmtime(path) }
+
+                if key not in self.crashes:
+                    shutil.copyfile(path, os.path.join(self.inputs, key))
+                    self.crashes[key] = { 'size': os.path.getsize(path), 'sources': [], 'status': None, 'signature': None, **info }
+                    added += 1
+
+                # Databases from before crash times were recorded lack 'found'
+                known = [ s for s in self.crashes[key]['sources'] if s['path'] == path ]
+                if not known:
+                    self.crashes[key]['sources'].append(source)
+                else:
+                    known[0].setdefault('found', source['found'])
+
+        return added
+
+    def context(self, window: float) -> int:
+        """
+        Console output of the fuzzing instance in the `window` seconds before
+        AFL saved each crash, cut from the time indexed console segments
+        """
+        out = os.path.join(self.path, 'context')
+        os.makedirs(out, exist_ok=True)
+        written = 0
+
+        for key, crash in self.crashes.items():
+            for number, source in enumerate(crash['sources']):
+                if 'found' not in source:
+                    continue
+
+                for name in CONSOLE_LOGS:
+                    path = os.path.join(out, f"{key}.{number}.{name}")
+                    if os.path.exists(path):
+                        continue
+
+                    log = ConsoleLog(os.path.join(source['benchmark'], source['instance'], name))
+                    if not log.segmented:
+                        continue
+
+                    with open(path, 'wb') as file:
+                        file.write(log.read(source['found'] - window, source['found'] + 1))
+                    written += 1
+        return written
+
+    def pending(self, reverify: bool) -> List[str]:
+        # A replay that never ran the input is tried again
+        return [ key for key, crash in self.crashes.items() if reverify or crash['status'] in (None, 'error') ]
+
+    def record(self, result: ReplayResult):
+        crash = self.crashes[result.name]
+        sig = signature(result)
+
+        old = crash['signature']
+        if old is not None and old in self.signatures and result.name in self.signatures[old]['crashes']:
+            self.signatures[old]['crashes'].remove(result.name)
+
+        crash['status'] = result.status
+        crash['time'] = result.time
+        crash['verified'] = time.time()
+        crash['signature'] = sig['id'] if sig is not None else None
+
+        if sig is not None:
+            entry = self.signatures.setdefault(sig['id'], { 'title': sig['title'], 'crashes': [] })
+            entry['crashes'].append(result.name)
+
+        self.signatures = { k:v for k, v in self.signatures.items() if v['crashes'] }
+
+    def summary(self) -> str:
+        reproduced = sum(1 for crash in self.crashes.values() if crash['signature'] is not None)
+        errors = sum(1 for crash in self.crashes.values() if crash['status'] == 'error')
+        lines = [ f"{len(self.crashes)} unique inputs, {reproduced} reproduced, {errors} never ran, {len(self.signatures)} signatures" ]
+        for key, sig in sorted(self.signatures.items(), key=lambda x: -len(x[1]['crashes'])):
+            lines.append(f"  {key} x{len(sig['crashes'])}: {sig['title']}")
+        return '\n'.join(lines)
+
+async def verify(db: CrashDatabase, args: argparse.Namespace):
+    pending = db.pending(args.reverify)
+    by_decoding: Dict[str, List[str]] = {}
+    for key in pending:
+        decoding = db.crashes[key].get('decoding') or args.testcase_decoding_mode
+        by_decoding.setdefault(decoding, []).append(os.path.join(db.inputs, key))
+
+    for decoding, testcases in by_decoding.items():
+        cfg = FuzzerConfig(qemu_dir=args.qemu_dir, optee_out_dir=args.optee_out_dir,
+                           testcase_decoding_mode=decoding, fuzzer_debug_log=False, afl_debug_log=False)
+        options = argparse.Namespace(**asdict(cfg))
+        engine = ReplayEngine(options, os.path.join(db.path, 'replay', decoding), args.jobs, args.timeout,
+                              args.delivery, args.replay_kernel_args, args.consumed_pattern.encode())
+        for result in await engine.run(testcases):
+            db.record(result)
+        db.save()
+
+def main():
+    parser = argparse.ArgumentParser("Crash triage")
+    parser.add_argument('benchmark_dirs', type=str, help="Benchmark directories to collect crashes from", nargs='+')
+    parser.add_argument('--db', type=str, default='crashdb', help="Crash database directory")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help="Parallel QEMU instances")
+    parser.add_argument('--timeout', type=float, default=60, help="Seconds before a replay is considered hung")
+    parser.add_argument('--reverify', required=False, action='store_true', help="Replay crashes that were already verified")
+    parser.add_argument('--context', type=float, default=30, help="Save the fuzzing console output of n seconds before every crash, 0 disables")
+    parser.add_argument('--index-only', required=False, action='store_true', help="Only index crash inputs, do not replay them")
+    parser.add_argument('--testcase-decoding-mode', choices=['dsl', 'direct'], default='dsl', help="Decoding mode when the benchmark does not record one")
+    parser.add_argument('--delivery', choices=['file', 'cmdline'], default='cmdline', help="Pass each crash on the kernel command line or as a file, file needs a guest with a file replay mode")
+    parser.add_argument('--replay-kernel-args', type=str, default='replay', help="Kernel arguments selecting the guest's file replay mode")
+    parser.add_argument('--consumed-pattern', type=str, default=CONSUMED_PATTERN.decode(), help="Regular expression the guest prints once it ran a crash input, runs without it are errors")
+    parser.add_argument('--qemu-dir', default='optee/qemu/build/', type=str, help="Path to QEMU build directory")
+    parser.add_argument('--optee-out-dir', default='./optee/out/bin/', type=str, help="Path to optee out dir with compiled images")
+    args = parser.parse_args()
+
+    db = CrashDatabase(args.db)
+    for benchmark_dir in args.benchmark_dirs:
+        added = db.index(benchmark_dir)
+        print(f"{benchmark_dir}: {added} new unique crashes")
+    db.save()
+
+    if args.context > 0:
+        written = db.context(args.context)
+        print(f"Saved {written} console excerpts to {os.path.join(db.path, 'context')}")
+
+    if not args.index_only:
+        asyncio.run(verify(db, args))
+
+    print(db.summary())
+
+if __name__ == "__main__":
+    main()
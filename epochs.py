@@ -0,0 +1,84 @@
+import glob
+import json
+import os
+import time
+from typing import Dict, List
+
+import numpy as np
+
+EPOCHS_FILE = 'epochs.json'
+# Written to metric.log when a resumed run starts, has no ':' so parsers skip it
+METRIC_MARKER = '#epoch {epoch} {time:.3f}\n'
+CONSOLE_MARKER = '\n--- epoch {epoch} started {date} ---\n'
+
+def last_activity(benchmark_dir: str) -> float | None:
+    """
+    Latest write to any instance metric log, the end of a run that was
+    killed before it could record it
+    """
+    times = [ os.path.getmtime(log) for log in glob.glob(os.path.join(benchmark_dir, '*', 'metric.log')) ]
+    return max(times, default=None)
+
+def _legacy(benchmark_dir: str) -> List[Dict]:
+    # Directories from before epochs were recorded, or killed during their first run
+    try:
+        started = os.path.getmtime(os.path.join(benchmark_dir, 'setup.json'))
+    except OSError:
+        return []
+
+    try:
+        with open(os.path.join(benchmark_dir, 'stop.json')) as file:
+            stop = json.load(file)
+        ended = os.path.getmtime(os.path.join(benchmark_dir, 'stop.json'))
+        return [{ 'epoch': 0, 'started': ended - stop['elapsed'], 'ended': ended, 'reason': stop['reason'] }]
+    except (OSError, ValueError, KeyError):
+        return [{ 'epoch': 0, 'started': started, 'ended': None }]
+
+def load_epochs(benchmark_dir: str) -> List[Dict]:
+    """
+    Epochs of a benchmark directory, an epoch that never recorded its end
+    was interrupted and ends with the last metric written
+    """
+    try:
+        with open(os.path.join(benchmark_dir, EPOCHS_FILE)) as file:
+            epochs = json.load(file)
+    except (OSError, ValueError):
+        epochs = _legacy(benchmark_dir)
+
+    if epochs and epochs[-1].get('ended') is None:
+        last = epochs[-1]
+        last['ended'] = max(last_activity(benchmark_dir) or last['started'], last['started'])
+        last['reason'] = 'interrupted'
+    return epochs
+
+def save_epochs(benchmark_dir: str, epochs: List[Dict]):
+    path = os.path.join(benchmark_dir, EPOCHS_FILE)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as file:
+        json.dump(epochs, file, indent=2)
+    os.replace(tmp, path)
+
+def elapsed(epochs: List[Dict]) -> float:
+    return sum(epoch['ended'] - epoch['started'] for epoch in epochs if epoch.get('ended') is not None)
+
+def begin_epoch(benchmark_dir: str, epochs: List[Dict]) -> Dict:
+    epoch = { 'epoch': len(epochs), 'started': time.time(), 'ended': None }
+    epochs.append(epoch)
+    save_epochs(benchmark_dir, epochs)
+    return epoch
+
+def end_epoch(benchmark_dir: str, epochs: List[Dict], reason: str | None):
+    epochs[-1]['ended'] = time.time()
+    epochs[-1]['reason'] = reason
+    save_epochs(benchmark_dir, epochs)
+
+def stitch(times: np.ndarray, epochs: List[Dict]) -> np.ndarray:
+    """
+    Moves the samples of every later epoch back by the time the benchmark
+    was not running, the epochs join into one continuous timeline
+    """
+    shift = np.zeros(len(times), dtype=np.float64)
+    for previous, epoch in zip(epochs, epochs[1:]):
+        gap = epoch['started'] - (previous.get('ended') or epoch['started'])
+        shift[times >= epoch['started']] += max(gap, 0)
+    return times - shift
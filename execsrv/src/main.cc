@@ -13,8 +13,11 @@
 #include <semaphore.h>
 #include <signal.h>
 #include <wait.h>
+#include <fcntl.h>
+#include <time.h>
 
 static FILE *LOG_FILE = nullptr;
+static bool VERBOSE = false;
 
 static void log(const char *fmt, ...) {
     if (!LOG_FILE) {
@@ -27,6 +30,9 @@ static void log(const char *fmt, ...) {
     va_end(list);
 }
 
+// Per iteration messages, off unless -v is given
+#define vlog(...) do { if (VERBOSE) log(__VA_ARGS__); } while (0)
+
 static void initlog(const char *path) {
     LOG_FILE = fopen(path, "a");
 
@@ -35,20 +41,123 @@ static void initlog(const char *path) {
     }
 }
 
+// ============================== Trace ================================
+// File layout: TraceHeader followed by `capacity` TraceRecords used as a
+// ring, record i lives in slot i % capacity. `count` is published after the
+// record is complete so readers never see a half written entry as valid.
+constexpr std::uint32_t TRACE_VERSION = 1;
+constexpr std::uint64_t TRACE_CAPACITY = 1 << 18;
+
+enum TraceFlags : std::uint32_t {
+    TRACE_FORK = 1,
+    TRACE_STOPPED = 2,
+    TRACE_KILLED = 4,
+};
+
+struct TraceHeader {
+    char magic[8];
+    std::uint32_t version;
+    std::uint32_t record_size;
+    std::uint64_t capacity;
+    std::uint64_t count;
+    std::int64_t start_ns;
+    std::int64_t start_realtime_ns;
+    char mode[16];
+};
+
+struct TraceRecord {
+    std::uint64_t iteration;
+    std::int64_t read_ns;    // control word from AFL received
+    std::int64_t resume_ns;  // fork() returned or SIGCONT sent
+    std::int64_t post_ns;    // semaphore lifted, equal to resume_ns after a fork
+    std::int64_t pid_ns;     // pid written to AFL
+    std::int64_t wait_ns;    // waitpid() returned
+    std::int64_t write_ns;   // status written to AFL
+    std::int32_t pid;
+    std::int32_t status;
+    std::uint32_t flags;
+    std::uint32_t reserved;
+};
+
+static_assert(sizeof(TraceHeader) == 64, "trace header layout");
+static_assert(sizeof(TraceRecord) == 72, "trace record layout");
+
+static TraceHeader *TRACE = nullptr;
+static TraceRecord *TRACE_RECORDS = nullptr;
+
+static std::int64_t now_ns(clockid_t clock = CLOCK_MONOTONIC) {
+    timespec ts;
+    clock_gettime(clock, &ts);
+    return std::int64_t(ts.tv_sec) * 1000000000 + ts.tv_nsec;
+}
+
+static void inittrace(const char *path, std::uint64_t capacity, const char *mode) {
+    int fd = open(path, O_RDWR | O_CREAT | O_TRUNC, 0644);
+    if (fd == -1) {
+        log("Failed to open trace file %s: %s\n", path, strerror(errno));
+        return;
+    }
+
+    size_t size = sizeof(TraceHeader) + capacity * sizeof(TraceRecord);
+    if (ftruncate(fd, size) == -1) {
+        log("Failed to size trace file: %s\n", strerror(errno));
+        close(fd);
+        return;
+    }
+
+    void *mem = mmap(nullptr, size, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+    close(fd);
+    if (mem == MAP_FAILED) {
+        log("Failed to map trace file: %s\n", strerror(errno));
+        return;
+    }
+
+    TRACE = reinterpret_cast<TraceHeader *>(mem);
+    TRACE_RECORDS = reinterpret_cast<TraceRecord *>(TRACE + 1);
+
+    memcpy(TRACE->magic, "SRVTRACE", sizeof(TRACE->magic));
+    TRACE->version = TRACE_VERSION;
+    TRACE->record_size = sizeof(TraceRecord);
+    TRACE->capacity = capacity;
+    TRACE->start_ns = now_ns();
+    TRACE->start_realtime_ns = now_ns(CLOCK_REALTIME);
+    strncpy(TRACE->mode, mode ? mode : "", sizeof(TRACE->mode) - 1);
+    __atomic_store_n(&TRACE->count, 0, __ATOMIC_RELEASE);
+}
+
+static void trace(const TraceRecord &record) {
+    if (!TRACE) {
+        return;
+    }
+
+    TRACE_RECORDS[record.iteration % TRACE->capacity] = record;
+    __atomic_store_n(&TRACE->count, record.iteration + 1, __ATOMIC_RELEASE);
+}
+
 static void afl_persistent(const char *path, int argc, char *argv[]);
 
 int main(int argc, char *argv[]) {
     int opt;
     char *path = nullptr;
-    char *log_path = nullptr;
+    char *trace_path = nullptr;
+    char *mode = nullptr;
+    std::uint64_t capacity = TRACE_CAPACITY;
 
-    while ((opt = getopt(argc, argv, "p:l:")) != -1) {
+    while ((opt = getopt(argc, argv, "p:l:t:n:m:v")) != -1) {
         switch (opt) {
             case 'p': path = optarg; break;
             case 'l': initlog(optarg); break;
+            case 't': trace_path = optarg; break;
+            case 'n': capacity = strtoull(optarg, nullptr, 0); break;
+            case 'm': mode = optarg; break;
+            case 'v': VERBOSE = true; break;
         }
     }
 
+    if (trace_path && capacity > 0) {
+        inittrace(trace_path, capacity, mode);
+    }
+
     int new_argc = argc - optind + 1;
     char **new_argv = (char **) calloc(new_argc + 1, sizeof(char *));
     new_argv[0] = basename(path);
@@ -136,10 +245,15 @@ static void afl_persistent(const char *path, int argc, char *argv[]) {
         afl_kill_sig = atoi(afl_kill_signal);
     }
 
+    TraceRecord record = {};
+
     while (true) {
         if (read(AFL_FORKSRV_FD, &was_killed, sizeof(was_killed)) != sizeof(was_killed))
             exit(4);
 
+        record.read_ns = now_ns();
+        record.flags = 0;
+
         if (!child_stopped) {
             child_pid = fork();
             if (child_pid < 0) {
@@ -157,16 +271,20 @@ static void afl_persistent(const char *path, int argc, char *argv[]) {
                     exit(4);
                 }
             } else {
-                log("Spawned child pid = %d\n", child_pid);
+                record.resume_ns = record.post_ns = now_ns();
+                record.flags |= TRACE_FORK;
+                vlog("Spawned child pid = %d\n", child_pid);
             }
         } else {
             kill(child_pid, SIGCONT);
+            record.resume_ns = now_ns();
             child_stopped = false;
-            log("Sending SIGCONT to %d\n", child_pid);
+            vlog("Sending SIGCONT to %d\n", child_pid);
             if (sem_post(&st->sem) == -1) {
                 log("Failed to lift semaphore: %s\n", std::strerror(errno));
                 exit(5);
             }
+            record.post_ns = now_ns();
         }
 
         pid_t pid;
@@ -179,21 +297,26 @@ static void afl_persistent(const char *path, int argc, char *argv[]) {
         if (write(AFL_FORKSRV_FD + 1, &pid, sizeof(pid)) != sizeof(pid))
             exit(5);
 
+        record.pid_ns = now_ns();
+
         if (waitpid(child_pid, &status, WUNTRACED) == -1)
             exit(5);
 
-        log("QEMU state = %X\n", status);
+        record.wait_ns = now_ns();
+        vlog("QEMU state = %X\n", status);
 
         if (WIFSTOPPED(status) && WSTOPSIG(status) == SIGSTOP) {
             child_stopped = true;
+            record.flags |= TRACE_STOPPED;
         } else if (WIFSIGNALED(status)) {
             child_stopped = false;
             was_killed = true;
+            record.flags |= TRACE_KILLED;
             log("QEMU was killed by signal = %d\n", WTERMSIG(status));
         }
 
         if (!was_killed) {
-            log("QEMU OS state = %d\n", st->value);
+            vlog("QEMU OS state = %d\n", st->value);
 
             if (write(AFL_FORKSRV_FD + 1, &st->value, sizeof(st->value)) != sizeof(st->value))
                 exit(7);
@@ -202,5 +325,10 @@ static void afl_persistent(const char *path, int argc, char *argv[]) {
                 exit(7);
         }
 
+        record.write_ns = now_ns();
+        record.pid = child_pid;
+        record.status = status;
+        trace(record);
+        record.iteration++;
     }
 }
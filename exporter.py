@@ -0,0 +1,155 @@
+import asyncio
+import json
+import re
+import time
+from typing import Dict, List, Tuple
+
+CONTENT_TYPES = {
+    'prometheus': 'text/plain; version=0.0.4; charset=utf-8',
+    'json': 'application/json',
+}
+
+def metric_name(field: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9_]', '_', field)
+
+def escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Gauges():
+    def __init__(self) -> None:
+        self.metrics: Dict[str, Tuple[str, str, List[Tuple[Dict, float]]]] = {}
+
+    def add(self, name: str, kind: str, description: str, labels: Dict, value: float | None):
+        if value is None:
+            return
+        self.metrics.setdefault(name, (kind, description, []))[2].append((labels, value))
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, description, samples) in self.metrics.items():
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                label = ','.join(f'{k}="{escape(v)}"' for k, v in labels.items())
+                lines.append(f'{name}{{{label}}} {float(value):.17g}')
+        return '\n'.join(lines) + '\n'
+
+class MetricsExporter():
+    """
+    Serves the live state of every registered benchmark over HTTP, as
+    Prometheus text on /metrics and as JSON on /json
+    """
+    def __init__(self, host: str = '127.0.0.1', port: int = 9464) -> None:
+        self.host = host
+        self.port = port
+        self.benchmarks: Dict[str, object] = {}
+        self.server: asyncio.AbstractServer | None = None
+
+    def register(self, name: str, benchmark):
+        self.benchmarks[name] = benchmark
+
+    def unregister(self, name: str):
+        self.benchmarks.pop(name, None)
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port, reuse_address=True)
+        self.port = self.server.sockets[0].getsockname()[1]
+        print(f"Serving metrics on http://{self.host}:{self.port}/metrics", flush=True)
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    def _instance(self, benchmark, inst, stalled: List[int], now: float) -> Dict:
+        stats = benchmark.stats.instances.get(inst.index)
+        sampler = getattr(benchmark, 'sampler', None)
+        last_seen = stats.last_seen if stats is not None else None
+
+        return {
+            'up': inst.pid() is not None,
+            'stalled': inst.index in stalled,
+            'last_seen': now - last_seen if last_seen is not None else None,
+            'metrics': { field:window.last() for field, window in stats.metrics.items() } if stats is not None else {},
+            'resources': dict(sampler.last.get(inst.index, {})) if sampler is not None else {},
+        }
+
+    def snapshot(self) -> Dict:
+        now = time.monotonic()
+        ret = {}
+
+        for name, benchmark in list(self.benchmarks.items()):
+            stalled = benchmark.stats.stalled()
+            instances = {
+                inst.index:self._instance(benchmark, inst, stalled, now)
+                    for inst in getattr(benchmark, 'instances', [])
+            }
+            ret[name] = {
+                'mode': benchmark.mode,
+                'decoding': benchmark.cfg.testcase_decoding_mode,
+                'elapsed': time.time() - benchmark.started if getattr(benchmark, 'started', None) else 0.0,
+                'up': sum(1 for inst in instances.values() if inst['up']),
+                'stalled': len(stalled),
+                'execs_per_sec': benchmark.stats.aggregate('execs_per_sec'),
+                'total_crashes': benchmark.stats.aggregate('total_crashes'),
+                'instances': instances,
+            }
+        return ret
+
+    def prometheus(self) -> str:
+        gauges = Gauges()
+
+        for name, bench in self.snapshot().items():
+            labels = { 'benchmark': name, 'mode': bench['mode'], 'decoding': bench['decoding'] }
+            gauges.add('benchmark_elapsed_seconds', 'gauge', "Seconds since the benchmark started", labels, bench['elapsed'])
+            gauges.add('benchmark_instances_up', 'gauge', "Instances with a running AFL process", labels, bench['up'])
+            gauges.add('benchmark_instances_stalled', 'gauge', "Instances without statsd data or progress", labels, bench['stalled'])
+            gauges.add('benchmark_execs_per_sec', 'gauge', "Sum of the latest execs_per_sec of all instances", labels, bench['execs_per_sec'].get('total'))
+            gauges.add('benchmark_crashes', 'gauge', "Sum of the latest total_crashes of all instances", labels, bench['total_crashes'].get('total'))
+
+            for index, inst in bench['instances'].items():
+                inst_labels = dict(labels, instance=str(index))
+                gauges.add('instance_up', 'gauge', "1 while the AFL process of the instance runs", inst_labels, int(inst['up']))
+                gauges.add('instance_stalled', 'gauge', "1 while the instance is considered stalled", inst_labels, int(inst['stalled']))
+                gauges.add('instance_last_seen_seconds', 'gauge', "Seconds since the last statsd datagram", inst_labels, inst['last_seen'])
+
+                for field, value in inst['metrics'].items():
+                    gauges.add(f'afl_{metric_name(field)}', 'gauge', f"Latest AFL statsd {field}", inst_labels, value)
+
+                for field, value in inst['resources'].items():
+                    component, _, kind = field.partition('_')
+                    if kind == 'rss':
+                        gauges.add('instance_rss_bytes', 'gauge', "Resident memory of the instance's processes", dict(inst_labels, component=component), value)
+                    elif kind == 'cpu':
+                        gauges.add('instance_cpu_seconds_total', 'counter', "CPU time used by the instance's processes", dict(inst_labels, component=component), value)
+
+        return gauges.render()
+
+    def _respond(self, path: str) -> Tuple[str, str, str]:
+        if path in ('/metrics', '/'):
+            return '200 OK', CONTENT_TYPES['prometheus'], self.prometheus()
+        if path in ('/json', '/metrics.json'):
+            return '200 OK', CONTENT_TYPES['json'], json.dumps(self.snapshot(), indent=2)
+        return '404 Not Found', 'text/plain', 'not found\n'
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            while (await asyncio.wait_for(reader.readline(), 5)).strip():
+                pass
+
+            parts = request.decode(errors='replace').split()
+            if len(parts) < 2 or parts[0] not in ('GET', 'HEAD'):
+                status, content_type, body = '405 Method Not Allowed', 'text/plain', 'GET only\n'
+            else:
+                status, content_type, body = self._respond(parts[1].split('?')[0])
+
+            data = body.encode()
+            writer.write(
+                f'HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(data)}\r\nConnection: close\r\n\r\n'.encode()
+                + (data if parts and parts[0] != 'HEAD' else b''))
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -3,81 +3,67 @@
 import argparse
 from typing import Dict
 import matplotlib.pyplot as plt
-import os
+import numpy as np
 import datetime
 
-from metric import METRIC
+from metric import METRIC, TIMELINE_METRICS, timeline
+from metricstore import MetricStore
+from resample import DOWNSAMPLE, align, downsample
 
 class LinePlot():
     def __init__(self) -> None:
-        pass
+        self.store = MetricStore()
 
-    def _read_metrics(self, data_dir: str, subdir: str) -> Dict[str, str]:
-        with open(os.path.join(data_dir, subdir, 'metric.log')) as file:
-            lines = file.readlines()
-
-        ret = {}
-        for line in lines:
-            name, value = line.split(':')
-            _, field = name.split('.', 1)
-            val, _ = value.split('|', 1)
-
-            if field not in ret:
-                ret[field] = []
-
-            ret[field].append(float(val))
-
-        return ret
-
-    def _read_data(self, data_dir: str) -> Dict[str, Dict[str, str]]:
-        dirs = os.listdir(data_dir)
-        data = {
-            i:self._read_metrics(data_dir, i)
-                for i in dirs
-        }
-
-        return data
+    def _read_data(self, data_dir: str) -> Dict[str, Dict[str, np.ndarray]]:
+        return self.store.read_data(data_dir)
 
     def _filter_metric(self, data, metric: str):
-        for _, i in data.items():
-            print(i.keys())
-
-        return {
-            index:instance[metric] for index, instance in data.items()
-        }
+        return self.store.filter_metric(data, metric)
 
     def _prepare_data(self, metric: str, data_dir: str):
         return self._filter_metric(self._read_data(data_dir), metric)
 
-    def plot(self, metric: str, data_dir: str, time: float, ticks: int):
+    def _prepare_timeline(self, metric: str, data_dir: str, time: float | None, step: float, baseline: str | None = None):
+        return align(timeline(metric, self.store, data_dir, time, baseline), step, end=time)
+
+    def plot(self, metric: str, data_dir: str, time: float | None, ticks: int, step: float = 1.0, points: int = 2000, method: str = 'lttb', baseline: str | None = None):
         cfg = METRIC[metric]
-        data = self._prepare_data(cfg.metric, data_dir)
-        maxticks = max(len(Y) for _, Y in data.items())
-        xticks = range(0, maxticks, maxticks // ticks)
-        labels = [ datetime.timedelta(seconds=time * i / len(xticks)) for i in range(0, len(xticks)) ]
-        print(xticks, labels)
+        grid, data = self._prepare_timeline(metric, data_dir, time, step, baseline)
+        if len(grid) == 0 or not any(np.isfinite(Y).any() for Y in data.values()):
+            raise ValueError(f"No {metric} samples in {data_dir}")
+        end = time if time is not None else grid[-1]
+        xticks = [ end * i / ticks for i in range(0, ticks + 1) ]
+        labels = [ datetime.timedelta(seconds=int(i)) for i in xticks ]
         plt.xticks(xticks, labels, rotation=45)
+        plt.xlim(0, end)
         plt.xlabel("Time in hours:minutes:seconds")
         plt.ylabel(cfg.ylabel)
         plt.title(data_dir.replace(".", "").replace("/", ""))
         plt.tight_layout()
 
-
         for _, Y in data.items():
-            plt.plot(Y)
+            plt.plot(*downsample(grid, Y, points, method))
 
 def main():
     parser = argparse.ArgumentParser("Line plot")
     parser.add_argument('metric_dir', type=str, help="Directory with metrics to read")
-    parser.add_argument('--metric', choices=METRIC.keys(), help="Metric to plot")
+    parser.add_argument('--metric', choices=TIMELINE_METRICS, default='execs/s', help="Metric to plot")
+    parser.add_argument('--baseline', required=False, type=str, help="norevert benchmark directory for relative metrics")
     parser.add_argument('--total-time', type=float, help="Total execution time")
     parser.add_argument('--ticks', default=10, type=int, help="Number of ticks on xaxis")
+    parser.add_argument('--step', default=1.0, type=float, help="Seconds between points of the common time grid")
+    parser.add_argument('--points', default=2000, type=int, help="Points drawn per instance")
+    parser.add_argument('--downsample', choices=list(DOWNSAMPLE.keys()) + ['none'], default='lttb', help="Downsampling method")
     parser.add_argument('--save', required=False, type=str, help="Save figure to file")
     parser.add_argument('--show', required=False, action='store_true', help="Show the generated figure")
     args = parser.parse_args()
 
     plot = LinePlot()
-    plot.plot(args.metric, args.metric_dir, args.total_time, args.ticks)
+    try:
+        plot.plot(args.metric, args.metric_dir, args.total_time, args.ticks, args.step, args.points, args.downsample, args.baseline)
+    except ValueError as e:
+        # No samples or no baseline for the metric, not a bug
+        parser.exit(1, f"{e}\n")
 
     if args.save is not None:
         plt.savefig(args.save)
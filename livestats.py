@@ -0,0 +1,176 @@
+import math
+import time
+from collections import deque
+from typing import Deque, Dict, Iterator, List, Tuple
+
+QUANTILES = [0.1, 0.5, 0.9]
+
+def parse_statsd(data: bytes) -> Iterator[Tuple[str, float]]:
+    for line in data.split(b'\n'):
+        name, sep, rest = line.partition(b':')
+        if not sep:
+            continue
+
+        _, _, field = name.partition(b'.')
+        field, _, _ = field.partition(b',')
+        value, _, _ = rest.partition(b'|')
+
+        try:
+            yield field.decode(), float(value)
+        except ValueError:
+            continue
+
+def quantile(values: List[float], q: float) -> float:
+    pos = (len(values) - 1) * q
+    lo = math.floor(pos)
+    hi = math.ceil(pos)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+def describe(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+
+    values = sorted(values)
+    ret = {
+        'count': len(values),
+        'mean': sum(values) / len(values),
+        'min': values[0],
+        'max': values[-1],
+    }
+
+    for q in QUANTILES:
+        ret[f'p{int(q * 100)}'] = quantile(values, q)
+
+    return ret
+
+class RollingWindow():
+    def __init__(self, window: float) -> None:
+        self.window = window
+        self.samples: Deque[Tuple[float, float]] = deque()
+
+    def add(self, t: float, value: float):
+        self.samples.append((t, value))
+        self.evict(t)
+
+    def evict(self, now: float):
+        while self.samples and self.samples[0][0] < now - self.window:
+            self.samples.popleft()
+
+    def values(self) -> List[float]:
+        return [ v for _, v in self.samples ]
+
+    def last(self) -> float | None:
+        return self.samples[-1][1] if self.samples else None
+
+    def rate(self) -> float:
+        if len(self.samples) < 2:
+            return 0.0
+
+        (t0, v0), (t1, v1) = self.samples[0], self.samples[-1]
+        return (v1 - v0) / (t1 - t0) if t1 > t0 else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        ret = describe(self.values())
+        if ret:
+            ret['rate'] = self.rate()
+        return ret
+
+class InstanceStats():
+    def __init__(self, window: float) -> None:
+        self.window = window
+        self.metrics: Dict[str, RollingWindow] = {}
+        self.started = time.monotonic()
+        self.last_seen: float | None = None
+
+    def add(self, t: float, field: str, value: float):
+        if field not in self.metrics:
+            self.metrics[field] = RollingWindow(self.window)
+
+        self.metrics[field].add(t, value)
+        self.last_seen = t
+
+    def stats(self, field: str) -> Dict[str, float]:
+        if field not in self.metrics:
+            return {}
+        return self.metrics[field].stats()
+
+class LiveStats():
+    def __init__(self, window: float = 300, stall_after: float = 60) -> None:
+        self.window = window
+        self.stall_after = stall_after
+        self.instances: Dict[int, InstanceStats] = {}
+
+    def instance(self, index: int) -> InstanceStats:
+        if index not in self.instances:
+            self.instances[index] = InstanceStats(self.window)
+        return self.instances[index]
+
+    def feed(self, index: int, data: bytes):
+        inst = self.instance(index)
+        now = time.monotonic()
+
+        for field, value in parse_statsd(data):
+            inst.add(now, field, value)
+
+    def stats(self, index: int, field: str) -> Dict[str, float]:
+        inst = self.instances.get(index)
+        if inst is None:
+            return {}
+
+        for window in inst.metrics.values():
+            window.evict(time.monotonic())
+        return inst.stats(field)
+
+    def aggregate(self, field: str) -> Dict[str, float]:
+        now = time.monotonic()
+        values = []
+        total = 0.0
+        rate = 0.0
+
+        for inst in self.instances.values():
+            window = inst.metrics.get(field)
+            if window is None:
+                continue
+
+            window.evict(now)
+            values += window.values()
+            total += window.last() or 0.0
+            rate += window.rate()
+
+        ret = describe(values)
+        if ret:
+            ret['total'] = total
+            ret['rate'] = rate
+        return ret
+
+    def stalled(self) -> List[int]:
+        now = time.monotonic()
+        ret = []
+
+        for index, inst in self.instances.items():
+            execs = inst.metrics.get('execs_per_sec')
+            if now - (inst.last_seen or inst.started) > self.stall_after:
+                ret.append(index)
+            elif execs is not None and not any(execs.values()):
+                ret.append(index)
+
+        return sorted(ret)
+
+    def summary_line(self) -> str:
+        speed = self.aggregate('execs_per_sec')
+        crashes = self.aggregate('total_crashes')
+
+        if not speed:
+            return "waiting for statsd"
+
+        line = (
+            f"execs/s total={speed['total']:.1f} mean={speed['mean']:.2f} "
+            f"min={speed['min']:.2f} p50={speed['p50']:.2f} max={speed['max']:.2f} "
+            f"crashes={crashes.get('total', 0):.0f} (+{crashes.get('rate', 0) * 3600:.1f}/h)"
+        )
+
+        stalled = self.stalled()
+        if stalled:
+            line += f" stalled={','.join(str(i) for i in stalled)}"
+
+        return line
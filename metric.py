@@ -1,11 +1,188 @@
 from dataclasses import dataclass
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+
+from epochs import load_epochs, stitch
+from metricstore import MetricStore
+from sketch import QuantileSketch, merge_all
+
+Series = Tuple[np.ndarray, np.ndarray]
+
+GB = 10 ** 9
+COMPONENTS = ['afl', 'srv', 'qemu']
+
+class MetricData():
+    """
+    Inputs of the metric formulas for one benchmark directory, every series
+    is read once and shares the time origin of the experiment
+    """
+    def __init__(self, store: MetricStore, data_dir: str, duration: float | None = None, baseline: str | None = None) -> None:
+        self.store = store
+        self.data_dir = data_dir
+        self.duration = duration
+        self.baseline = baseline
+        self.start = store.start_time(data_dir)
+        self.fields: Dict[str, Dict[str, Series]] = {}
+        self.resource_columns: Dict[str, Dict[str, np.ndarray]] | None = None
+
+    def field(self, name: str) -> Dict[str, Series]:
+        if name not in self.fields:
+            self.fields[name] = self.store.read_timeline(self.data_dir, name, self.duration, start=self.start)
+        return self.fields[name]
+
+    def resources(self) -> Dict[str, Dict[str, np.ndarray]]:
+        """
+        Resource samples per instance on the metric timeline, CPU seconds
+        accumulate across restarts and epochs
+        """
+        if self.resource_columns is not None:
+            return self.resource_columns
+
+        self.resource_columns = {}
+        if self.start is None:
+            # Without a time index the samples cannot be matched to the metrics
+            return self.resource_columns
+
+        epochs = load_epochs(self.data_dir)
+        for index, columns in self.store.read_resources(self.data_dir).items():
+            order = np.argsort(columns['time'], kind='stable')
+            columns = { name:column[order] for name, column in columns.items() }
+            # Every process restarts its own counter, e.g. QEMU alone after a crash
+            cpu = sum(accumulate(columns[f'{name}_cpu']) for name in COMPONENTS)
+            rss = sum(columns[f'{name}_rss'] for name in COMPONENTS)
+            self.resource_columns[index] = {
+                'time': stitch(columns['time'], epochs) - self.start,
+                'cpu': cpu,
+                'rss': rss,
+            }
+        return self.resource_columns
+
+def accumulate(counter: np.ndarray) -> np.ndarray:
+    """
+    Total of a counter that restarts from zero whenever its process does
+    """
+    if counter.size == 0:
+        return counter
+    steps = np.diff(counter)
+    return np.concatenate(([counter[0]], np.where(steps < 0, counter[1:], steps))).cumsum()
+
+def hold(times: np.ndarray, values: np.ndarray, at: np.ndarray) -> np.ndarray:
+    """
+    Last value of a series at every time of `at`, NaN before its first sample
+    """
+    index = np.searchsorted(times, at, side='right') - 1
+    ret = values[np.maximum(index, 0)].astype(np.float64) if len(values) else np.full(len(at), np.nan)
+    ret[index < 0] = np.nan
+    return ret
+
+def _finite(times: np.ndarray, values: np.ndarray) -> Series:
+    keep = np.isfinite(values)
+    return times[keep], values[keep]
+
+def crashes_per_core_hour(data: MetricData) -> Dict[str, Series]:
+    resources = data.resources()
+    ret = {}
+    for index, (times, crashes) in data.field('total_crashes').items():
+        usage = resources.get(index)
+        if usage is not None and len(usage['time']):
+            hours = hold(usage['time'], usage['cpu'], times) / 3600
+        else:
+            # Without resource samples every instance counts as one busy core
+            hours = times / 3600
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ret[index] = _finite(times, np.where(hours > 0, crashes / hours, np.nan))
+    return ret
+
+def execs_per_gb(data: MetricData) -> Dict[str, Series]:
+    resources = data.resources()
+    ret = {}
+    for index, (times, execs) in data.field('execs_per_sec').items():
+        usage = resources.get(index)
+        if usage is None or len(usage['time']) == 0:
+            continue
+        gb = hold(usage['time'], usage['rss'], times) / GB
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ret[index] = _finite(times, np.where(gb > 0, execs / gb, np.nan))
+    return ret
+
+def instance_ram(data: MetricData) -> Dict[str, Series]:
+    return {
+        index:(usage['time'], usage['rss'] / GB)
+            for index, usage in data.resources().items() if len(usage['time'])
+    }
+
+def revert_overhead(data: MetricData) -> Dict[str, Series]:
+    """
+    Extra time per execution compared to the mean speed of the baseline,
+    normally a norevert run of the same target
+    """
+    if data.baseline is None:
+        raise ValueError("revert overhead needs a norevert baseline directory")
+
+    sketches = data.store.read_sketches(data.baseline, 'execs_per_sec')
+    if not sketches:
+        raise ValueError(f"{data.baseline} has no execs_per_sec samples")
+    baseline = merge_all(sketches.values()).mean()
+
+    ret = {}
+    for index, (times, execs) in data.field('execs_per_sec').items():
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ret[index] = _finite(times, np.where(execs > 0, (baseline / execs - 1) * 100, np.nan))
+    return ret
+
+def time_to_crash(n: int) -> Callable[[MetricData], Dict[str, Series]]:
+    """
+    Seconds until an instance reported its `n`th crash, instances that never
+    got there are left out
+    """
+    def formula(data: MetricData) -> Dict[str, Series]:
+        ret = {}
+        for index, (times, crashes) in data.field('total_crashes').items():
+            reached = np.flatnonzero(crashes >= n)
+            if reached.size:
+                ret[index] = (times[reached[:1]], times[reached[:1]])
+        return ret
+    return formula
 
 @dataclass()
 class MetricConfig():
     ylabel: str
     metric: str
     title: str
+    # Derived metrics compute their per-instance series from MetricData
+    formula: Callable[[MetricData], Dict[str, Series]] | None = None
+    # One value per instance instead of a series, nothing to draw over time
+    timeline: bool = True
+
+    @property
+    def derived(self) -> bool:
+        return self.formula is not None
 
 METRIC = {
-    'execs/s': MetricConfig('Test case executions per seconds', 'execs_per_sec', "Fuzzing speed comparison")
+    'execs/s': MetricConfig('Test case executions per seconds', 'execs_per_sec', "Fuzzing speed comparison"),
+    'crashes': MetricConfig('Crashes found', 'total_crashes', "Crashes found"),
+    'crashes/core-h': MetricConfig('Crashes per CPU core hour', 'crashes/core-h', "Crash discovery efficiency", crashes_per_core_hour),
+    'execs/s/GB': MetricConfig('Test case executions per second per GB of RAM', 'execs/s/GB', "Memory efficiency", execs_per_gb),
+    'ram': MetricConfig('Instance RAM in GB', 'ram', "RAM usage per instance", instance_ram),
+    'revert-overhead': MetricConfig('Time per execution over norevert in %', 'revert-overhead', "Revert overhead", revert_overhead),
+    'time-to-1st-crash': MetricConfig('Seconds to the first crash', 'time-to-1st-crash', "Time to first crash", time_to_crash(1), timeline=False),
+    'time-to-10th-crash': MetricConfig('Seconds to the 10th crash', 'time-to-10th-crash', "Time to 10th crash", time_to_crash(10), timeline=False),
 }
+
+TIMELINE_METRICS = [ name for name, cfg in METRIC.items() if cfg.timeline ]
+
+def timeline(name: str, store: MetricStore, data_dir: str, duration: float | None = None, baseline: str | None = None) -> Dict[str, Series]:
+    cfg = METRIC[name]
+    if not cfg.derived:
+        return store.read_timeline(data_dir, cfg.metric, duration)
+    return cfg.formula(MetricData(store, data_dir, duration, baseline))
+
+def sketches(name: str, store: MetricStore, data_dir: str, baseline: str | None = None) -> Dict[str, QuantileSketch]:
+    cfg = METRIC[name]
+    if not cfg.derived:
+        return store.read_sketches(data_dir, cfg.metric)
+    return {
+        index:QuantileSketch.of(values)
+            for index, (_, values) in timeline(name, store, data_dir, baseline=baseline).items() if len(values)
+    }
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from collector import TIME_SUFFIX
+from epochs import load_epochs, stitch as stitch_epochs
+from sketch import QuantileSketch
+
+METRIC_LOG = 'metric.log'
+RAM_LOG = 'ram.log'
+RESOURCES_LOG = 'resources.csv'
+CACHE_SUFFIX = '.npz'
+CACHE_VERSION = 4
+SKETCH_PREFIX = '__sketch__'
+TIME_PREFIX = '__time__'
+TIME_DTYPE = np.dtype([('end', '<u8'), ('time', '<f8')])
+
+def _to_float(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Values of the statsd lines and which of them are numbers, a malformed
+    line, e.g. an empty value, is dropped like livestats does
+    """
+    try:
+        return values.astype(np.float64), np.ones(len(values), dtype=bool)
+    except ValueError:
+        pass
+
+    ret = np.full(len(values), np.nan)
+    parsed = np.zeros(len(values), dtype=bool)
+    for i, value in enumerate(values):
+        try:
+            ret[i] = float(value)
+            parsed[i] = True
+        except ValueError:
+            pass
+    return ret, parsed
+
+class MetricStore():
+    def __init__(self, log_name: str = METRIC_LOG, use_cache: bool = True) -> None:
+        self.log_name = log_name
+        self.use_cache = use_cache
+
+    def cache_path(self, log: str) -> str:
+        return log + CACHE_SUFFIX
+
+    def _stamp(self, log: str) -> np.ndarray:
+        st = os.stat(log)
+        try:
+            ts = os.stat(log + TIME_SUFFIX)
+            index = [ts.st_size, ts.st_mtime_ns]
+        except OSError:
+            index = [-1, -1]
+        return np.array([CACHE_VERSION, st.st_size, st.st_mtime_ns] + index, dtype=np.int64)
+
+    def _read_index(self, log: str) -> np.ndarray | None:
+        try:
+            with open(log + TIME_SUFFIX, 'rb') as file:
+                raw = file.read()
+        except OSError:
+            return None
+        return np.frombuffer(raw[:len(raw) - len(raw) % TIME_DTYPE.itemsize], dtype=TIME_DTYPE)
+
+    def _parse(self, raw: bytes, index: np.ndarray | None = None) -> Dict[str, np.ndarray]:
+        lines = np.array(raw.split(b'\n'))
+        starts = np.cumsum(np.char.str_len(lines) + 1) - np.char.str_len(lines) - 1
+        keep = np.char.find(lines, b':') >= 0
+        lines = lines[keep]
+
+        if lines.size == 0:
+            return {}
+
+        # afl.<field>[,tags]:<value>|<type>[|tags]
+        name, _, rest = np.char.partition(lines, b':').T
+        values, parsed = _to_float(np.char.partition(rest, b'|')[:, 0])
+        if not parsed.all():
+            keep[np.flatnonzero(keep)[~parsed]] = False
+            name, values = name[parsed], values[parsed]
+            if values.size == 0:
+                return {}
+        field = np.char.partition(np.char.partition(name, b'.')[:, 2], b',')[:, 0]
+
+        fields, inverse = np.unique(field, return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.cumsum(np.bincount(inverse, minlength=len(fields)))[:-1]
+        names = [ field.decode() for field in fields ]
+
+        ret = dict(zip(names, np.split(values[order], bounds)))
+
+        if index is not None and len(index):
+            # A line belongs to the first datagram that ends after its start,
+            # lines past the end of the index were never flushed with a time
+            datagram = np.searchsorted(index['end'], starts[keep], side='right')
+            times = index['time'][np.minimum(datagram, len(index) - 1)]
+            times[datagram >= len(index)] = np.nan
+            ret.update({
+                TIME_PREFIX + name:column
+                    for name, column in zip(names, np.split(times[order], bounds))
+            })
+
+        return ret
+
+    @staticmethod
+    def _kind(key: str) -> str | None:
+        if key == '__stamp__':
+            return None
+        for prefix in (SKETCH_PREFIX, TIME_PREFIX):
+            if key.startswith(prefix):
+                return prefix
+        return ''
+
+    def _load_cache(self, cache: str, stamp: np.ndarray, kind: str) -> Dict[str, np.ndarray] | None:
+        try:
+            with np.load(cache) as data:
+                if not np.array_equal(data['__stamp__'], stamp):
+                    return None
+
+                return {
+                    key:data[key]
+                        for key in data.files if self._kind(key) == kind
+                }
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def _save_cache(self, cache: str, stamp: np.ndarray, entries: Dict[str, np.ndarray]):
+        tmp = f"{cache}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, 'wb') as file:
+                np.savez(file, __stamp__=stamp, **entries)
+            os.replace(tmp, cache)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _load(self, log: str, kind: str) -> Dict[str, np.ndarray]:
+        stamp = self._stamp(log)
+        cache = self.cache_path(log)
+
+        if self.use_cache:
+            entries = self._load_cache(cache, stamp, kind)
+            if entries is not None:
+                return entries
+
+        with open(log, 'rb') as file:
+            entries = self._parse(file.read(), self._read_index(log))
+
+        entries.update({
+            SKETCH_PREFIX + field:QuantileSketch.of(values).to_array()
+                for field, values in entries.items() if self._kind(field) == ''
+        })
+
+        if self.use_cache:
+            self._save_cache(cache, stamp, entries)
+
+        return { key:value for key, value in entries.items() if self._kind(key) == kind }
+
+    def load(self, log: str) -> Dict[str, np.ndarray]:
+        return self._load(log, '')
+
+    def load_sketches(self, log: str) -> Dict[str, QuantileSketch]:
+        return {
+            key[len(SKETCH_PREFIX):]:QuantileSketch.from_array(value)
+                for key, value in self._load(log, SKETCH_PREFIX).items()
+        }
+
+    def load_times(self, log: str) -> Dict[str, np.ndarray]:
+        return {
+            key[len(TIME_PREFIX):]:value
+                for key, value in self._load(log, TIME_PREFIX).items()
+        }
+
+    def instances(self, data_dir: str):
+        is_instance = lambda x: os.path.isfile(os.path.join(data_dir, x, self.log_name))
+        names = filter(is_instance, os.listdir(data_dir))
+        return sorted(names, key=lambda x: (not x.isdigit(), int(x) if x.isdigit() else 0, x))
+
+    def read_metrics(self, data_dir: str, subdir: str) -> Dict[str, np.ndarray]:
+        return self.load(os.path.join(data_dir, subdir, self.log_name))
+
+    def read_data(self, data_dir: str) -> Dict[str, Dict[str, np.ndarray]]:
+        return {
+            i:self.read_metrics(data_dir, i)
+                for i in self.instances(data_dir)
+        }
+
+    def filter_metric(self, data: Dict[str, Dict[str, np.ndarray]], metric: str) -> Dict[str, np.ndarray]:
+        return {
+            index:instance[metric] for index, instance in data.items() if metric in instance
+        }
+
+    def prepare_data(self, metric: str, data_dir: str) -> Dict[str, np.ndarray]:
+        return self.filter_metric(self.read_data(data_dir), metric)
+
+    def read_sketches(self, data_dir: str, metric: str) -> Dict[str, QuantileSketch]:
+        ret = {}
+        for i in self.instances(data_dir):
+            sketches = self.load_sketches(os.path.join(data_dir, i, self.log_name))
+            if metric in sketches:
+                ret[i] = sketches[metric]
+        return ret
+
+    def start_time(self, data_dir: str) -> float | None:
+        """
+        Arrival time of the first sample of any metric, None for logs
+        recorded without a time index
+        """
+        firsts = [
+            np.nanmin(times)
+                for i in self.instances(data_dir)
+                for times in self.load_times(os.path.join(data_dir, i, self.log_name)).values()
+                if np.isfinite(times).any()
+        ]
+        return float(min(firsts)) if firsts else None
+
+    def read_timeline(self, data_dir: str, metric: str, duration: float | None = None, stitch: bool = True, start: float | None = None) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """
+        Samples of `metric` per instance with their arrival time in seconds
+        since `start`, by default the first sample of the experiment. Logs
+        recorded without a time index are spread evenly over `duration`, or
+        one second apart. The epochs of a resumed benchmark are joined without
+        the time between them unless `stitch` is off.
+        """
+        epochs = load_epochs(data_dir) if stitch else []
+        ret = {}
+        for i in self.instances(data_dir):
+            log = os.path.join(data_dir, i, self.log_name)
+            values = self.load(log).get(metric)
+            if values is None:
+                continue
+            times = self.load_times(log).get(metric)
+            if times is not None and len(epochs) > 1:
+                times = stitch_epochs(times, epochs)
+            ret[i] = (times, values)
+
+        if start is None:
+            start = min((np.nanmin(t) for t, _ in ret.values() if t is not None and np.isfinite(t).any()), default=0.0)
+        for i, (times, values) in ret.items():
+            if times is None:
+                step = duration / len(values) if duration and len(values) else 1.0
+                times = np.arange(len(values)) * step
+            else:
+                times = times - start
+            finite = np.isfinite(times)
+            ret[i] = (times[finite], values[finite])
+        return ret
+
+    def read_ram(self, data_dir: str) -> Dict[str, np.ndarray]:
+        with open(os.path.join(data_dir, RAM_LOG)) as file:
+            samples = [ json.loads(i) for i in file if i.strip() ]
+
+        keys = { key for sample in samples for key in sample }
+        return {
+            key:np.array([ sample.get(key, np.nan) for sample in samples ], dtype=np.float64)
+                for key in keys
+        }
+
+    def read_resources(self, data_dir: str) -> Dict[str, Dict[str, np.ndarray]]:
+        """
+        Columns of the resource samples per instance, empty if the benchmark
+        ran without the sampler
+        """
+        path = os.path.join(data_dir, RESOURCES_LOG)
+        if not os.path.isfile(path):
+            return {}
+
+        # A line cut off by a killed run is skipped
+        table = np.atleast_1d(np.genfromtxt(path, delimiter=',', names=True, dtype=np.float64, invalid_raise=False))
+        if table.size == 0:
+            return {}
+
+        instances = table['instance'].astype(np.int64)
+        return {
+            str(index):{ name:table[name][instances == index] for name in table.dtype.names }
+                for index in np.unique(instances)
+        }
+
+    def sources(self, data_dir: str) -> List[str]:
+        ret = [ os.path.join(data_dir, i, self.log_name) for i in self.instances(data_dir) ]
+        if os.path.isfile(os.path.join(data_dir, RAM_LOG)):
+            ret.append(os.path.join(data_dir, RAM_LOG))
+        return ret
+
+def main():
+    parser = argparse.ArgumentParser("Metric store")
+    parser.add_argument('metric_dirs', type=str, help="Benchmark directories to index", nargs='+')
+    parser.add_argument('--rebuild', required=False, action='store_true', help="Ignore existing caches")
+    args = parser.parse_args()
+
+    store = MetricStore()
+    for data_dir in args.metric_dirs:
+        for name in store.instances(data_dir):
+            log = os.path.join(data_dir, name, store.log_name)
+            if args.rebuild and os.path.isfile(store.cache_path(log)):
+                os.remove(store.cache_path(log))
+
+            metrics = store.load(log)
+            print(f"{log}: " + ", ".join(f"{k}={len(v)}" for k, v in metrics.items()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import shlex
+import shutil
+import socket
+import tempfile
+import time
+from dataclasses import asdict
+from typing import Dict, List
+
+import numpy as np
+
+from benchmark import Benchmark, FuzzerConfig, FuzzerInstance, bind_consoles, prepare_dir
+from collector import Collector
+from metricstore import MetricStore
+from run import prepare_afl_args, prepare_env, prepare_execsrv_args, prepare_qemu_args, run_fuzzer
+from standin import STANDIN_STATS, StandinConfig, install
+
+VERSION = 2
+
+def describe(values: List[float]) -> Dict[str, float]:
+    values = np.asarray(values, dtype=np.float64)
+    return {
+        'n': int(values.size),
+        'median': float(np.median(values)),
+        'p90': float(np.percentile(values, 90)),
+        'min': float(values.min()),
+        'max': float(values.max()),
+    }
+
+def standin_stats(out_dir: str) -> Dict | None:
+    for root, _, files in os.walk(out_dir, followlinks=True):
+        if STANDIN_STATS in files:
+            try:
+                with open(os.path.join(root, STANDIN_STATS)) as file:
+                    return json.load(file)
+            except (OSError, ValueError):
+                return None
+    return None
+
+def bench_args(tree: Dict[str, str], iterations: int) -> Dict:
+    """
+    Building the AFL, execsrv and QEMU command lines and splitting them again
+    """
+    base = FuzzerConfig(fast=True, **tree)
+    prepare, build, split = [], [], []
+
+    for index in range(iterations):
+        start = time.perf_counter()
+        options = argparse.Namespace(**asdict(base.prepare(index, 'bench')))
+        options.testcase = '@@'
+        options.kernel_args = 'fuzz'
+        middle = time.perf_counter()
+        cmd = f"afl-fuzz {prepare_afl_args(options)} -- srv {prepare_execsrv_args(options)} -- {prepare_qemu_args(options)}"
+        prepare_env(options)
+        end = time.perf_counter()
+        shlex.split(cmd)
+        prepare.append(middle - start)
+        build.append(end - middle)
+        split.append(time.perf_counter() - end)
+
+    return {
+        'prepare_us': describe(np.array(prepare) * 10 ** 6),
+        'build_us': describe(np.array(build) * 10 ** 6),
+        'shlex_us': describe(np.array(split) * 10 ** 6),
+    }
+
+async def wait_first_exec(out_dir: str, timeout: float) -> Dict | None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = standin_stats(out_dir)
+        if stats is not None and stats['first_exec'] is not None:
+            return stats
+        await asyncio.sleep(0.005)
+    return None
+
+async def bench_launch(tree: Dict[str, str], work: str, repeat: int, timeout: float) -> Dict:
+    """
+    run.run_fuzzer end to end: command building and process start in this
+    process, then interpreter start, forkserver handshake and the first
+    test case in the stand-in
+    """
+    phases = { 'run_fuzzer': [], 'afl_start': [], 'handshake': [], 'first_exec': [] }
+
+    for rep in range(repeat):
+        subdir = os.path.join(work, f'launch-{rep}')
+        cfg = FuzzerConfig(fast=True, **tree).prepare(0, subdir)
+        os.makedirs(cfg.input)
+        os.makedirs(cfg.output)
+
+        collector = Collector()
+        await bind_consoles(cfg, collector, os.path.join(subdir, 'normal.log'), os.path.join(subdir, 'secure.log'),
+                            os.path.join(subdir, 'console'))
+        task = asyncio.create_task(collector.run())
+
+        start = time.time()
+        process = run_fuzzer(argparse.Namespace(**asdict(cfg)))
+        launched = time.time()
+        stats = await wait_first_exec(cfg.output, timeout)
+
+        process.terminate()
+        await asyncio.to_thread(process.communicate)
+        collector.stop()
+        await task
+
+        if stats is None:
+            raise RuntimeError(f"Stand-in did not execute a test case within {timeout}s, see {subdir}")
+
+        phases['run_fuzzer'].append(launched - start)
+        phases['afl_start'].append(stats['started'] - start)
+        phases['handshake'].append(stats['handshake'] - start)
+        phases['first_exec'].append(stats['first_exec'] - start)
+
+    return { f'{name}_ms':describe(np.array(values) * 1000) for name, values in phases.items() }
+
+def make_corpus(path: str, files: int, size: int):
+    os.makedirs(path, exist_ok=True)
+    rng = np.random.default_rng(0)
+    for i in range(files):
+        with open(os.path.join(path, f'id:{i:06d}'), 'wb') as file:
+            file.write(rng.bytes(size))
+
+async def bench_setup(tree: Dict[str, str], work: str, corpus: str, counts: List[int], repeat: int) -> Dict:
+    """
+    Benchmark.setup: corpus ingest, per instance directories and seeding
+    """
+    ret = {}
+    for count in counts:
+        total, slowest, ingest = [], [], []
+        for rep in range(repeat):
+            benchmark_dir = os.path.join(work, f'setup-{count}-{rep}')
+            await prepare_dir(benchmark_dir)
+            benchmark = Benchmark('fast', benchmark_dir, corpus, 'dsl')
+            benchmark.cfg = FuzzerConfig(fast=True, **tree)
+            instances = [ FuzzerInstance(benchmark.cfg) for _ in range(count) ]
+            await benchmark.setup(instances)
+
+            with open(os.path.join(benchmark_dir, 'setup.json')) as file:
+                setup = json.load(file)
+            total.append(setup['total'])
+            ingest.append(setup['corpus']['time'])
+            slowest.append(max(inst['time'] for inst in setup['instances'].values()))
+
+        ret[str(count)] = {
+            'total_ms': describe(np.array(total) * 1000),
+            'ingest_ms': describe(np.array(ingest) * 1000),
+            'slowest_instance_ms': describe(np.array(slowest) * 1000),
+        }
+    return ret
+
+def send_datagrams(port: int, size: int, duration: float, sent):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    line = b'afl.execs_per_sec:' + b'1' * max(size - 21, 1) + b'|g\n'
+    count = 0
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        for _ in range(64):
+            sock.sendto(line, ('127.0.0.1', port))
+        count += 64
+    sent.value = count
+
+def send_stream(address: int | str, size: int, duration: float, sent):
+    if isinstance(address, str):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(address)
+    else:
+        sock = socket.create_connection(('127.0.0.1', address))
+    chunk = b'x' * (size - 1) + b'\n'
+    total = 0
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        sock.sendall(chunk)
+        total += len(chunk)
+    sock.close()
+    sent.value = total
+
+async def bench_collector(work: str, senders: int, duration: float, datagram_size: int, stream_size: int, transport: str) -> Dict:
+    """
+    Collector throughput with one process per statsd and console channel,
+    consoles over loopback TCP or Unix sockets
+    """
+    out = os.path.join(work, f'collector-{transport}')
+    os.makedirs(out, exist_ok=True)
+
+    collector = Collector()
+    datagram_ports, stream_ports = [], []
+    for i in range(senders):
+        sink = await collector.add_datagram(0, os.path.join(out, f'{i}.metric.log'))
+        datagram_ports.append(sink.address[1])
+    for i in range(senders):
+        if transport == 'unix':
+            sink = await collector.add_unix_stream(os.path.join(out, f'{i}.sock'), os.path.join(out, f'{i}.normal.log'))
+            stream_ports.append(sink.address)
+        else:
+            sink = await collector.add_stream(0, os.path.join(out, f'{i}.normal.log'))
+            stream_ports.append(sink.address[1])
+    task = asyncio.create_task(collector.run())
+
+    ctx = multiprocessing.get_context('spawn')
+    datagrams = [ ctx.Value('q', 0) for _ in datagram_ports ]
+    streams = [ ctx.Value('q', 0) for _ in stream_ports ]
+    processes = [ ctx.Process(target=send_datagrams, args=(port, datagram_size, duration, sent)) for port, sent in zip(datagram_ports, datagrams) ]
+    processes += [ ctx.Process(target=send_stream, args=(port, stream_size, duration, sent)) for port, sent in zip(stream_ports, streams) ]
+
+    start = time.monotonic()
+    for process in processes:
+        process.start()
+    await asyncio.to_thread(lambda: [ process.join() for process in processes ])
+    elapsed = time.monotonic() - start
+
+    collector.stop()
+    await task
+
+    line = 18 + max(datagram_size - 21, 1) + 3
+    received = sum(os.path.getsize(os.path.join(out, f'{i}.metric.log')) // line for i in range(senders))
+    stored = sum(os.path.getsize(os.path.join(out, f'{i}.normal.log')) for i in range(senders))
+    sent = sum(value.value for value in datagrams)
+
+    return {
+        'senders': senders,
+        'datagrams_sent_per_s': sent / elapsed,
+        'datagrams_stored_per_s': received / elapsed,
+        'datagram_loss': 1 - received / sent if sent else 0.0,
+        'stream_mb_per_s': stored / elapsed / 10 ** 6,
+        'stream_complete': stored == sum(value.value for value in streams),
+    }
+
+async def bench_scaling(tree: Dict[str, str], work: str, corpus: str, counts: List[int], duration: float) -> Dict:
+    """
+    Full Benchmark.run_for against the stand-in at increasing instance counts
+    """
+    ret = {}
+    single = None
+    store = MetricStore(use_cache=False)
+
+    for count in counts:
+        benchmark_dir = os.path.join(work, f'scaling-{count}')
+        await prepare_dir(benchmark_dir)
+        benchmark = Benchmark('fast', benchmark_dir, corpus, 'dsl')
+        benchmark.cfg = FuzzerConfig(fast=True, **tree)
+
+        start = time.monotonic()
+        await benchmark.run_for(count, duration, False, summary_interval=0, sample_interval=1)
+        wall = time.monotonic() - start
+
+        first_exec, execs, samples = [], 0, 0
+        for index in range(count):
+            instance_dir = os.path.join(benchmark_dir, str(index))
+            stats = standin_stats(os.path.join(instance_dir, 'out'))
+            if stats is not None and stats['first_exec'] is not None:
+                first_exec.append(stats['first_exec'] - stats['started'])
+                execs += stats['execs']
+            if os.path.isfile(os.path.join(instance_dir, 'metric.log')):
+                samples += len(store.read_metrics(benchmark_dir, str(index)).get('execs_per_sec', []))
+
+        rate = execs / duration
+        if single is None:
+            single = rate / count
+
+        ret[str(count)] = {
+            'wall_s': wall,
+            'overhead_s': wall - duration,
+            'started': len(first_exec),
+            'first_exec_ms': describe(np.array(first_exec) * 1000) if first_exec else None,
+            'execs_per_s': rate,
+            'efficiency': rate / (single * count) if single else 0.0,
+            'statsd_samples': samples,
+        }
+    return ret
+
+def flatten(data: Dict, prefix: str = '') -> Dict[str, float]:
+    ret = {}
+    for key, value in data.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            ret.update(flatten(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            ret[name] = value
+    return ret
+
+def compare(results: Dict, baseline: Dict):
+    new, old = flatten(results['results']), flatten(baseline['results'])
+    for key in sorted(new.keys() & old.keys()):
+        change = f"{new[key] / old[key] - 1:+.1%}" if old[key] else 'n/a'
+        print(f"{key:>48}: {old[key]:12.3f} -> {new[key]:12.3f} ({change})")
+
+BENCHMARKS = ['args', 'launch', 'setup', 'collector', 'scaling']
+
+async def main():
+    parser = argparse.ArgumentParser("Launcher overhead benchmarks")
+    parser.add_argument('--only', choices=BENCHMARKS, nargs='+', default=BENCHMARKS, help="Benchmarks to run")
+    parser.add_argument('--work-dir', type=str, required=False, help="Scratch directory, a temporary one is removed afterwards")
+    parser.add_argument('--out', type=str, default='overhead.json', help="Results file")
+    parser.add_argument('--baseline', type=str, required=False, help="Previous results file to compare against")
+    parser.add_argument('--srv', type=str, required=False, help="Real execsrv binary to use instead of the stand-in server")
+    parser.add_argument('--repeat', type=int, default=10, help="Repetitions of the launch and setup benchmarks")
+    parser.add_argument('--iterations', type=int, default=10000, help="Iterations of the argument building benchmark")
+    parser.add_argument('--instances', type=int, nargs='+', default=[1, 2, 4, 8], help="Instance counts for the setup and scaling benchmarks")
+    parser.add_argument('--duration', type=float, default=10, help="Seconds each scaling run and the collector benchmark take")
+    parser.add_argument('--corpus-files', type=int, default=256, help="Files in the generated seed corpus")
+    parser.add_argument('--corpus-size', type=int, default=4096, help="Bytes per seed corpus file")
+    parser.add_argument('--senders', type=int, default=4, help="Statsd and console senders in the collector benchmark")
+    parser.add_argument('--exec-us', type=float, default=1000, help="Stand-in QEMU busy time per test case in microseconds")
+    parser.add_argument('--boot', type=float, default=0.5, help="Stand-in QEMU boot time in seconds")
+    parser.add_argument('--console-bytes', type=int, default=64, help="Stand-in console output per test case")
+    parser.add_argument('--timeout', type=float, default=30, help="Seconds to wait for the first stand-in test case")
+    args = parser.parse_args()
+
+    work = args.work_dir if args.work_dir is not None else tempfile.mkdtemp(prefix='overhead-')
+    work = os.path.abspath(work)
+    standin = StandinConfig(exec_us=args.exec_us, boot=args.boot, console_bytes=args.console_bytes)
+    tree = install(os.path.join(work, 'tree'), standin, args.srv)
+    corpus = os.path.join(work, 'corpus')
+    make_corpus(corpus, args.corpus_files, args.corpus_size)
+
+    results = {}
+    try:
+        if 'args' in args.only:
+            results['args'] = bench_args(tree, args.iterations)
+        if 'launch' in args.only:
+            results['launch'] = await bench_launch(tree, work, args.repeat, args.timeout)
+        if 'setup' in args.only:
+            results['setup'] = await bench_setup(tree, work, corpus, args.instances, args.repeat)
+        if 'collector' in args.only:
+            results['collector'] = {
+                transport:await bench_collector(work, args.senders, args.duration, 64, 4096, transport)
+                    for transport in ('tcp', 'unix')
+            }
+        if 'scaling' in args.only:
+            results['scaling'] = await bench_scaling(tree, work, corpus, args.instances, args.duration)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work, ignore_errors=True)
+
+    report = {
+        'version': VERSION,
+        'host': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+        },
+        'standin': asdict(standin),
+        'srv': 'execsrv' if args.srv is not None else 'standin',
+        'results': results,
+    }
+
+    with open(args.out, 'w') as file:
+        json.dump(report, file, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            compare(report, json.load(file))
+    else:
+        for key, value in flatten(results).items():
+            print(f"{key:>48}: {value:12.3f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
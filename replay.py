@@ -0,0 +1,164 @@
+import argparse
+import asyncio
+import binascii
+import json
+import os
+import re
+import shlex
+import time
+from copy import copy
+from dataclasses import asdict, dataclass
+from typing import List
+
+from run import make_abs, prepare_env, prepare_qemu_args
+
+CRASH_PATTERNS = [
+    re.compile(rb'Kernel panic'),
+    re.compile(rb'Internal error: Oops'),
+    re.compile(rb'Unable to handle kernel'),
+    re.compile(rb'E/TC:\S*\s+\S+\s+Panic'),
+    re.compile(rb'E/TC:\S*\s+\S+\s+(?:User|Core) \w+ abort'),
+]
+
+# A line the guest prints once it runs the test case. The kernel echoes its
+# command line, including testcase=, at boot and again when it warns about
+# unknown parameters, lines like that prove nothing.
+CONSUMED_PATTERN = rb'(?i)test ?case'
+CMDLINE_ECHO = re.compile(rb'(?i)command line|testcase=')
+
+@dataclass()
+class ReplayResult:
+    name: str
+    shard: int
+    status: str
+    time: float
+    returncode: int | None
+    normal_log: str
+    secure_log: str
+
+def make_shards(testcases: List[str], count: int) -> List[List[str]]:
+    shards = [ [] for _ in range(count) ]
+    sizes = [ 0 ] * count
+
+    # Largest first onto the least loaded shard keeps shard run times even
+    for path in sorted(testcases, key=os.path.getsize, reverse=True):
+        index = sizes.index(min(sizes))
+        shards[index].append(path)
+        sizes[index] += os.path.getsize(path) + 1
+
+    return [ shard for shard in shards if shard ]
+
+def was_consumed(pattern: re.Pattern, *logs: str) -> bool:
+    for log in logs:
+        try:
+            with open(log, 'rb') as file:
+                lines = file.read().splitlines()
+        except OSError:
+            continue
+
+        if any(pattern.search(line) and not CMDLINE_ECHO.search(line) for line in lines):
+            return True
+    return False
+
+def is_crash(*logs: str) -> bool:
+    for log in logs:
+        try:
+            with open(log, 'rb') as file:
+                data = file.read()
+        except OSError:
+            continue
+
+        if any(pattern.search(data) for pattern in CRASH_PATTERNS):
+            return True
+    return False
+
+class ReplayEngine():
+    def __init__(self, options: argparse.Namespace, out_dir: str, jobs: int, timeout: float, delivery: str = 'cmdline', kernel_args: str = 'replay',
+                 consumed: bytes = CONSUMED_PATTERN) -> None:
+        self.options = options
+        self.out_dir = out_dir
+        self.jobs = jobs
+        self.timeout = timeout
+        self.delivery = delivery
+        self.kernel_args = kernel_args
+        self.consumed = re.compile(consumed)
+        self.results: List[ReplayResult] = []
+
+    def _qemu_options(self, testcase: str, normal_log: str, secure_log: str) -> argparse.Namespace:
+        options = copy(self.options)
+        options.drive = None
+        options.exit = True
+        options.qemu_log_file = None
+        options.serial_normal = f'file:{normal_log}'
+        options.serial_secure = f'file:{secure_log}'
+
+        if self.delivery == 'file':
+            options.testcase = testcase
+            options.kernel_args = self.kernel_args
+        else:
+            with open(testcase, 'rb') as file:
+                options.testcase = None
+                options.kernel_args = f"testcase={binascii.b2a_hex(file.read()).decode()}"
+
+        return options
+
+    async def _run_one(self, shard: int, testcase: str) -> ReplayResult:
+        name = os.path.basename(testcase)
+        prefix = os.path.join(self.out_dir, f'{shard}', name)
+        normal_log = prefix + '.normal.log'
+        secure_log = prefix + '.secure.log'
+
+        options = self._qemu_options(os.path.abspath(testcase), normal_log, secure_log)
+        qemu_bin = make_abs(os.path.join(options.qemu_dir, 'qemu-system-aarch64'))
+        args = [qemu_bin] + shlex.split(prepare_qemu_args(options))
+
+        start = time.monotonic()
+        process = await asyncio.create_subprocess_exec(
+            *args, cwd=make_abs(options.optee_out_dir), env=prepare_env(options),
+            stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+
+        try:
+            returncode = await asyncio.wait_for(process.wait(), self.timeout)
+            if returncode != 0 or is_crash(normal_log, secure_log):
+                status = 'crashed'
+            elif not was_consumed(self.consumed, normal_log, secure_log):
+                # A clean exit of a guest that never ran the input says nothing about it
+                status = 'error'
+            else:
+                status = 'passed'
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            returncode = None
+            status = 'timeout'
+
+        return ReplayResult(name, shard, status, time.monotonic() - start, returncode, normal_log, secure_log)
+
+    async def _run_shard(self, shard: int, testcases: List[str], results):
+        os.makedirs(os.path.join(self.out_dir, f'{shard}'), exist_ok=True)
+
+        for testcase in testcases:
+            result = await self._run_one(shard, testcase)
+            self.results.append(result)
+            results.write(json.dumps(asdict(result)) + '\n')
+            results.flush()
+            print(f"[{shard}] {result.name}: {result.status} in {result.time:.2f}s", flush=True)
+
+    async def run(self, testcases: List[str]) -> List[ReplayResult]:
+        os.makedirs(self.out_dir, exist_ok=True)
+        shards = make_shards(testcases, self.jobs)
+
+        with open(os.path.join(self.out_dir, 'results.jsonl'), 'w') as results:
+            await asyncio.gather(*(
+                self._run_shard(index, shard, results) for index, shard in enumerate(shards)
+            ))
+
+        return self.results
+
+    def summary(self) -> str:
+        counts = {}
+        for result in self.results:
+            counts[result.status] = counts.get(result.status, 0) + 1
+
+        total = sum(result.time for result in self.results)
+        return f"{len(self.results)} test cases, " + ", ".join(f"{k}={v}" for k, v in sorted(counts.items())) + f", {total:.1f}s of QEMU time"
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from epochs import load_epochs, stitch
+from metric import METRIC, sketches, timeline
+from metricstore import MetricStore, RAM_LOG, RESOURCES_LOG
+from resample import align, downsample
+from sketch import QuantileSketch, merge_all
+
+STATE_FILE = '.report-state.json'
+XLABEL = 'Time in hours : minutes : seconds'
+RAM_YLABEL = 'Allocated RAM in GB'
+
+def tikzplotlib_fix_ncols(obj):
+    """
+    workaround for matplotlib 3.6 renamed legend's _ncol to _ncols, which breaks tikzplotlib
+    """
+    if hasattr(obj, "_ncols"):
+        obj._ncol = obj._ncols
+    for child in obj.get_children():
+        tikzplotlib_fix_ncols(child)
+
+def resolve_metric(name: str) -> Dict[str, str]:
+    if name in METRIC:
+        cfg = METRIC[name]
+        return { 'metric': cfg.metric, 'ylabel': cfg.ylabel, 'title': cfg.title, 'derived': cfg.derived }
+    return { 'metric': name, 'ylabel': name, 'title': name, 'derived': False }
+
+def figure_experiments(figure: Dict) -> Dict[str, str]:
+    experiments = figure.get('experiments', figure.get('experiment'))
+    if isinstance(experiments, str):
+        return { experiments: experiments }
+    if isinstance(experiments, list):
+        return { name:name for name in experiments }
+    return experiments
+
+def set_time_axis(ax, figure: Dict, end: float | None = None):
+    """
+    Ticks from 0 to the figure's time, or to the `end` of the data when the
+    figure sets none
+    """
+    end = figure.get('time', end)
+    ticks = figure.get('ticks', 10)
+    xticks = np.linspace(0, end, ticks + 1)
+    xlabels = [ timedelta(seconds=int(i)) for i in xticks ]
+    ax.set_xticks(xticks, xlabels, rotation=45)
+    ax.set_xlim(0, end)
+    ax.set_xlabel(figure.get('xlabel', XLABEL))
+
+def draw_line(ax, figure: Dict, data: Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]]):
+    set_time_axis(ax, figure)
+    colors = figure.get('colors', {})
+    legend = len(data) > 1
+
+    for label, timeline in data.items():
+        grid, instances = align(timeline, figure.get('step', 1.0), end=figure['time'])
+        first = True
+        for val in instances.values():
+            x, y = downsample(grid, val, figure.get('points', 2000), figure.get('downsample', 'lttb'))
+            ax.plot(x, y, label=label if legend and first else None, color=colors.get(label))
+            first = False
+
+    if legend:
+        ax.legend()
+
+def draw_box(ax, figure: Dict, data: Dict[str, QuantileSketch]):
+    ax.bxp([ sketch.box_stats(label) for label, sketch in data.items() ], showfliers=False)
+    ax.set_xticklabels(ax.get_xticklabels(), rotation=figure.get('rotation', 0))
+
+def draw_ram_line(ax, figure: Dict, data: Dict[str, Tuple[np.ndarray | None, np.ndarray]]):
+    ends = [ np.nanmax(times) for times, _ in data.values() if times is not None and np.isfinite(times).any() ]
+    set_time_axis(ax, figure, max(ends, default=None))
+    for label, (times, val) in data.items():
+        if times is None:
+            # A ram.log from before the samples were timed, spread over the run
+            times = np.arange(len(val)) * figure['time'] / len(val)
+        ax.plot(times, val / 10 ** 9, label=label)
+    ax.legend()
+
+def draw_ram_box(ax, figure: Dict, data: Dict[str, np.ndarray]):
+    ax.boxplot([ val / 10 ** 9 for val in data.values() ], labels=list(data.keys()))
+    ax.set_xticklabels(ax.get_xticklabels(), rotation=figure.get('rotation', 45))
+
+DRAW = {
+    'line': draw_line,
+    'box': draw_box,
+    'ram_line': draw_ram_line,
+    'ram_box': draw_ram_box,
+}
+
+def render(figure: Dict, data: Dict, outputs: List[str]) -> str:
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots()
+    DRAW[figure['type']](ax, figure, data)
+
+    if 'ylim' in figure:
+        ax.set_ylim(figure['ylim'])
+    ax.set_ylabel(figure.get('ylabel', ''))
+    ax.set_title(figure.get('title', ''))
+    fig.tight_layout()
+
+    for out in outputs:
+        if out.endswith('.tex'):
+            import tikzplotlib
+            tikzplotlib_fix_ncols(fig)
+            tikzplotlib.save(out, figure=fig)
+        else:
+            fig.savefig(out)
+
+    plt.close(fig)
+    return figure['name']
+
+class Report():
+    def __init__(self, spec: Dict, base_dir: str, jobs: int | None = None, force: bool = False) -> None:
+        self.spec = spec
+        self.base_dir = base_dir
+        self.jobs = jobs
+        self.force = force
+        self.store = MetricStore()
+        self.output_dir = self._path(spec.get('output_dir', '.'))
+        self.formats = spec.get('formats', ['pdf'])
+        self.experiments = { name:self._path(exp['dir'] if isinstance(exp, dict) else exp) for name, exp in spec['experiments'].items() }
+        self.figures = [ self._figure(figure) for figure in spec['figures'] ]
+
+    @staticmethod
+    def from_file(path: str, jobs: int | None = None, force: bool = False) -> 'Report':
+        with open(path) as file:
+            return Report(json.load(file), os.path.dirname(os.path.abspath(path)), jobs, force)
+
+    def _path(self, path: str) -> str:
+        return path if os.path.isabs(path) else os.path.normpath(os.path.join(self.base_dir, path))
+
+    def _figure(self, figure: Dict) -> Dict:
+        figure = dict(figure)
+        if figure['type'] in ('line', 'box'):
+            resolved = resolve_metric(figure['metric'])
+            figure['field'] = resolved['metric']
+            figure['derived'] = resolved['derived']
+            figure.setdefault('ylabel', resolved['ylabel'])
+            figure.setdefault('title', resolved['title'])
+        else:
+            figure.setdefault('ylabel', RAM_YLABEL)
+            figure.setdefault('field', 'used')
+        return figure
+
+    def outputs(self, figure: Dict) -> List[str]:
+        formats = figure.get('formats', self.formats)
+        return [ os.path.join(self.output_dir, f"{figure['name']}.{fmt}") for fmt in formats ]
+
+    def fingerprint(self, figure: Dict) -> str:
+        h = hashlib.sha256(json.dumps(figure, sort_keys=True).encode())
+        ram = figure['type'].startswith('ram')
+        for name, label in sorted(figure_experiments(figure).items()):
+            h.update(f"{name}={label}".encode())
+            for source in self.store.sources(self.experiments[name]):
+                # The RAM timeline starts with the first metric sample
+                if ram != (os.path.basename(source) == RAM_LOG) and figure['type'] != 'ram_line':
+                    continue
+                st = os.stat(source)
+                h.update(f"{source}:{st.st_size}:{st.st_mtime_ns}".encode())
+        if figure.get('derived'):
+            # Derived metrics also read resource samples and the baseline
+            dirs = [ self.experiments[name] for name in figure_experiments(figure) ]
+            if 'baseline' in figure:
+                dirs.append(self.experiments[figure['baseline']])
+            for data_dir in dirs:
+                for source in self.store.sources(data_dir) + [os.path.join(data_dir, RESOURCES_LOG)]:
+                    if os.path.isfile(source):
+                        st = os.stat(source)
+                        h.update(f"{source}:{st.st_size}:{st.st_mtime_ns}".encode())
+        h.update(json.dumps(self.outputs(figure)).encode())
+        return h.hexdigest()
+
+    def _timeline(self, data_dir: str, figure: Dict):
+        if not figure['derived']:
+            return self.store.read_timeline(data_dir, figure['field'], figure['time'])
+        return timeline(figure['metric'], self.store, data_dir, figure['time'], self._baseline(figure))
+
+    def _sketches(self, data_dir: str, figure: Dict):
+        if not figure['derived']:
+            return self.store.read_sketches(data_dir, figure['field'])
+        return sketches(figure['metric'], self.store, data_dir, self._baseline(figure))
+
+    def _baseline(self, figure: Dict) -> str | None:
+        # Relative metrics name the experiment they are measured against
+        return self.experiments[figure['baseline']] if 'baseline' in figure else None
+
+    def _ram(self, data_dir: str) -> Dict[str, np.ndarray]:
+        """
+        RAM samples of an experiment, their times on the timeline of its
+        metrics
+        """
+        ram = self.store.read_ram(data_dir)
+        if 'time' not in ram or not np.isfinite(ram['time']).any():
+            ram.pop('time', None)
+            return ram
+
+        order = np.argsort(ram['time'], kind='stable')
+        ram = { key:column[order] for key, column in ram.items() }
+        start = self.store.start_time(data_dir)
+        times = stitch(ram['time'], load_epochs(data_dir))
+        ram['time'] = times - (start if start is not None else np.nanmin(times))
+        return ram
+
+    def _load(self, figures: List[Dict]) -> Dict[str, Dict]:
+        needed = { name for figure in figures for name in figure_experiments(figure) }
+        ret = {}
+        for name in sorted(needed):
+            data_dir = self.experiments[name]
+            uses = [ f for f in figures if name in figure_experiments(f) ]
+            types = { f['type'] for f in uses }
+            ret[name] = {
+                'timelines': { (f['field'], f['time']):self._timeline(data_dir, f) for f in uses if f['type'] == 'line' },
+                'sketches': { f['field']:self._sketches(data_dir, f) for f in uses if f['type'] == 'box' },
+                'ram': self._ram(data_dir) if types & { 'ram_line', 'ram_box' } else None,
+            }
+        return ret
+
+    def _data(self, figure: Dict, loaded: Dict[str, Dict]) -> Dict:
+        ret = {}
+        for name, label in figure_experiments(figure).items():
+            if figure['type'] == 'ram_line':
+                ram = loaded[name]['ram']
+                ret[label] = (ram.get('time'), ram[figure['field']])
+            elif figure['type'] == 'ram_box':
+                ret[label] = loaded[name]['ram'][figure['field']]
+            elif figure['type'] == 'box':
+                ret[label] = merge_all(loaded[name]['sketches'][figure['field']].values())
+            else:
+                ret[label] = loaded[name]['timelines'][(figure['field'], figure['time'])]
+        return ret
+
+    def build(self) -> List[str]:
+        os.makedirs(self.output_dir, exist_ok=True)
+        state_path = os.path.join(self.output_dir, STATE_FILE)
+        try:
+            with open(state_path) as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            state = {}
+
+        stale = []
+        for figure in self.figures:
+            fingerprint = self.fingerprint(figure)
+            up_to_date = all(os.path.isfile(out) for out in self.outputs(figure))
+            if self.force or not up_to_date or state.get(figure['name']) != fingerprint:
+                stale.append((figure, fingerprint))
+            else:
+                print(f"{figure['name']}: up to date")
+
+        if not stale:
+            return []
+
+        loaded = self._load([ figure for figure, _ in stale ])
+
+        done = []
+        try:
+            with ProcessPoolExecutor(max_workers=self.jobs) as pool:
+                futures = {
+                    pool.submit(render, figure, self._data(figure, loaded), self.outputs(figure)):(figure, fingerprint)
+                        for figure, fingerprint in stale
+                }
+
+                for future, (figure, fingerprint) in futures.items():
+                    future.result()
+                    state[figure['name']] = fingerprint
+                    done.append(figure['name'])
+                    print(f"{figure['name']}: rendered")
+        finally:
+            with open(state_path, 'w') as file:
+                json.dump(state, file, indent=2)
+
+        return done
+
+def main():
+    parser = argparse.ArgumentParser("Report builder")
+    parser.add_argument('spec', type=str, help="JSON report spec")
+    parser.add_argument('--jobs', type=int, required=False, help="Figures rendered in parallel")
+    parser.add_argument('--force', required=False, action='store_true', help="Render figures even if their inputs did not change")
+    parser.add_argument('--only', required=False, type=str, nargs='+', help="Only consider the named figures")
+    args = parser.parse_args()
+
+    report = Report.from_file(args.spec, args.jobs, args.force)
+    if args.only is not None:
+        report.figures = [ figure for figure in report.figures if figure['name'] in args.only ]
+    report.build()
+
+if __name__ == "__main__":
+    main()
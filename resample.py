@@ -0,0 +1,96 @@
+from typing import Dict, Tuple
+
+import numpy as np
+
+Series = Tuple[np.ndarray, np.ndarray]
+
+def align(series: Dict[str, Series], step: float, max_gap: float | None = None, end: float | None = None) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """
+    Resample every (time, value) series onto one grid of `step` seconds by
+    carrying the last observed value forward. Points before an instance's
+    first sample, after its last one or inside a gap longer than `max_gap`
+    are NaN, an instance without samples is NaN everywhere.
+    """
+    if end is None:
+        ends = [ t[-1] for t, _ in series.values() if len(t) ]
+        if not ends:
+            # Nothing was sampled, there is no time range to span
+            return np.zeros(0), { name:np.zeros(0) for name in series }
+        end = max(ends)
+    grid = np.arange(0, end + step, step)
+    max_gap = 2 * step if max_gap is None else max(max_gap, step)
+
+    ret = {}
+    for name, (t, v) in series.items():
+        if len(t) == 0:
+            ret[name] = np.full(grid.shape, np.nan)
+            continue
+        index = np.searchsorted(t, grid, side='right') - 1
+        valid = index >= 0
+        index = np.maximum(index, 0)
+        valid &= grid - t[index] <= max_gap
+        ret[name] = np.where(valid, v[index], np.nan)
+    return grid, ret
+
+def minmax(x: np.ndarray, y: np.ndarray, points: int) -> Series:
+    """
+    Keep the minimum and maximum of `points // 2` equal buckets, in order
+    """
+    buckets = points // 2
+    if len(x) <= points or buckets < 1:
+        return x, y
+
+    bucket = np.arange(len(x)) * buckets // len(x)
+    order = np.lexsort((y, bucket))
+    starts = np.flatnonzero(np.r_[True, bucket[order][1:] != bucket[order][:-1]])
+    ends = np.r_[starts[1:], len(order)] - 1
+
+    keep = np.unique(np.concatenate([order[starts], order[ends]]))
+    return x[keep], y[keep]
+
+def lttb(x: np.ndarray, y: np.ndarray, points: int) -> Series:
+    """
+    Largest-Triangle-Three-Buckets: one point per bucket, chosen to span the
+    largest triangle with the previous pick and the next bucket's centroid
+    """
+    n = len(x)
+    if n <= points or points < 3:
+        return x, y
+
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    # Centroid of each following bucket, the last bucket looks at the final point
+    sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    sizes = np.maximum(np.diff(edges), 1)
+    cx = np.r_[(sums_x / sizes)[1:], x[-1]]
+    cy = np.r_[(sums_y / sizes)[1:], y[-1]]
+
+    keep = np.empty(points, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+    a = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], max(edges[i + 1], edges[i] + 1)
+        area = np.abs((x[a] - cx[i]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy[i] - y[a]))
+        a = lo + int(np.argmax(area))
+        keep[i + 1] = a
+    return x[keep], y[keep]
+
+DOWNSAMPLE = {
+    'lttb': lttb,
+    'minmax': minmax,
+}
+
+def downsample(x: np.ndarray, y: np.ndarray, points: int, method: str = 'lttb') -> Series:
+    """
+    Reduce a series with NaN gaps to about `points` points, keeping the gaps
+    """
+    if method == 'none' or len(x) <= points:
+        return x, y
+
+    finite = np.isfinite(y)
+    xs, ys = DOWNSAMPLE[method](x[finite], y[finite], points)
+
+    # Break the line again where the input had missing values
+    breaks = np.flatnonzero(np.diff(np.cumsum(~finite)[np.searchsorted(x, xs)]) > 0) + 1
+    return np.insert(xs, breaks, np.nan), np.insert(ys, breaks, np.nan)
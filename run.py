@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import argparse
+import asyncio
 import os
 import socket
 import shlex
@@ -8,10 +9,16 @@ import time
 import binascii
 import ctypes
 import ctypes.util
+import glob
+import re
+import select
+import shutil
+import sys
+import tempfile
 from subprocess import Popen, PIPE, check_call
-from typing import Dict
+from typing import Dict, List, Set
 from functools import partial
-import uuid
+from affinity import parse_cpulist
 
 DIR = os.path.dirname(__file__)
 
@@ -23,14 +30,20 @@ def parse_args():
     parser.add_argument('--qemu-log-file', required=False, type=str, help='Store logs from QEMU to file')
     parser.add_argument('--afl-log-file', required=False, type=str, help="Store logs from AFL to file")
     parser.add_argument('--execsrv-log-file', required=False, type=str, help="Store logs from execsrv to file")
+    parser.add_argument('--execsrv-trace-file', required=False, type=str, help="Store a binary per execution trace from execsrv to file")
+    parser.add_argument('--execsrv-trace-size', required=False, type=int, help="Records kept in the execsrv trace ring")
+    parser.add_argument('--execsrv-verbose', required=False, action='store_true', help="Log every execution from execsrv")
     parser.add_argument('--enable-statsd', required=False, action='store_true', help="Send metrics to statsd server")
     parser.add_argument('--statsd-host', default='127.0.0.1:8125', type=str, help="StatsD host")
     parser.add_argument('--statsd-flavor', required=False, choices=['dogstatsd', 'influxdb', 'librato', 'signalfx'], help="Select the StatsD flavor")
-    parser.add_argument('--launch-terminals', required=False, action='store_true', help="Launch terminals")
+    parser.add_argument('--launch-terminals', required=False, action='store_true', help="Launch terminals listening on the console endpoints, port 0 picks a free one")
     parser.add_argument('--stdio-normal-port', default=54320, type=int, help="Port to send TCP logs from normal world")
     parser.add_argument('--stdio-secure-port', default=54321, type=int, help="Port to send TCP logs from secure world")
+    parser.add_argument('--stdio-normal-socket', required=False, type=str, help="Unix socket to send logs from normal world, replaces the port")
+    parser.add_argument('--stdio-secure-socket', required=False, type=str, help="Unix socket to send logs from secure world, replaces the port")
     parser.add_argument('--testcase-decoding-mode', choices=['dsl', 'direct'], default='dsl', help="Select the test case decoding mechanism")
     parser.add_argument('--no-affinity', required=False, action='store_true', help="Disable CPU pinning in AFL")
+    parser.add_argument('--cpus', required=False, type=str, help="Pin AFL, execsrv and QEMU to a cpu list, e.g. 2,3 or 4-7")
 
     parser.add_argument('--afl-dir', default='optee/AFLplusplus/', type=str, help="Path to AFL root dir")
     parser.add_argument('--qemu-dir', default='optee/qemu/build/', type=str, help="Path to QEMU build directory")
@@ -51,10 +64,16 @@ def parse_args():
     fuzzer_types.add_argument('--tznorevert', action="store_true", required=False, help="Run from trustzone and don't revert vm state")
 
     fuzzer.add_argument('--skip-cpu-check', action='store_true', required=False, help="Skip AFL's cpu check")
-    fuzzer.add_argument('--tmpfs', type=str, required=False, help="Path to tmpf used to store QEMU state in normal mode")
+    fuzzer.add_argument('--tmpfs', type=str, default='./tmpfs', help="Path to tmpf used to store QEMU state in normal mode")
+    fuzzer.add_argument('--drive-pool', type=int, default=1, help="Number of ready QEMU state drives kept in tmpfs")
     fuzzer.add_argument('--timeout', type=float, default=50000, help="AFL timeout")
     fuzzer.add_argument('--input', default='in', help='Input directory for AFL')
     fuzzer.add_argument('--output', default='out', help='Output directory for AFL')
+    fuzzer.add_argument('--sync-dir', type=str, required=False, help="Shared AFL sync directory for cooperative fuzzing, replaces --output")
+    fuzzer.add_argument('--afl-role', choices=['main', 'secondary'], default='main', help="Run as AFL main (-M) or secondary (-S) instance")
+    fuzzer.add_argument('--afl-name', type=str, default='main', help="Name of this instance in the sync directory")
+    fuzzer.add_argument('--sync-time', type=int, required=False, help="Minutes between AFL corpus syncs")
+    fuzzer.add_argument('--afl-autoresume', required=False, action='store_true', help="Resume from an existing AFL output directory")
 
     tcgen = subparsers.add_parser('tcgen', help="Testcase generator")
     tcgen.add_argument('tcdir', type=str, help='Directory to store generated testcases')
@@ -65,6 +84,12 @@ def parse_args():
     tc_source = tc.add_mutually_exclusive_group(required=True)
     tc_source.add_argument('--from-path', type=str, required=False, help="Run testcases from file or directory")
     tc_source.add_argument('--hex', type=str, required=False, help="Run testcase from hex")
+    tc.add_argument('--jobs', type=int, default=os.cpu_count(), help="Parallel QEMU instances when replaying a directory")
+    tc.add_argument('--replay-dir', type=str, default='replay', help="Directory for per test case results and console logs")
+    tc.add_argument('--test-timeout', type=float, default=60, help="Seconds before a replayed test case is considered hung")
+    tc.add_argument('--delivery', choices=['file', 'cmdline'], default='cmdline', help="Pass each test case on the kernel command line or as a file, file needs a guest with a file replay mode")
+    tc.add_argument('--replay-kernel-args', type=str, default='replay', help="Kernel arguments selecting the guest's file replay mode")
+    tc.add_argument('--consumed-pattern', type=str, required=False, help="Regular expression the guest prints once it ran a test case, runs without it are errors")
 
     return parser.parse_args()
 
@@ -74,9 +99,22 @@ def make_abs(path: str) -> str:
     else:
         return path
 
+def console_serial(options: argparse.Namespace, world: str) -> str:
+    serial = getattr(options, f'serial_{world}', None)
+    if serial is not None:
+        return serial
+
+    # QEMU connects to the collector as a client on either transport
+    path = getattr(options, f'stdio_{world}_socket', None)
+    if path is not None:
+        return f"unix:{path}"
+    return f"tcp:localhost:{getattr(options, f'stdio_{world}_port')}"
+
 def prepare_qemu_args(options: argparse.Namespace) -> str:
+    normal = console_serial(options, 'normal')
+    secure = console_serial(options, 'secure')
     fmt = f"""-nographic \
-        -serial tcp:localhost:{options.stdio_normal_port} -serial tcp:localhost:{options.stdio_secure_port} \
+        -serial {normal} -serial {secure} \
         -smp 1 \
         -machine virt,secure=on,mte=off,gic-version=3,virtualization=false \
         -cpu max,sve=off,pauth-impdef=on \
@@ -101,12 +139,31 @@ def prepare_qemu_args(options: argparse.Namespace) -> str:
 
     return fmt
 
+def fuzz_mode(options: argparse.Namespace) -> str | None:
+    for mode in ('normal', 'fast', 'norevert', 'tznorevert'):
+        if getattr(options, mode, False):
+            return mode
+    return None
+
 def prepare_execsrv_args(options: argparse.Namespace) -> str:
     fmt = ""
 
     if options.execsrv_log_file is not None:
         fmt += f"-l {make_abs(options.execsrv_log_file)} "
 
+    if getattr(options, 'execsrv_trace_file', None) is not None:
+        fmt += f"-t {make_abs(options.execsrv_trace_file)} "
+
+        if getattr(options, 'execsrv_trace_size', None) is not None:
+            fmt += f"-n {options.execsrv_trace_size} "
+
+        mode = fuzz_mode(options)
+        if mode is not None:
+            fmt += f"-m {mode} "
+
+    if getattr(options, 'execsrv_verbose', False):
+        fmt += "-v "
+
     qemu_bin = os.path.join(make_abs(options.qemu_dir), 'qemu-system-aarch64')
     fmt += f"-p '{qemu_bin}' "
 
@@ -118,7 +175,12 @@ def prepare_afl_args(options: argparse.Namespace) -> str:
     if options.timeout is not None:
         fmt += f"-t {options.timeout} "
 
-    fmt += f"-i {make_abs(options.input)} -o {make_abs(options.output)} "
+    sync_dir = getattr(options, 'sync_dir', None)
+    if sync_dir is not None:
+        role = '-M' if options.afl_role == 'main' else '-S'
+        fmt += f"-i {make_abs(options.input)} -o {make_abs(sync_dir)} {role} {options.afl_name} "
+    else:
+        fmt += f"-i {make_abs(options.input)} -o {make_abs(options.output)} "
 
     return fmt
 
@@ -153,6 +215,16 @@ def prepare_env(options: argparse.Namespace) -> Dict[str, str]:
     if 'no_affinity' in options and options.no_affinity:
         env['AFL_NO_AFFINITY'] = '1'
 
+    if getattr(options, 'afl_autoresume', False):
+        env['AFL_AUTORESUME'] = '1'
+
+    if getattr(options, 'sync_dir', None) is not None:
+        if getattr(options, 'sync_time', None) is not None:
+            env['AFL_SYNC_TIME'] = str(options.sync_time)
+
+        if options.afl_role == 'main':
+            env['AFL_FINAL_SYNC'] = '1'
+
     return env
 
 def is_port_open(port: int) -> bool:
@@ -161,18 +233,63 @@ def is_port_open(port: int) -> bool:
     sock.close()
     return conn == 0
 
-def launch_terminal(port: int, label: str, options: argparse.Namespace):
-    optee_build = options.optee_build_dir
-    soc_term = os.path.join(optee_build, 'soc_term.py')
-    Popen(shlex.split(f"gnome-terminal -t '{label}' -- {soc_term} {port}"))
+def is_endpoint_open(endpoint: str) -> bool:
+    kind, _, target = endpoint.partition(':')
+    if kind == 'tcp':
+        return int(target) != 0 and is_port_open(int(target))
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM, 0)
+    conn = sock.connect_ex(target)
+    sock.close()
+    return conn == 0
+
+def launch_terminal(endpoint: str, label: str, timeout: float = 30) -> str:
+    """
+    Opens a console window listening on `endpoint` and blocks until the
+    terminal reports it listens, returns the endpoint it bound
+    """
+    ready_dir = tempfile.mkdtemp(prefix='term-')
+    fifo = os.path.join(ready_dir, 'ready')
+    os.mkfifo(fifo)
+    fd = os.open(fifo, os.O_RDONLY | os.O_NONBLOCK)
+    try:
+        terminal = os.path.join(DIR, 'terminal.py')
+        Popen(shlex.split(f"gnome-terminal -t '{label}' -- {sys.executable} {terminal} {endpoint} --ready {fifo}"))
+
+        data = b''
+        deadline = time.monotonic() + timeout
+        while not data.endswith(b'\n'):
+            readable, _, _ = select.select([fd], [], [], max(deadline - time.monotonic(), 0))
+            if not readable:
+                raise TimeoutError(f"{label} terminal did not listen on {endpoint} after {timeout}s")
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                # The terminal closed the FIFO without reporting, e.g. it failed to bind
+                raise RuntimeError(f"{label} terminal exited before listening on {endpoint}")
+            data += chunk
+        return data.decode().strip()
+    finally:
+        os.close(fd)
+        shutil.rmtree(ready_dir, ignore_errors=True)
 
 def launch_terminals(options: argparse.Namespace):
-    if 'launch_terminals' in options and options.launch_terminals:
-        for port, label in zip([54320, 54321], ["Normal world", "Secure world"]):
-            if not is_port_open(port):
-                launch_terminal(port, label, options)
-                while not is_port_open(port):
-                    time.sleep(0.01)
+    if not getattr(options, 'launch_terminals', False):
+        return
+
+    for world, label in [('normal', "Normal world"), ('secure', "Secure world")]:
+        path = getattr(options, f'stdio_{world}_socket', None)
+        endpoint = f'unix:{path}' if path is not None else f"tcp:{getattr(options, f'stdio_{world}_port')}"
+        if is_endpoint_open(endpoint):
+            # A terminal from an earlier run or the benchmark collector serves it
+            print(f"{label} console {endpoint} is already served, not opening a terminal")
+            continue
+
+        # QEMU connects to whatever the terminal bound, port 0 included
+        kind, _, target = launch_terminal(endpoint, label).partition(':')
+        if kind == 'unix':
+            setattr(options, f'stdio_{world}_socket', target)
+        else:
+            setattr(options, f'stdio_{world}_port', int(target))
 
 libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
 libc.mount.argtypes = (ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_ulong, ctypes.c_char_p)
@@ -208,11 +325,13 @@ def run_testcase(options: argparse.Namespace):
             with open(path, "rb") as file:
                 run_qemu(options, f"testcase={binascii.b2a_hex(file.read()).decode()}")
         else:
-            args = ""
-            for name in os.listdir(path):
-                with open(os.path.join(path, name), "rb") as file:
-                    args += f"testcase={binascii.b2a_hex(file.read()).decode()} "
-            run_qemu(options, args)
+            from replay import CONSUMED_PATTERN, ReplayEngine
+
+            testcases = [ os.path.join(path, name) for name in sorted(os.listdir(path)) if os.path.isfile(os.path.join(path, name)) ]
+            engine = ReplayEngine(options, options.replay_dir, options.jobs, options.test_timeout, options.delivery, options.replay_kernel_args,
+                                  options.consumed_pattern.encode() if options.consumed_pattern is not None else CONSUMED_PATTERN)
+            asyncio.run(engine.run(testcases))
+            print(engine.summary())
 
 def run_tcgen(options: argparse.Namespace):
     if not os.path.isdir(options.tcdir):
@@ -220,12 +339,133 @@ def run_tcgen(options: argparse.Namespace):
 
     run_qemu(options, 'tcgen')
 
-def create_disk_in_tmpfs(options: argparse.Namespace) -> str:
-    id = uuid.uuid4()
-    drive = os.path.join(make_abs(options.tmpfs), f'{id}.qcow2')
-    if not os.path.isfile(drive):
-        check_call(shlex.split(f"qemu-img create -f qcow2 {drive} 128M"))
-    return drive
+UUID_IMAGE = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\.qcow2$')
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def open_files() -> Set[str]:
+    ret = set()
+    for fd_dir in glob.glob('/proc/[0-9]*/fd'):
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            continue
+
+        for fd in fds:
+            try:
+                ret.add(os.readlink(os.path.join(fd_dir, fd)))
+            except OSError:
+                pass
+    return ret
+
+class DrivePool():
+    def __init__(self, tmpfs: str, size: str = '128M', count: int = 1) -> None:
+        self.tmpfs = make_abs(tmpfs)
+        self.size = size
+        self.count = count
+        self.template = os.path.join(self.tmpfs, f'template-{size}.qcow2')
+
+        if not os.path.isdir(self.tmpfs):
+            os.makedirs(self.tmpfs)
+
+    def _image(self, slot: int) -> str:
+        return os.path.join(self.tmpfs, f'pool-{slot}.qcow2')
+
+    def _owner(self, image: str) -> str:
+        return image + '.owner'
+
+    def _slots(self) -> List[int]:
+        ret = []
+        for path in glob.glob(os.path.join(self.tmpfs, 'pool-*.qcow2')):
+            slot = os.path.basename(path)[len('pool-'):-len('.qcow2')]
+            if slot.isdigit():
+                ret.append(int(slot))
+        return sorted(ret)
+
+    def _owner_pid(self, image: str) -> int | None:
+        try:
+            with open(self._owner(image)) as file:
+                return int(file.read().strip() or 0)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            return 0
+
+    def _reset(self, image: str):
+        if not os.path.isfile(self.template):
+            tmp = f'{self.template}.{os.getpid()}.tmp'
+            check_call(shlex.split(f"qemu-img create -q -f qcow2 {tmp} {self.size}"))
+            os.replace(tmp, self.template)
+
+        tmp = f'{image}.{os.getpid()}.tmp'
+        shutil.copyfile(self.template, tmp)
+        os.replace(tmp, image)
+
+    def reclaim(self):
+        in_use = None
+
+        for slot in self._slots():
+            image = self._image(slot)
+            pid = self._owner_pid(image)
+            if pid is not None and not pid_alive(pid):
+                self._reset(image)
+                os.remove(self._owner(image))
+
+        for name in os.listdir(self.tmpfs):
+            if UUID_IMAGE.match(name):
+                if in_use is None:
+                    in_use = open_files()
+
+                path = os.path.join(self.tmpfs, name)
+                if path not in in_use:
+                    os.remove(path)
+
+    def warm(self):
+        slots = self._slots()
+        free = [ i for i in slots if self._owner_pid(self._image(i)) is None ]
+        slot = max(slots, default=-1) + 1
+
+        for _ in range(self.count - len(free)):
+            self._reset(self._image(slot))
+            slot += 1
+
+    def acquire(self) -> str:
+        slots = self._slots()
+
+        for slot in slots + [max(slots, default=-1) + 1]:
+            image = self._image(slot)
+            try:
+                fd = os.open(self._owner(image), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue
+
+            with os.fdopen(fd, 'w') as file:
+                file.write(str(os.getpid()))
+
+            if not os.path.isfile(image):
+                self._reset(image)
+            return image
+
+        raise RuntimeError(f"Cannot acquire drive from {self.tmpfs}")
+
+    def release(self, image: str):
+        self._reset(image)
+        os.remove(self._owner(image))
+
+def pin_cpus(options: argparse.Namespace):
+    cpus = getattr(options, 'cpus', None)
+    if not cpus:
+        return None
+
+    # Applied to AFL before exec, execsrv and QEMU inherit the mask
+    return partial(os.sched_setaffinity, 0, parse_cpulist(cpus))
 
 def run_fuzzer(options: argparse.Namespace):
     optee_out_dir = make_abs(options.optee_out_dir)
@@ -237,14 +477,20 @@ def run_fuzzer(options: argparse.Namespace):
 
     srv_bin = os.path.join(make_abs(options.execsrv_dir), 'srv')
 
-    if not os.path.isdir(options.output):
+    if getattr(options, 'sync_dir', None) is not None:
+        os.makedirs(make_abs(options.sync_dir), exist_ok=True)
+    elif not os.path.isdir(options.output):
         os.mkdir(options.output)
 
     options.testcase = '@@'
-    options.drive = None
+    options.drive = getattr(options, 'drive', None)
 
     if options.normal:
-        options.drive = create_disk_in_tmpfs(options)
+        if options.drive is None:
+            pool = DrivePool(options.tmpfs, count=options.drive_pool)
+            pool.reclaim()
+            options.drive = pool.acquire()
+            pool.warm()
         options.kernel_args = 'fuzz'
     elif options.fast:
         options.kernel_args = 'fuzz'
@@ -254,6 +500,9 @@ def run_fuzzer(options: argparse.Namespace):
         options.kernel_args = 'fuzz_no_reverts'
 
 
+    # Terminals bind the console endpoints QEMU is pointed at
+    launch_terminals(options)
+
     qemu_args = prepare_qemu_args(options)
     execsrv_args = prepare_execsrv_args(options)
     afl_args = prepare_afl_args(options)
@@ -262,18 +511,19 @@ def run_fuzzer(options: argparse.Namespace):
     cmd = f"{afl_bin} {afl_args} -- {srv_bin} {execsrv_args} -- {qemu_args}"
     print(cmd)
     print(env)
-    launch_terminals(options)
 
 
 
+    preexec = pin_cpus(options)
+
     if options.afl_log_file:
-        out = open(options.afl_log_file, "wb")
-        err = open(options.afl_log_file + ".err", "wb")
-        return Popen(shlex.split(cmd), cwd=optee_out_dir, env=env, stdout=out, stderr=err)
+        out = open(options.afl_log_file, "ab")
+        err = open(options.afl_log_file + ".err", "ab")
+        return Popen(shlex.split(cmd), cwd=optee_out_dir, env=env, stdout=out, stderr=err, preexec_fn=preexec)
     elif options.noout:
-        return Popen(shlex.split(cmd), cwd=optee_out_dir, env=env, stdout=PIPE, stderr=PIPE)
+        return Popen(shlex.split(cmd), cwd=optee_out_dir, env=env, stdout=PIPE, stderr=PIPE, preexec_fn=preexec)
     else:
-        return Popen(shlex.split(cmd), cwd=optee_out_dir, env=env)
+        return Popen(shlex.split(cmd), cwd=optee_out_dir, env=env, preexec_fn=preexec)
 
 
 
@@ -281,17 +531,18 @@ def main():
     args = parse_args()
     print(args)
 
-    if args.command == 'qemu':
-        run_qemu(args, None)
-    elif args.command == 'testcase':
-        run_testcase(args)
-    elif args.command == 'tcgen':
-        run_tcgen(args)
-    elif args.command == 'fuzzer':
-        run_fuzzer(args)().communicate()
-
-    if args.drive is not None:
-        os.remove(args.drive)
+    try:
+        if args.command == 'qemu':
+            run_qemu(args, None)
+        elif args.command == 'testcase':
+            run_testcase(args)
+        elif args.command == 'tcgen':
+            run_tcgen(args)
+        elif args.command == 'fuzzer':
+            run_fuzzer(args).communicate()
+    finally:
+        if getattr(args, 'drive', None) is not None:
+            DrivePool(args.tmpfs).release(args.drive)
 
 if __name__ == '__main__':
     main()
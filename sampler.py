@@ -0,0 +1,156 @@
+import asyncio
+import json
+import os
+import time
+from typing import Callable, Dict, List, Tuple
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+
+# /proc/<pid>/comm is truncated to 15 characters
+COMPONENTS = {
+    'afl-fuzz': 'afl',
+    'srv': 'srv',
+    'qemu-system-aar': 'qemu',
+}
+
+FIELDS = [ f'{name}_{kind}' for name in COMPONENTS.values() for kind in ('rss', 'cpu') ]
+
+def meminfo() -> Dict[str, int]:
+    ret = {}
+    with open('/proc/meminfo') as file:
+        for line in file:
+            name, value = line.split(':', 1)
+            ret[name] = int(value.split()[0]) * 1024
+    return ret
+
+def system_memory() -> Dict[str, int]:
+    info = meminfo()
+    cached = info.get('Cached', 0) + info.get('SReclaimable', 0)
+    used = info['MemTotal'] - info['MemFree'] - info.get('Buffers', 0) - cached
+
+    return {
+        'total': info['MemTotal'],
+        'available': info.get('MemAvailable', info['MemFree']),
+        'used': used if used >= 0 else info['MemTotal'] - info['MemFree'],
+    }
+
+def disk_usage(path: str) -> int:
+    try:
+        st = os.statvfs(path)
+    except OSError:
+        return 0
+    return (st.f_blocks - st.f_bfree) * st.f_frsize
+
+def children(pid: int) -> List[int]:
+    ret = []
+    try:
+        tasks = os.listdir(f'/proc/{pid}/task')
+    except OSError:
+        return ret
+
+    for tid in tasks:
+        try:
+            with open(f'/proc/{pid}/task/{tid}/children') as file:
+                ret += [ int(i) for i in file.read().split() ]
+        except OSError:
+            pass
+    return ret
+
+def process_tree(pid: int) -> List[int]:
+    ret = []
+    stack = [pid]
+    while stack:
+        pid = stack.pop()
+        ret.append(pid)
+        stack += children(pid)
+    return ret
+
+def proc_stat(pid: int) -> Tuple[str, float, int] | None:
+    try:
+        with open(f'/proc/{pid}/stat') as file:
+            stat = file.read()
+    except OSError:
+        return None
+
+    comm = stat[stat.index('(') + 1:stat.rindex(')')]
+    fields = stat[stat.rindex(')') + 2:].split()
+    cpu = (int(fields[11]) + int(fields[12])) / CLK_TCK
+    rss = int(fields[21]) * PAGE_SIZE
+    return comm, cpu, rss
+
+def sample_tree(pid: int) -> Dict[str, float]:
+    ret = { field:0 for field in FIELDS }
+
+    for child in process_tree(pid):
+        stat = proc_stat(child)
+        if stat is None:
+            continue
+
+        comm, cpu, rss = stat
+        name = COMPONENTS.get(comm)
+        if name is None:
+            continue
+
+        ret[f'{name}_rss'] += rss
+        ret[f'{name}_cpu'] += cpu
+    return ret
+
+class ResourceSampler():
+    def __init__(self, benchmark_dir: str, interval: float, tmpfs: str | None = None, append: bool = False) -> None:
+        self.benchmark_dir = benchmark_dir
+        self.interval = interval
+        self.tmpfs = tmpfs
+        self.append = append
+        self.sources: Dict[int, Callable[[], int | None]] = {}
+        self.stopped = asyncio.Event()
+        self.last: Dict[int, Dict[str, float]] = {}
+
+    def add(self, index: int, pid: Callable[[], int | None]):
+        self.sources[index] = pid
+
+    def stop(self):
+        self.stopped.set()
+
+    def sample(self) -> Tuple[Dict[str, float], List[List[float]]]:
+        now = time.time()
+        system = system_memory()
+        system['time'] = now
+        system['tmpfs'] = disk_usage(self.tmpfs) if self.tmpfs is not None else 0
+
+        rows = []
+        for index, source in self.sources.items():
+            pid = source()
+            if pid is None:
+                continue
+
+            tree = sample_tree(pid)
+            self.last[index] = tree
+            rows.append([now, index, system['used'], system['available'], system['tmpfs']] + [ tree[i] for i in FIELDS ])
+
+        return system, rows
+
+    async def run(self):
+        mode = 'a' if self.append else 'w'
+        resources = open(os.path.join(self.benchmark_dir, 'resources.csv'), mode)
+        ram = open(os.path.join(self.benchmark_dir, 'ram.log'), mode)
+        if resources.tell() == 0:
+            resources.write(','.join(['time', 'instance', 'used', 'available', 'tmpfs'] + FIELDS) + '\n')
+
+        try:
+            while not self.stopped.is_set():
+                system, rows = await asyncio.to_thread(self.sample)
+
+                ram.write(json.dumps(system) + '\n')
+                ram.flush()
+                for row in rows:
+                    resources.write(','.join(f'{i:.3f}' if isinstance(i, float) else str(i) for i in row) + '\n')
+                resources.flush()
+
+                try:
+                    await asyncio.wait_for(self.stopped.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            resources.close()
+            ram.close()
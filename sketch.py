@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+from functools import reduce
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+
+DEFAULT_ALPHA = 0.01
+
+class QuantileSketch():
+    """
+    Log-bucketed quantile sketch (DDSketch) with relative error `alpha`,
+    mergeable across instances and experiments without the raw samples
+    """
+    def __init__(self, alpha: float = DEFAULT_ALPHA) -> None:
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.log_gamma = np.log(self.gamma)
+        # Positive and negative values have their own stores, zero a counter
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.negative_keys = np.zeros(0, dtype=np.int64)
+        self.negative_counts = np.zeros(0, dtype=np.int64)
+        self.zero = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    @staticmethod
+    def _combine(keys: np.ndarray, counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        unique, inverse = np.unique(keys, return_inverse=True)
+        return unique, np.bincount(inverse, weights=counts, minlength=len(unique)).astype(np.int64)
+
+    def _key(self, magnitudes: np.ndarray) -> np.ndarray:
+        # Bucket k holds (gamma^(k-1), gamma^k], keys below 1 are negative
+        return np.ceil(np.log(magnitudes) / self.log_gamma).astype(np.int64)
+
+    def _value(self, keys: np.ndarray) -> np.ndarray:
+        return 2 * self.gamma ** keys.astype(np.float64) / (self.gamma + 1)
+
+    @staticmethod
+    def _insert(keys: np.ndarray, counts: np.ndarray, new: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        return QuantileSketch._combine(np.concatenate([keys, new]), np.concatenate([counts, np.ones(new.size, dtype=np.int64)]))
+
+    def add(self, values: np.ndarray) -> 'QuantileSketch':
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return self
+
+        positive = values[values > 0]
+        negative = values[values < 0]
+        self.zero += int(values.size - positive.size - negative.size)
+        self.count += int(values.size)
+        self.sum += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+        self.keys, self.counts = self._insert(self.keys, self.counts, self._key(positive))
+        self.negative_keys, self.negative_counts = self._insert(self.negative_keys, self.negative_counts, self._key(-negative))
+        return self
+
+    def merge(self, other: 'QuantileSketch') -> 'QuantileSketch':
+        if other.alpha != self.alpha:
+            raise ValueError(f"Cannot merge sketches with alpha {self.alpha} and {other.alpha}")
+
+        ret = QuantileSketch(self.alpha)
+        ret.keys, ret.counts = self._combine(
+            np.concatenate([self.keys, other.keys]), np.concatenate([self.counts, other.counts]))
+        ret.negative_keys, ret.negative_counts = self._combine(
+            np.concatenate([self.negative_keys, other.negative_keys]), np.concatenate([self.negative_counts, other.negative_counts]))
+        ret.zero = self.zero + other.zero
+        ret.count = self.count + other.count
+        ret.sum = self.sum + other.sum
+        ret.min = min(self.min, other.min)
+        ret.max = max(self.max, other.max)
+        return ret
+
+    def _buckets(self) -> Tuple[np.ndarray, np.ndarray]:
+        values = np.concatenate([-self._value(self.negative_keys), [0.0], self._value(self.keys)])
+        counts = np.concatenate([self.negative_counts, [self.zero], self.counts])
+        order = np.argsort(values, kind='stable')
+        return values[order], counts[order]
+
+    def quantile(self, q: float | np.ndarray) -> float | np.ndarray:
+        if self.count == 0:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan
+
+        values, counts = self._buckets()
+        rank = np.asarray(q) * (self.count - 1)
+        index = np.searchsorted(np.cumsum(counts), rank, side='right')
+        ret = np.clip(values[np.minimum(index, len(values) - 1)], self.min, self.max)
+        ret = np.where(np.asarray(q) <= 0, self.min, np.where(np.asarray(q) >= 1, self.max, ret))
+        return ret if np.ndim(q) else float(ret)
+
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else np.nan
+
+    def box_stats(self, label: str, whis: float = 1.5) -> Dict:
+        q1, med, q3 = self.quantile(np.array([0.25, 0.5, 0.75]))
+        iqr = q3 - q1
+        values, counts = self._buckets()
+        inside = values[(counts > 0) & (values >= q1 - whis * iqr) & (values <= q3 + whis * iqr)]
+
+        return {
+            'label': label,
+            'med': med,
+            'q1': q1,
+            'q3': q3,
+            'whislo': max(self.min, float(inside.min())) if inside.size else q1,
+            'whishi': min(self.max, float(inside.max())) if inside.size else q3,
+            'mean': self.mean(),
+            'fliers': [],
+        }
+
+    def to_array(self) -> np.ndarray:
+        header = [self.alpha, self.zero, self.count, self.sum, self.min, self.max, len(self.keys), len(self.negative_keys)]
+        return np.concatenate([np.array(header, dtype=np.float64), self.keys, self.counts, self.negative_keys, self.negative_counts])
+
+    @staticmethod
+    def from_array(array: np.ndarray) -> 'QuantileSketch':
+        alpha, zero, count, total, lo, hi, size, negative = array[:8]
+        size, negative = int(size), int(negative)
+        ret = QuantileSketch(float(alpha))
+        ret.zero = int(zero)
+        ret.count = int(count)
+        ret.sum = float(total)
+        ret.min = float(lo)
+        ret.max = float(hi)
+        body = array[8:]
+        ret.keys = body[:size].astype(np.int64)
+        ret.counts = body[size:2 * size].astype(np.int64)
+        ret.negative_keys = body[2 * size:2 * size + negative].astype(np.int64)
+        ret.negative_counts = body[2 * size + negative:2 * (size + negative)].astype(np.int64)
+        return ret
+
+    @staticmethod
+    def of(values: np.ndarray, alpha: float = DEFAULT_ALPHA) -> 'QuantileSketch':
+        return QuantileSketch(alpha).add(values)
+
+def merge_all(sketches: Iterable[QuantileSketch]) -> QuantileSketch:
+    return reduce(QuantileSketch.merge, sketches)
+
+def check(samples: int = 10000, seed: int = 0) -> Dict[str, float]:
+    """
+    Largest relative error of the sketch quantiles against np.quantile for
+    distributions around and below 1, every one must stay within alpha
+    """
+    rng = np.random.default_rng(seed)
+    cases = {
+        'linspace(0.05, 0.95)': np.linspace(0.05, 0.95),
+        'uniform(0, 6)': rng.uniform(0, 6, samples),
+        'lognormal(-3, 1)': rng.lognormal(-3, 1, samples),
+        'normal(0, 1)': rng.normal(0, 1, samples),
+        'ram in GB': rng.normal(0.042, 0.002, samples),
+    }
+    q = np.linspace(0.01, 0.99, 99)
+
+    ret = {}
+    for name, values in cases.items():
+        sketch = QuantileSketch.from_array(QuantileSketch.of(values).to_array())
+        # The sketch returns the sample at rank floor(q * (n - 1))
+        exact = np.quantile(values, q, method='lower')
+        error = np.abs(sketch.quantile(q) - exact) / np.maximum(np.abs(exact), np.finfo(np.float64).tiny)
+        ret[name] = float(error.max())
+        if ret[name] > sketch.alpha * (1 + 1e-9):
+            raise AssertionError(f"{name}: relative quantile error {ret[name]:.4f} exceeds alpha {sketch.alpha}")
+    return ret
+
+if __name__ == "__main__":
+    for name, error in check().items():
+        print(f"{name}: max relative error {error:.4%}")
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+import argparse
+import glob
+import json
+import os
+from typing import Dict, List
+
+import numpy as np
+
+TRACE_FILE = 'srv.trace'
+# Restarted instances write srv.<n>.trace next to the first trace
+TRACE_GLOB = 'srv*.trace'
+MAGIC = b'SRVTRACE'
+VERSION = 1
+
+HEADER = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('record_size', '<u4'),
+    ('capacity', '<u8'),
+    ('count', '<u8'),
+    ('start_ns', '<i8'),
+    ('start_realtime_ns', '<i8'),
+    ('mode', 'S16'),
+])
+
+RECORD = np.dtype([
+    ('iteration', '<u8'),
+    ('read_ns', '<i8'),
+    ('resume_ns', '<i8'),
+    ('post_ns', '<i8'),
+    ('pid_ns', '<i8'),
+    ('wait_ns', '<i8'),
+    ('write_ns', '<i8'),
+    ('pid', '<i4'),
+    ('status', '<i4'),
+    ('flags', '<u4'),
+    ('reserved', '<u4'),
+])
+
+TRACE_FORK = 1
+TRACE_STOPPED = 2
+TRACE_KILLED = 4
+
+# Phase name, start and end timestamps of one iteration
+PHASES = [
+    ('resume', 'read_ns', 'resume_ns'),
+    ('post', 'resume_ns', 'post_ns'),
+    ('handoff', 'post_ns', 'pid_ns'),
+    ('exec', 'pid_ns', 'wait_ns'),
+    ('report', 'wait_ns', 'write_ns'),
+    ('total', 'read_ns', 'write_ns'),
+]
+QUANTILES = [0.5, 0.9, 0.99]
+
+class Trace():
+    def __init__(self, path: str) -> None:
+        self.path = path
+        mem = np.memmap(path, mode='r', dtype=np.uint8)
+
+        header = mem[:HEADER.itemsize].view(HEADER)[0]
+        if header['magic'] != MAGIC or header['version'] != VERSION:
+            raise ValueError(f"{path} is not an execsrv trace")
+        if header['record_size'] != RECORD.itemsize:
+            raise ValueError(f"{path} has {header['record_size']} byte records, expected {RECORD.itemsize}")
+
+        self.mode = header['mode'].decode() or 'unknown'
+        self.capacity = int(header['capacity'])
+        self.count = int(header['count'])
+        self.start_ns = int(header['start_ns'])
+        self.start_realtime_ns = int(header['start_realtime_ns'])
+
+        ring = mem[HEADER.itemsize:HEADER.itemsize + self.capacity * RECORD.itemsize].view(RECORD)
+        used = ring[:min(self.count, self.capacity)]
+
+        # Slots of a ring that wrapped hold the newest records, keep them in order
+        # and drop any slot the writer had not finished when the count was read
+        records = np.sort(np.array(used), order='iteration')
+        self.records = records[(records['iteration'] < self.count) & (records['write_ns'] > 0)]
+
+    @property
+    def dropped(self) -> int:
+        return max(self.count - self.capacity, 0)
+
+    def phases(self, mask: np.ndarray | None = None) -> Dict[str, np.ndarray]:
+        records = self.records if mask is None else self.records[mask]
+        ret = { name:(records[end] - records[start]) / 1000 for name, start, end in PHASES }
+
+        # Time AFL spends between a status and the next control word
+        gaps = records['read_ns'][1:] - records['write_ns'][:-1]
+        contiguous = np.diff(records['iteration']) == 1
+        ret['afl'] = gaps[contiguous] / 1000
+        return ret
+
+    def kinds(self) -> Dict[str, np.ndarray]:
+        flags = self.records['flags']
+        return {
+            'fork': (flags & TRACE_FORK) != 0,
+            'resume': (flags & TRACE_FORK) == 0,
+        }
+
+def find_traces(paths: List[str]) -> List[str]:
+    ret = []
+    for path in paths:
+        if os.path.isdir(path):
+            ret += sorted(glob.glob(os.path.join(path, '**', TRACE_GLOB), recursive=True))
+        else:
+            ret.append(path)
+    return ret
+
+def describe(values: np.ndarray) -> Dict[str, float]:
+    if values.size == 0:
+        return { 'n': 0 }
+
+    ret = { 'n': int(values.size), 'mean': float(values.mean()) }
+    for q, value in zip(QUANTILES, np.quantile(values, QUANTILES)):
+        ret[f'p{int(q * 100)}'] = float(value)
+    ret['max'] = float(values.max())
+    return ret
+
+def breakdown(traces: List[Trace]) -> Dict[str, Dict]:
+    """
+    Latency of every phase in microseconds per revert mode, split into
+    iterations that spawned QEMU and ones that resumed a stopped QEMU
+    """
+    by_mode: Dict[str, List[Trace]] = {}
+    for trace in traces:
+        by_mode.setdefault(trace.mode, []).append(trace)
+
+    ret = {}
+    for mode, group in sorted(by_mode.items()):
+        entry = {
+            'traces': len(group),
+            'iterations': sum(len(trace.records) for trace in group),
+            'dropped': sum(trace.dropped for trace in group),
+            'killed': int(sum(((trace.records['flags'] & TRACE_KILLED) != 0).sum() for trace in group)),
+        }
+
+        for kind in ('fork', 'resume'):
+            phases = [ trace.phases(trace.kinds()[kind]) for trace in group ]
+            entry[kind] = {
+                name:describe(np.concatenate([ phase[name] for phase in phases ]))
+                    for name in phases[0]
+            }
+        ret[mode] = entry
+    return ret
+
+def format_breakdown(result: Dict[str, Dict]) -> str:
+    lines = []
+    for mode, entry in result.items():
+        lines.append(f"{mode}: {entry['iterations']} iterations from {entry['traces']} traces, "
+                     f"{entry['dropped']} dropped, {entry['killed']} killed")
+        for kind in ('fork', 'resume'):
+            if entry[kind]['total']['n'] == 0:
+                continue
+            lines.append(f"  {kind}:")
+            for name, stats in entry[kind].items():
+                if stats['n'] == 0:
+                    continue
+                quantiles = ' '.join(f"p{int(q * 100)}={stats[f'p{int(q * 100)}']:.1f}" for q in QUANTILES)
+                lines.append(f"    {name:>8} us: mean={stats['mean']:.1f} {quantiles} max={stats['max']:.1f}")
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser("execsrv trace decoder")
+    parser.add_argument('paths', type=str, help="Trace files or benchmark directories to search for execsrv traces", nargs='+')
+    parser.add_argument('--json', type=str, required=False, help="Write the breakdown as JSON to this file")
+    parser.add_argument('--dump', required=False, action='store_true', help="Print every record of the first trace")
+    args = parser.parse_args()
+
+    traces = [ Trace(path) for path in find_traces(args.paths) ]
+    if not traces:
+        parser.error("no traces found")
+
+    if args.dump:
+        for record in traces[0].records:
+            print(' '.join(f"{name}={record[name]}" for name in RECORD.names if name != 'reserved'))
+        return
+
+    result = breakdown(traces)
+    print(format_breakdown(result))
+
+    if args.json is not None:
+        with open(args.json, 'w') as file:
+            json.dump(result, file, indent=2)
+
+if __name__ == "__main__":
+    main()
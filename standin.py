@@ -0,0 +1,277 @@
+import json
+import os
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass
+from typing import Dict, List
+
+AFL_FORKSRV_FD = 198
+STANDIN_STATS = 'standin.json'
+EXECUTABLES = {
+    'afl': os.path.join('afl', 'afl-fuzz'),
+    'srv': os.path.join('execsrv', 'srv'),
+    'qemu': os.path.join('qemu', 'qemu-system-aarch64'),
+}
+FUZZ_KERNEL_ARGS = { 'fuzz', 'host_fuzz', 'fuzz_no_reverts' }
+
+@dataclass()
+class StandinConfig:
+    exec_us: float = 1000         # CPU time burnt by QEMU per test case
+    boot: float = 0.5             # Seconds from QEMU start to the first test case
+    console_bytes: int = 64       # Normal world console output per test case
+    secure_every: int = 10        # Test cases between secure world console lines
+    statsd_interval: float = 1.0
+    replay: bool = True           # Guest runs the test case passed on its command line
+    connect_timeout: float = 5.0
+
+    @staticmethod
+    def load(path: str) -> 'StandinConfig':
+        with open(path) as file:
+            return StandinConfig(**json.load(file))
+
+def write_json(path: str, data: Dict):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as file:
+        json.dump(data, file)
+    os.replace(tmp, path)
+
+def read_exact(fd: int, size: int) -> bytes:
+    data = b''
+    while len(data) < size:
+        chunk = os.read(fd, size - len(data))
+        if not chunk:
+            raise EOFError
+        data += chunk
+    return data
+
+def terminate(signum, frame):
+    raise SystemExit(0)
+
+def option(args: List[str], *names: str) -> str | None:
+    for name in names:
+        if name in args:
+            return args[args.index(name) + 1]
+    return None
+
+def run_afl(args: List[str], cfg: StandinConfig):
+    """
+    afl-fuzz -Q external ... -i in -o out [-M|-S name] -- srv ... -- qemu ...
+    Drives the target through the forkserver pipes and reports AFL style
+    statsd gauges.
+    """
+    started = time.time()
+    signal.signal(signal.SIGTERM, terminate)
+
+    split = args.index('--')
+    options, target = args[:split], args[split + 1:]
+    name = option(options, '-M', '-S') or 'default'
+    out_dir = os.path.join(option(options, '-o'), name)
+    os.makedirs(out_dir, exist_ok=True)
+
+    # AFL substitutes @@ with the file holding the current input
+    cur_input = os.path.join(out_dir, '.cur_input')
+    with open(cur_input, 'wb') as file:
+        file.write(b'\0' * 16)
+    target = [ cur_input if arg == '@@' else arg for arg in target ]
+
+    ctl_r, ctl_w = os.pipe()
+    st_r, st_w = os.pipe()
+    os.dup2(ctl_r, AFL_FORKSRV_FD)
+    os.dup2(st_w, AFL_FORKSRV_FD + 1)
+    os.close(ctl_r)
+    os.close(st_w)
+
+    srv = subprocess.Popen(target, pass_fds=(AFL_FORKSRV_FD, AFL_FORKSRV_FD + 1))
+    os.close(AFL_FORKSRV_FD)
+    os.close(AFL_FORKSRV_FD + 1)
+
+    statsd = None
+    if os.environ.get('AFL_STATSD') == '1':
+        statsd = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        address = (os.environ.get('AFL_STATSD_HOST', '127.0.0.1'), int(os.environ.get('AFL_STATSD_PORT', '8125')))
+
+    stats = { 'started': started, 'handshake': None, 'first_exec': None, 'execs': 0, 'finished': None }
+    stats_path = os.path.join(out_dir, STANDIN_STATS)
+    child = 0
+
+    try:
+        read_exact(st_r, 4)
+        stats['handshake'] = time.time()
+
+        last, last_execs = time.time(), 0
+        while True:
+            os.write(ctl_w, struct.pack('<I', 0))
+            child, = struct.unpack('<i', read_exact(st_r, 4))
+            read_exact(st_r, 4)
+            stats['execs'] += 1
+
+            now = time.time()
+            if stats['first_exec'] is None:
+                stats['first_exec'] = now
+                write_json(stats_path, stats)
+
+            if now - last >= cfg.statsd_interval:
+                if statsd is not None:
+                    rate = (stats['execs'] - last_execs) / (now - last)
+                    gauges = {
+                        'cycle_done': 0, 'cycles_wo_finds': 0, 'execs_done': stats['execs'], 'execs_per_sec': rate,
+                        'corpus_count': 1, 'corpus_found': 0, 'saved_crashes': 0, 'saved_hangs': 0, 'total_crashes': 0,
+                    }
+                    statsd.sendto(''.join(f'afl.{k}:{v}|g\n' for k, v in gauges.items()).encode(), address)
+                last, last_execs = now, stats['execs']
+    except (EOFError, OSError):
+        pass
+    finally:
+        stats['finished'] = time.time()
+        write_json(stats_path, stats)
+        for pid in (child, srv.pid):
+            if pid > 0:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+        srv.wait()
+
+def run_srv(args: List[str], cfg: StandinConfig):
+    """
+    Same protocol as execsrv: the QEMU child stops itself after every test
+    case and is resumed with SIGCONT for the next one
+    """
+    path = option(args, '-p')
+    split = args.index('--') + 1 if '--' in args else len(args)
+    argv = [ os.path.basename(path) ] + args[split:]
+
+    os.write(AFL_FORKSRV_FD + 1, struct.pack('<I', 0))
+    child, stopped = 0, False
+
+    try:
+        while True:
+            read_exact(AFL_FORKSRV_FD, 4)
+
+            if not stopped:
+                child = os.posix_spawn(path, argv, os.environ)
+            else:
+                os.kill(child, signal.SIGCONT)
+                stopped = False
+
+            os.write(AFL_FORKSRV_FD + 1, struct.pack('<i', child))
+            _, status = os.waitpid(child, os.WUNTRACED)
+
+            stopped = os.WIFSTOPPED(status)
+            os.write(AFL_FORKSRV_FD + 1, struct.pack('<i', 0 if stopped else status))
+    except (EOFError, OSError):
+        if child > 0:
+            try:
+                os.kill(child, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+def open_serial(spec: str, timeout: float):
+    kind, _, target = spec.partition(':')
+    if kind == 'file':
+        return open(target, 'ab', buffering=0)
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if kind == 'unix':
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.connect(target)
+                return sock.makefile('wb', buffering=0)
+
+            host, _, port = target.rpartition(':')
+            return socket.create_connection((host, int(port))).makefile('wb', buffering=0)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+def run_qemu(args: List[str], cfg: StandinConfig):
+    serials = [ args[i + 1] for i, arg in enumerate(args) if arg == '-serial' ]
+    normal, secure = [ open_serial(spec, cfg.connect_timeout) for spec in serials[:2] ]
+    append = option(args, '-append') or ''
+    kernel_args = set(append.split())
+
+    log = option(args, '-D')
+    if log is not None:
+        with open(log, 'a') as file:
+            file.write(f'standin qemu {os.getpid()}\n')
+
+    time.sleep(cfg.boot)
+    normal.write(b'Booting Linux on physical CPU 0x0000000000 [0x000f0510]\n')
+    # A kernel echoes its command line, unknown parameters a second time
+    normal.write(f'Kernel command line: {append}\n'.encode())
+    if 'testcase=' in append:
+        normal.write(f'Unknown kernel command line parameters "{append}", will be passed to user space.\n'.encode())
+    secure.write(b'I/TC: OP-TEE version: standin\n')
+
+    # Replays pass the input on the command line, the guest reports running it
+    testcase = [ arg[len('testcase='):] for arg in kernel_args if arg.startswith('testcase=') ]
+    if testcase and cfg.replay:
+        normal.write(f'running testcase of {len(testcase[0]) // 2} bytes\n'.encode())
+
+    if not kernel_args & FUZZ_KERNEL_ARGS:
+        return
+
+    line = b'x' * max(cfg.console_bytes - 1, 0) + b'\n'
+    count = 0
+    while True:
+        end = time.perf_counter() + cfg.exec_us / 10 ** 6
+        while time.perf_counter() < end:
+            pass
+
+        normal.write(line)
+        count += 1
+        if cfg.secure_every > 0 and count % cfg.secure_every == 0:
+            secure.write(b'D/TC:0 0 standin test case done\n')
+
+        os.kill(os.getpid(), signal.SIGSTOP)
+
+ROLES = {
+    'afl': run_afl,
+    'srv': run_srv,
+    'qemu': run_qemu,
+}
+
+def main(role: str, config: str):
+    ROLES[role](sys.argv[1:], StandinConfig.load(config))
+
+def install(root: str, cfg: StandinConfig, srv: str | None = None) -> Dict[str, str]:
+    """
+    Lay out afl/, execsrv/ and qemu/ under `root` the way run.py expects them,
+    with executables that re-enter this module. A real execsrv build can be
+    used in place of the stand-in server.
+    """
+    config = os.path.join(root, 'standin.json')
+    os.makedirs(os.path.join(root, 'out'), exist_ok=True)
+    write_json(config, asdict(cfg))
+
+    for role, path in EXECUTABLES.items():
+        path = os.path.join(root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.lexists(path):
+            os.remove(path)
+
+        if role == 'srv' and srv is not None:
+            os.symlink(os.path.abspath(srv), path)
+            continue
+
+        with open(path, 'w') as file:
+            file.write(f'#!{sys.executable}\n'
+                       f'import sys\n'
+                       f'sys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r})\n'
+                       f'from standin import main\n'
+                       f'main({role!r}, {config!r})\n')
+        os.chmod(path, 0o755)
+
+    return {
+        'afl_dir': os.path.join(root, 'afl'),
+        'execsrv_dir': os.path.join(root, 'execsrv'),
+        'qemu_dir': os.path.join(root, 'qemu'),
+        'optee_out_dir': os.path.join(root, 'out'),
+        'tmpfs': os.path.join(root, 'tmpfs'),
+    }
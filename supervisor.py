@@ -0,0 +1,193 @@
+import asyncio
+import json
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List
+
+from consolelog import console_size as log_size
+from livestats import LiveStats
+from sampler import proc_stat, process_tree
+
+@dataclass()
+class SupervisorConfig:
+    check_interval: float = 5
+    startup_grace: float = 180    # Seconds after a (re)start before stalls count
+    stall_after: float = 120      # Seconds without statsd data or throughput
+    min_rate: float = 0.0         # execs_per_sec at or below this is no throughput
+    console_timeout: float = 0    # Seconds without console output, 0 disables
+    max_restarts: int = 5
+    backoff: float = 10           # Seconds before a restart, doubled for every further one
+
+@dataclass()
+class Downtime:
+    start: float
+    reason: str
+    detected: float
+    restarted: float | None = None
+    end: float | None = None
+
+class InstanceHealth():
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self.restarts = 0
+        self.gave_up = False
+        self.console_size = 0
+        self.console_seen = time.monotonic()
+        self.downtime: List[Downtime] = []
+
+    @property
+    def down(self) -> Downtime | None:
+        if self.downtime and self.downtime[-1].end is None:
+            return self.downtime[-1]
+        return None
+
+def console_size(inst) -> int:
+    return log_size(inst.normal_log) + log_size(inst.secure_log)
+
+class Supervisor():
+    """
+    Watches the process tree, statsd heartbeat and console output of every
+    instance and restarts the ones that died or stopped making progress
+    """
+    def __init__(self, cfg: SupervisorConfig, stats: LiveStats, instances: List, stop: asyncio.Event,
+                 restart: Callable, label: str = '') -> None:
+        self.cfg = cfg
+        self.stats = stats
+        self.instances = instances
+        self.stop = stop
+        self.restart = restart
+        self.label = label
+        self.health: Dict[int, InstanceHealth] = { inst.index:InstanceHealth() for inst in instances }
+
+    def _progress(self, index: int, since: float) -> bool | None:
+        inst = self.stats.instances.get(index)
+        execs = inst.metrics.get('execs_per_sec') if inst is not None else None
+        if execs is None:
+            return None
+
+        recent = [ v for t, v in execs.samples if t >= since ]
+        if not recent:
+            return None
+        return max(recent) > self.cfg.min_rate
+
+    def diagnose(self, inst) -> str | None:
+        now = time.monotonic()
+        health = self.health[inst.index]
+
+        if inst.process is not None and inst.process.poll() is not None:
+            return f'exited with {inst.process.returncode}'
+
+        pid = inst.pid()
+        if pid is not None:
+            names = { stat[0] for stat in map(proc_stat, process_tree(pid)) if stat is not None }
+            if now - health.started > self.cfg.startup_grace and 'srv' not in names:
+                return 'execsrv missing'
+
+        size = console_size(inst)
+        if size != health.console_size:
+            health.console_size = size
+            health.console_seen = now
+
+        if now - health.started < self.cfg.startup_grace:
+            return None
+
+        stats = self.stats.instances.get(inst.index)
+        last_seen = stats.last_seen if stats is not None else None
+        if last_seen is None or now - max(last_seen, health.started) > self.cfg.stall_after:
+            return 'no statsd data'
+
+        if self._progress(inst.index, now - self.cfg.stall_after) is False and now - health.started > self.cfg.stall_after:
+            return 'no throughput'
+
+        if self.cfg.console_timeout > 0 and now - health.console_seen > self.cfg.console_timeout:
+            return 'console silent'
+
+        return None
+
+    def _recovered(self, inst) -> bool:
+        health = self.health[inst.index]
+        down = health.down
+        if down is None or down.restarted is None:
+            return False
+        return self._progress(inst.index, health.started) is True
+
+    async def _handle(self, inst, reason: str):
+        health = self.health[inst.index]
+        now = time.time()
+
+        if health.down is None:
+            stats = self.stats.instances.get(inst.index)
+            last_seen = stats.last_seen if stats is not None else None
+            # The instance was last known good when it last reported
+            start = now - (time.monotonic() - last_seen) if last_seen is not None and reason != 'console silent' else now
+            health.downtime.append(Downtime(start, reason, now))
+
+        if health.restarts >= self.cfg.max_restarts:
+            if not health.gave_up:
+                health.gave_up = True
+                print(f"{self.label}Instance {inst.index} {reason}, giving up after {health.restarts} restarts", flush=True)
+            return
+
+        delay = self.cfg.backoff * 2 ** health.restarts
+        print(f"{self.label}Instance {inst.index} {reason}, restarting in {delay:.0f}s", flush=True)
+        try:
+            await asyncio.wait_for(self.stop.wait(), delay)
+            return
+        except asyncio.TimeoutError:
+            pass
+
+        if await self.restart(inst):
+            health.restarts += 1
+            health.started = time.monotonic()
+            health.console_seen = health.started
+            health.down.restarted = time.time()
+
+    async def _watch(self, inst):
+        while not self.stop.is_set():
+            try:
+                await asyncio.wait_for(self.stop.wait(), self.cfg.check_interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+
+            health = self.health[inst.index]
+            if health.gave_up:
+                continue
+
+            if self._recovered(inst):
+                health.down.end = time.time()
+                print(f"{self.label}Instance {inst.index} recovered", flush=True)
+                continue
+
+            reason = self.diagnose(inst)
+            if reason is not None:
+                await self._handle(inst, reason)
+
+    async def run(self):
+        await asyncio.gather(*(self._watch(inst) for inst in self.instances))
+
+    def report(self, started: float, finished: float) -> Dict:
+        instances = {}
+        for index, health in self.health.items():
+            intervals = [ asdict(down) for down in health.downtime ]
+            total = sum(min(down.end or finished, finished) - max(down.start, started) for down in health.downtime)
+            instances[index] = {
+                'restarts': health.restarts,
+                'gave_up': health.gave_up,
+                'downtime': max(total, 0.0),
+                'intervals': intervals,
+            }
+
+        total = sum(inst['downtime'] for inst in instances.values())
+        return {
+            'config': asdict(self.cfg),
+            'started': started,
+            'finished': finished,
+            'downtime': total,
+            'availability': 1 - total / (len(instances) * (finished - started)) if instances and finished > started else None,
+            'instances': instances,
+        }
+
+    def write(self, path: str, started: float, finished: float):
+        with open(path, 'w') as file:
+            json.dump(self.report(started, finished), file, indent=2)
@@ -0,0 +1,221 @@
+import asyncio
+import itertools
+import math
+import json
+import os
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List
+
+from benchmark import CONSOLE_SEGMENT_SIZE, Benchmark, prepare_dir
+from sampler import system_memory
+from affinity import CpuAllocator
+from exporter import MetricsExporter
+from convergence import ConvergenceConfig
+from supervisor import SupervisorConfig
+
+GB = 10 ** 9
+
+@dataclass()
+class Job:
+    mode: str
+    decoding: str
+    threads: int
+    repeat: int = 0
+    status: str = 'pending'
+    dir: str = ''
+    cpus: float = 0
+    ram: float = 0
+    first_slot: int = 0
+    started: float | None = None
+    finished: float | None = None
+    error: str | None = None
+    reason: str | None = None
+
+    @property
+    def name(self) -> str:
+        return f"{self.mode}-{self.decoding}-t{self.threads}-r{self.repeat}"
+
+@dataclass()
+class SweepSpec:
+    modes: List[str] = field(default_factory=lambda: ['normal'])
+    decoding: List[str] = field(default_factory=lambda: ['dsl'])
+    threads: List[int] = field(default_factory=lambda: [1])
+    repeat: int = 1
+    jobs: List[Dict] = field(default_factory=list)
+    time: float = 3600 * 2
+    corpus: str = './in'
+    budget: Dict[str, float] = field(default_factory=dict)
+    cost: Dict = field(default_factory=lambda: { 'cpus': 1, 'ram': 1.5 })
+    stats_window: float = 300
+    summary_interval: float = 60
+    sample_interval: float = 5
+    pin: str = 'none'
+    cooperative: bool = False
+    sync_time: int | None = None
+    adaptive: Dict | None = None
+    supervise: Dict | None = None
+    console_transport: str = 'unix'
+    console_segment_size: int = CONSOLE_SEGMENT_SIZE
+    console_segment_time: float = 0
+
+    def instance_cost(self, mode: str) -> tuple[float, float]:
+        cpus = self.cost.get('cpus', 1)
+        ram = self.cost.get('ram', 1.5)
+        if isinstance(cpus, dict):
+            cpus = cpus.get(mode, cpus.get('default', 1))
+        if isinstance(ram, dict):
+            ram = ram.get(mode, ram.get('default', 1.5))
+        return float(cpus), float(ram)
+
+    def expand(self) -> List[Job]:
+        jobs = [
+            Job(mode, decoding, threads, repeat)
+                for mode, decoding, threads, repeat in itertools.product(self.modes, self.decoding, self.threads, range(self.repeat))
+        ]
+        jobs += [ Job(**job) for job in self.jobs ]
+
+        for job in jobs:
+            cpus, ram = self.instance_cost(job.mode)
+            job.cpus = cpus * job.threads
+            job.ram = ram * job.threads
+
+        return jobs
+
+class Sweep():
+    def __init__(self, spec: SweepSpec, sweep_dir: str, exporter: MetricsExporter | None = None, resume: bool = False) -> None:
+        self.spec = spec
+        self.sweep_dir = sweep_dir
+        self.exporter = exporter
+        self.resume = resume
+        self.jobs = spec.expand()
+        self.cpus = float(spec.budget.get('cpus', os.cpu_count() or 1))
+        self.ram = float(spec.budget.get('ram', system_memory()['total'] / GB))
+        self.active: List[Job] = []
+        self.slots: List[bool] = []
+        self.allocator = CpuAllocator(spec.pin) if spec.pin != 'none' else None
+
+        for job in self.jobs:
+            if job.cpus > self.cpus or job.ram > self.ram:
+                raise ValueError(f"Job {job.name} needs {job.cpus} cpus and {job.ram} GB, budget is {self.cpus} cpus and {self.ram} GB")
+
+    @staticmethod
+    def from_file(path: str, sweep_dir: str, exporter: MetricsExporter | None = None, resume: bool = False) -> 'Sweep':
+        with open(path) as file:
+            return Sweep(SweepSpec(**json.load(file)), sweep_dir, exporter, resume)
+
+    def _restore(self):
+        # Jobs a previous run finished are kept, everything else is resumed in place
+        try:
+            with open(os.path.join(self.sweep_dir, 'manifest.json')) as file:
+                previous = { job['name']:job for job in json.load(file)['jobs'] }
+        except (OSError, ValueError, KeyError):
+            return
+
+        for job in self.jobs:
+            entry = previous.get(job.name)
+            if entry is not None and entry['status'] == 'done':
+                job.status, job.dir, job.reason = entry['status'], entry['dir'], entry['reason']
+                job.started, job.finished = entry['started'], entry['finished']
+
+    # Summed from the running jobs, adding and subtracting floats leaves residue
+    @property
+    def used_cpus(self) -> float:
+        return math.fsum(job.cpus for job in self.active)
+
+    @property
+    def used_ram(self) -> float:
+        return math.fsum(job.ram for job in self.active)
+
+    def _fits(self, job: Job) -> bool:
+        jobs = self.active + [job]
+        return math.fsum(i.cpus for i in jobs) <= self.cpus and math.fsum(i.ram for i in jobs) <= self.ram
+
+    def _allocate_slots(self, count: int) -> int:
+        run = 0
+        for index, used in enumerate(self.slots):
+            run = 0 if used else run + 1
+            if run == count:
+                start = index - count + 1
+                break
+        else:
+            start = len(self.slots) - run
+            self.slots += [False] * (start + count - len(self.slots))
+
+        for i in range(start, start + count):
+            self.slots[i] = True
+        return start
+
+    def _free_slots(self, start: int, count: int):
+        for i in range(start, start + count):
+            self.slots[i] = False
+
+    def write_manifest(self):
+        manifest = {
+            'spec': asdict(self.spec),
+            'budget': { 'cpus': self.cpus, 'ram': self.ram },
+            'jobs': [ dict(asdict(job), name=job.name) for job in self.jobs ],
+        }
+
+        tmp = os.path.join(self.sweep_dir, 'manifest.json.tmp')
+        with open(tmp, 'w') as file:
+            json.dump(manifest, file, indent=2)
+        os.replace(tmp, os.path.join(self.sweep_dir, 'manifest.json'))
+
+    async def _run_job(self, job: Job):
+        job.status = 'running'
+        job.started = time.time()
+        job.dir = os.path.join(self.sweep_dir, job.name)
+        self.write_manifest()
+        print(f"Starting {job.name} ({job.cpus:g} cpus, {job.ram:g} GB)", flush=True)
+
+        try:
+            resume = self.resume and os.path.isdir(job.dir)
+            if not resume:
+                await prepare_dir(job.dir)
+            benchmark = Benchmark(job.mode, job.dir, self.spec.corpus, job.decoding,
+                                  self.spec.stats_window, job.first_slot, job.name, self.allocator,
+                                  self.spec.cooperative, self.spec.sync_time, self.exporter,
+                                  self.spec.console_transport, self.spec.console_segment_size,
+                                  self.spec.console_segment_time, resume)
+            adaptive = ConvergenceConfig(**self.spec.adaptive) if self.spec.adaptive is not None else None
+            supervise = SupervisorConfig(**self.spec.supervise) if self.spec.supervise is not None else None
+            await benchmark.run_for(job.threads, self.spec.time, False,
+                                    self.spec.summary_interval, self.spec.sample_interval, adaptive, supervise)
+            job.status = 'done'
+            job.reason = benchmark.stop_reason
+        except Exception as e:
+            job.status = 'failed'
+            job.error = repr(e)
+        finally:
+            job.finished = time.time()
+            self.active.remove(job)
+            self._free_slots(job.first_slot, job.threads)
+            self.write_manifest()
+            print(f"Finished {job.name}: {job.status}", flush=True)
+
+    async def run(self):
+        os.makedirs(self.sweep_dir, exist_ok=True)
+        if self.resume:
+            self._restore()
+        self.write_manifest()
+
+        pending = [ job for job in self.jobs if job.status != 'done' ]
+        running = set()
+
+        while pending or running:
+            for job in list(pending):
+                if self._fits(job):
+                    pending.remove(job)
+                    job.first_slot = self._allocate_slots(job.threads)
+                    self.active.append(job)
+                    running.add(asyncio.create_task(self._run_job(job)))
+
+            if not running:
+                for job in pending:
+                    job.status = 'failed'
+                    job.error = f"needs {job.cpus:g} cpus and {job.ram:g} GB, never fit the budget of {self.cpus:g} cpus and {self.ram:g} GB"
+                self.write_manifest()
+                raise RuntimeError(f"{len(pending)} jobs never fit the budget: " + ", ".join(job.name for job in pending))
+
+            _, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
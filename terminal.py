@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import selectors
+import socket
+import sys
+
+def listen(endpoint: str) -> socket.socket:
+    kind, _, target = endpoint.partition(':')
+    if kind == 'unix':
+        # A socket left behind by a closed terminal would fail the bind
+        if os.path.exists(target):
+            os.unlink(target)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(target)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(('127.0.0.1', int(target)))
+    sock.listen(1)
+    return sock
+
+def address(sock: socket.socket) -> str:
+    if sock.family == socket.AF_UNIX:
+        return f'unix:{sock.getsockname()}'
+    return f'tcp:{sock.getsockname()[1]}'
+
+def relay(sock: socket.socket):
+    # QEMU connects again after every restart, the window stays open
+    stdin = sys.stdin.fileno()
+    while True:
+        conn, _ = sock.accept()
+        with conn, selectors.DefaultSelector() as selector:
+            selector.register(conn, selectors.EVENT_READ)
+            try:
+                selector.register(stdin, selectors.EVENT_READ)
+            except (PermissionError, ValueError):
+                # stdin is not pollable, e.g. /dev/null, the console is output only
+                pass
+
+            connected = True
+            while connected:
+                for key, _ in selector.select():
+                    if key.fileobj is conn:
+                        data = conn.recv(0x10000)
+                        if not data:
+                            connected = False
+                            break
+                        sys.stdout.buffer.write(data)
+                        sys.stdout.buffer.flush()
+                    else:
+                        data = os.read(stdin, 0x1000)
+                        if data:
+                            conn.sendall(data)
+                        else:
+                            selector.unregister(stdin)
+
+def main():
+    parser = argparse.ArgumentParser("Console terminal")
+    parser.add_argument('endpoint', type=str, help="unix:<path> or tcp:<port> to listen on, port 0 picks a free one")
+    parser.add_argument('--ready', type=str, required=False, help="FIFO to write the bound endpoint to once it listens")
+    args = parser.parse_args()
+
+    sock = listen(args.endpoint)
+    if args.ready is not None:
+        with open(args.ready, 'w') as file:
+            file.write(address(sock) + '\n')
+
+    try:
+        relay(sock)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+        if sock.family == socket.AF_UNIX and os.path.exists(args.endpoint.partition(':')[2]):
+            os.unlink(args.endpoint.partition(':')[2])
+
+if __name__ == "__main__":
+    main()
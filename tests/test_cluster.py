@@ -0,0 +1,33 @@
+import json
+
+from cluster import Assignment, ClusterSpec, Coordinator
+from metricstore import MetricStore
+
+HEADER = 'time,instance,used,available,tmpfs,afl_cpu,afl_rss,srv_cpu,srv_rss,qemu_cpu,qemu_rss\n'
+
+def result(path, start):
+    (path / '0').mkdir(parents=True)
+    (path / '0' / 'metric.log').write_text('')
+    (path / 'resources.csv').write_text(HEADER + ''.join(
+        f'{start + i:.3f},0,1,1,0,{i},100,0,100,0,100\n' for i in range(3)
+    ))
+    (path / 'ram.log').write_text(''.join(json.dumps({ 'time': start + i, 'used': 1e9 }) + '\n' for i in range(3)))
+
+def test_merge_resources_into_top_level(tmp_path):
+    bench = tmp_path / 'bench'
+    bench.mkdir()
+    coordinator = Coordinator(ClusterSpec(), str(bench))
+    for agent, first, start in (('a', 0, 10.0), ('b', 1, 10.5)):
+        result(tmp_path / agent, start)
+        coordinator._merge(Assignment(agent, first, 1), str(tmp_path / agent))
+
+    resources = MetricStore().read_resources(str(bench))
+    assert sorted(resources) == ['0', '1']
+    assert list(resources['1']['time']) == [10.5, 11.5, 12.5]
+
+    times = [ json.loads(line)['time'] for line in (bench / 'ram.log').read_text().splitlines() ]
+    assert times == sorted(times) and len(times) == 6
+
+    # The raw copies stay with their agent, instance ids as the agent wrote them
+    assert (bench / 'nodes' / 'b' / 'resources.csv').read_text().splitlines()[1].split(',')[1] == '0'
+    assert (bench / 'nodes' / 'b' / 'ram.log').is_file()
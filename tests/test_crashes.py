@@ -0,0 +1,28 @@
+import argparse
+import asyncio
+
+from crashes import CrashDatabase, verify
+from replay import CONSUMED_PATTERN
+from standin import StandinConfig, install
+
+def test_retry_input_that_never_ran(tmp_path):
+    db = CrashDatabase(str(tmp_path / 'crashdb'))
+    (tmp_path / 'crashdb' / 'inputs' / 'abc').write_bytes(b'\x00\xff')
+    db.crashes['abc'] = { 'size': 2, 'sources': [], 'status': None, 'signature': None }
+
+    def run(cfg: StandinConfig):
+        dirs = install(str(tmp_path / 'standin'), cfg)
+        args = argparse.Namespace(
+            reverify=False, testcase_decoding_mode='dsl', qemu_dir=dirs['qemu_dir'], optee_out_dir=dirs['optee_out_dir'],
+            jobs=1, timeout=30, delivery='cmdline', replay_kernel_args='replay', consumed_pattern=CONSUMED_PATTERN.decode(),
+        )
+        asyncio.run(verify(db, args))
+
+    # The kernel echoes testcase= but the guest never runs it
+    run(StandinConfig(boot=0, replay=False))
+    assert db.crashes['abc']['status'] == 'error'
+    assert db.pending(False) == ['abc']
+
+    run(StandinConfig(boot=0))
+    assert db.crashes['abc']['status'] == 'passed'
+    assert db.pending(False) == []
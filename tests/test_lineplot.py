@@ -0,0 +1,13 @@
+import matplotlib
+matplotlib.use('Agg')
+
+import pytest
+
+from lineplot import LinePlot
+
+@pytest.mark.parametrize('time', [None, 3600.0])
+def test_plot_metric_without_samples(tmp_path, time):
+    # An instance directory without metric or resource logs
+    (tmp_path / '0').mkdir()
+    with pytest.raises(ValueError, match='No ram samples'):
+        LinePlot().plot('ram', str(tmp_path), time, 10)
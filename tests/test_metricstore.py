@@ -0,0 +1,19 @@
+import numpy as np
+
+from collector import TIME_SUFFIX
+from metricstore import TIME_DTYPE, MetricStore
+
+def test_load_skips_malformed_line(tmp_path):
+    lines = [b'afl.total_crashes:1|g', b'afl.total_crashes:|g', b'afl.execs_per_sec:x|g', b'afl.total_crashes:3|g']
+    log = tmp_path / 'metric.log'
+    log.write_bytes(b''.join(line + b'\n' for line in lines))
+    # One datagram per line, flushed at 10, 11, 12 and 13 seconds
+    ends = np.cumsum([ len(line) + 1 for line in lines ])
+    index = np.array(list(zip(ends, [10.0, 11.0, 12.0, 13.0])), dtype=TIME_DTYPE)
+    (tmp_path / ('metric.log' + TIME_SUFFIX)).write_bytes(index.tobytes())
+
+    store = MetricStore()
+    assert list(store.load(str(log))['total_crashes']) == [1.0, 3.0]
+    assert 'execs_per_sec' not in store.load(str(log))
+    assert list(store.load_times(str(log))['total_crashes']) == [10.0, 13.0]
+    assert store.load_sketches(str(log))['total_crashes'].count == 2
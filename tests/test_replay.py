@@ -0,0 +1,23 @@
+import re
+
+from replay import CONSUMED_PATTERN, was_consumed
+
+def consumed(tmp_path, *lines: bytes) -> bool:
+    log = tmp_path / 'normal.log'
+    log.write_bytes(b''.join(line + b'\n' for line in lines))
+    return was_consumed(re.compile(CONSUMED_PATTERN), str(log))
+
+def test_cmdline_echo_is_not_consumed(tmp_path):
+    assert not consumed(tmp_path,
+        b'[    0.000000] Kernel command line: console=ttyAMA0 testcase=00ff',
+        b'[    0.000000] Unknown kernel command line parameters "testcase=00ff", will be passed to user space.',
+    )
+    assert not consumed(tmp_path,
+        b'[    0.000000] Unknown kernel command line parameters "testcase=00ff", will be passed to user space.',
+    )
+
+def test_guest_report_is_consumed(tmp_path):
+    assert consumed(tmp_path,
+        b'[    0.000000] Kernel command line: console=ttyAMA0 testcase=00ff',
+        b'running testcase of 2 bytes',
+    )
@@ -0,0 +1,31 @@
+import json
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+
+from collector import TIME_SUFFIX
+from metricstore import TIME_DTYPE
+from report import Report, draw_ram_line
+
+def test_ram_line_uses_sample_times(tmp_path):
+    (tmp_path / '0').mkdir()
+    line = b'afl.execs_per_sec:1|g\n'
+    (tmp_path / '0' / 'metric.log').write_bytes(line)
+    (tmp_path / '0' / ('metric.log' + TIME_SUFFIX)).write_bytes(np.array([(len(line), 100.0)], dtype=TIME_DTYPE).tobytes())
+    # Irregular sampling, e.g. a slow sample after a restart
+    (tmp_path / 'ram.log').write_text(''.join(
+        json.dumps({ 'time': t, 'used': 2e9 }) + '\n' for t in (101.0, 102.0, 110.0, 111.0)
+    ))
+
+    report = Report({ 'experiments': { 'a': str(tmp_path) }, 'figures': [] }, str(tmp_path))
+    ram = report._ram(str(tmp_path))
+    times, used = ram['time'], ram['used']
+    assert list(times) == [1.0, 2.0, 10.0, 11.0]
+
+    fig, ax = plt.subplots()
+    draw_ram_line(ax, { 'ticks': 4 }, { 'a': (times, used) })
+    assert list(ax.lines[0].get_xdata()) == [1.0, 2.0, 10.0, 11.0]
+    assert list(ax.get_xticks()) == [0.0, 2.75, 5.5, 8.25, 11.0]
+    plt.close(fig)
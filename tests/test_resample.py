@@ -0,0 +1,20 @@
+import numpy as np
+
+from resample import align
+
+def test_align_empty_member():
+    grid, data = align({
+        '0': (np.array([0.0, 1.0, 2.0]), np.array([1.0, 2.0, 3.0])),
+        '1': (np.zeros(0), np.zeros(0)),
+    }, 1.0)
+    assert list(grid) == [0.0, 1.0, 2.0]
+    assert list(data['0']) == [1.0, 2.0, 3.0]
+    assert np.isnan(data['1']).all() and data['1'].shape == grid.shape
+
+def test_align_all_empty():
+    grid, data = align({ '0': (np.zeros(0), np.zeros(0)) }, 1.0)
+    assert len(grid) == 0
+    assert len(data['0']) == 0
+
+    grid, data = align({}, 1.0)
+    assert len(grid) == 0 and data == {}
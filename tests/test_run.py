@@ -0,0 +1,13 @@
+import pytest
+
+from run import launch_terminal
+
+def test_terminal_exits_without_listening(tmp_path, monkeypatch):
+    # A terminal that opens the ready FIFO and dies before it reports
+    terminal = tmp_path / 'gnome-terminal'
+    terminal.write_text('#!/bin/sh\nwhile [ "$1" != "--ready" ]; do shift; done\n: > "$2"\n')
+    terminal.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{tmp_path}:/usr/bin:/bin")
+
+    with pytest.raises(RuntimeError, match='Normal world terminal exited'):
+        launch_terminal(f"unix:{tmp_path / 'normal.sock'}", "Normal world", timeout=5)